@@ -1,8 +1,11 @@
 from dotenv import load_dotenv
 from embeddings import (
-    generate_embeddings
+    generate_embeddings,
+    generate_embeddings_batch
 )
 
+import hashlib
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import numpy as np
 from datetime import datetime
 
@@ -11,7 +14,10 @@ from functions import (
     get_service_management_client,
     get_models,
     get_db_client, 
-    get_document_url
+    get_document_url,
+    get_search_index,
+    get_lexical_index,
+    get_query_typeahead
 )
 
 from document_parser import (
@@ -24,111 +30,274 @@ from document_processor_subclasses import (
 
 from embeddings import convert_chunks_to_json
 
+from collection_search import (
+    CollectionScan,
+    cosine_similarity,
+    build_search_filter,
+    scan_collection,
+    search_collection,
+    search_collection_hierarchical
+)
+
+from lexical_index import reciprocal_rank_fusion
+
+from near_duplicates import (
+    SimHashIndex,
+    collapse_duplicates,
+    compute_simhash,
+    format_simhash,
+    get_body_words,
+    get_simhash_bands
+)
+
+from cache import (
+    LRUCache,
+    GenerationalCache,
+    SemanticAnswerCache
+)
+
+from singleflight import SingleFlight
+
+from recall_monitor import RecallMonitor
+
+from search_trace import (
+    tracing,
+    trace_detail,
+    trace_stage
+)
+
+from index_events import (
+    corpus_events,
+    corpus_generation
+)
+
+from constants import (
+    SEARCH_BACKEND,
+    SEARCH_MODES,
+    HIERARCHICAL_SECTION_COUNT,
+    HYBRID_CANDIDATE_FACTOR,
+    QUERY_EMBEDDING_CACHE_SIZE,
+    QUERY_EMBEDDING_CACHE_TTL_SECONDS,
+    RETRIEVAL_CACHE_SIZE,
+    RETRIEVAL_CACHE_TTL_SECONDS,
+    ANSWER_CACHE_SIZE,
+    ANSWER_CACHE_SIMILARITY_THRESHOLD,
+    ANSWER_CACHE_TTL_SECONDS,
+    ADAPTIVE_MIN_EXCERPTS,
+    ADAPTIVE_MAX_EXCERPTS,
+    ADAPTIVE_MIN_SCORE,
+    ADAPTIVE_MAX_SCORE_GAP,
+    EMBEDDING_BATCH_SIZE,
+    BATCH_SEARCH_CONCURRENCY,
+    BATCH_COMPLETION_CONCURRENCY,
+    NEAR_DUPLICATE_MAX_DISTANCE,
+    NEAR_DUPLICATE_MIN_WORDS,
+    NEAR_DUPLICATE_CANDIDATE_FACTOR
+)
+
 from azure.ai.formrecognizer import DocumentAnalysisClient, AnalysisFeature, AnalyzeResult, DocumentParagraph
 from azure.core.credentials import AzureKeyCredential
 
 load_dotenv()
 
-def cosine_similarity(vec1, vec2):
-    dot_product = np.dot(vec1, vec2)
-    norm_vec1 = np.linalg.norm(vec1)
-    norm_vec2 = np.linalg.norm(vec2)
-    return dot_product / (norm_vec1 * norm_vec2)
+query_embedding_cache = LRUCache(QUERY_EMBEDDING_CACHE_SIZE, QUERY_EMBEDDING_CACHE_TTL_SECONDS)
+retrieval_cache = GenerationalCache(RETRIEVAL_CACHE_SIZE, corpus_generation.get, RETRIEVAL_CACHE_TTL_SECONDS)
+answer_cache = SemanticAnswerCache(ANSWER_CACHE_SIZE, ANSWER_CACHE_SIMILARITY_THRESHOLD, ANSWER_CACHE_TTL_SECONDS)
+corpus_events.subscribe(answer_cache)
+completion_requests = SingleFlight()
+recall_monitor = RecallMonitor()
 
+def normalize_query(query: str) -> str:
+    return " ".join(query.lower().split())
 
-def vector_search(query: str, result_count: int):
-    embeddings_model, completions_model = get_models()
-    collection = get_db_client().collection
-    open_ai_client = get_openai_client()
-    query_embedding = generate_embeddings(query, open_ai_client,
-                                          embeddings_model)
-
-    pipeline = [{
-        '$search': {
-            "cosmosSearch": {
-                "vector": query_embedding,
-                "path": "contentVector",
-                "k": result_count
-            },
-            "returnStoredSource": True
-        }
-    }, {
-        '$project': {
-            'similarityScore': {
-                '$meta': 'searchScore'
-            },
-            'document': '$$ROOT'
-        }
-    }]
-
-    # Apply search pipeline on filtered documents
-    results = list(collection.aggregate(pipeline))
-
-    response_list = []
-    for result in results:
-        response = {}
-        response['similarityScore'] = result['similarityScore']
-        response['page'] = result['document']['page']
-        response['content'] = result['document']['content']
-        response['clientName'] = result['document']['clientName']
-        response['date'] = result['document']['date']
-        response['documentName'] = result['document']['documentName']
-        response['id'] = result['document']['id']
-        response['url'] = get_document_url(
-            client_name=result['document']['clientName'][0],
-            document_name=result['document']['documentName'][0],
-            date=result['document']['date'][0],
-            page_number=result['document']['page'][0]
-        )
-        response_list.append(response)
 
-    return response_list
+def record_query(query: str):
+    # Suggested by this worker right away, persist_query makes it visible to the others on their next refresh
+    try:
+        get_query_typeahead().record(normalize_query(query), " ".join(query.split()))
+    except Exception as e:
+        print(f"ERROR: Unable to record query for typeahead: {e}")
 
 
-def vector_search_by_client(query: str, result_count: int, client_names: list = None):
-    embeddings_model, completions_model = get_models()
-    collection = get_db_client().collection
-    open_ai_client = get_openai_client()
-    query_embedding = generate_embeddings(
-        query, open_ai_client, embeddings_model)
-
-    # Pre-filter based on ClientName
-    filtered_documents = collection.find({'clientName': {'$in': client_names}})
-
-    # Calculate cosine similarity and store results
-    results = []
-    for document in filtered_documents:
-        similarity = cosine_similarity(
-            document['contentVector'], query_embedding)
-        document_with_score = document.copy()
-        document_with_score['similarityScore'] = similarity
-        results.append(document_with_score)
-
-    # Sort results based on similarity score in descending order
-    results.sort(key=lambda x: x['similarityScore'], reverse=True)
-
-    # Take the top result_count results
-    top_results = results[:result_count]
-
-    response_list = []
-    for result in top_results:
-        response = {}
-        response['similarityScore'] = result['similarityScore']
-        response['page'] = result['page']
-        response['content'] = result['content']
-        response['clientName'] = result['clientName']
-        response['date'] = result['date']
-        response['documentName'] = result['documentName']
-        response['id'] = result['id']
-        response['url'] = get_document_url(
-            client_name=result['clientName'][0],
-            document_name=result['documentName'][0],
-            date=result['date'][0],
-            page_number=result['page'][0]
-        )
-        response_list.append(response)
+def persist_query(query: str):
+    # Runs as a background task after the response is sent, nothing would report a failure
+    try:
+        get_db_client().record_query(normalize_query(query), " ".join(query.split()))
+    except Exception as e:
+        print(f"ERROR: Unable to persist query for typeahead: {e}")
+
+
+def suggest_queries(prefix: str, limit: int = 5) -> list[dict]:
+    # A trailing space means the last word is complete, "what is " should not suggest "what isin ..."
+    normalized_prefix = normalize_query(prefix)
+    if normalized_prefix and prefix[-1].isspace():
+        normalized_prefix += " "
+    return get_query_typeahead().suggest(normalized_prefix, limit) if normalized_prefix else []
+
+
+def get_query_embedding(query: str, embeddings_model: str) -> list:
+    # Repeated DDQ questions skip the embeddings round trip (and its rate limiting pause)
+    cache_key = (embeddings_model, normalize_query(query))
+    query_embedding = query_embedding_cache.get(cache_key)
+    # The completion step looks the embedding up again, the first lookup is the one worth reporting
+    trace_detail('queryEmbeddingCache', 'miss' if query_embedding is None else 'hit', overwrite=False)
+    if query_embedding is None:
+        with trace_stage('embedding'):
+            query_embedding = generate_embeddings(query, get_openai_client(), embeddings_model)
+        query_embedding_cache.set(cache_key, query_embedding)
+    return query_embedding
+
+
+def get_query_embeddings(queries: list[str], embeddings_model: str) -> list[list]:
+    # Cached embeddings are reused, the rest are requested EMBEDDING_BATCH_SIZE texts per API call
+    cache_keys = [(embeddings_model, normalize_query(query)) for query in queries]
+    query_embeddings = [query_embedding_cache.get(cache_key) for cache_key in cache_keys]
+    missing = {}
+    for index, query_embedding in enumerate(query_embeddings):
+        if query_embedding is None:
+            missing.setdefault(cache_keys[index], index)
+    missing_indices = list(missing.values())
+
+    openai_client = get_openai_client() if missing_indices else None
+    for start in range(0, len(missing_indices), EMBEDDING_BATCH_SIZE):
+        batch_indices = missing_indices[start:start + EMBEDDING_BATCH_SIZE]
+        batch_embeddings = generate_embeddings_batch([queries[index] for index in batch_indices], openai_client, embeddings_model)
+        for index, query_embedding in zip(batch_indices, batch_embeddings):
+            query_embedding_cache.set(cache_keys[index], query_embedding)
+            missing[cache_keys[index]] = query_embedding
+
+    return [query_embedding if query_embedding is not None else missing[cache_keys[index]]
+            for index, query_embedding in enumerate(query_embeddings)]
+
+
+def get_search_metrics() -> dict:
+    return {
+        'recall': recall_monitor.stats()
+    }
+
+
+def get_cache_stats() -> dict:
+    return {
+        'queryEmbeddings': query_embedding_cache.stats(),
+        'retrievalResults': {**retrieval_cache.stats(), 'corpusGeneration': corpus_generation.get()},
+        'answers': answer_cache.stats(),
+        'completionRequests': completion_requests.stats()
+    }
+
+
+def format_search_result(result: dict) -> dict:
+    response = {}
+    response['similarityScore'] = result['similarityScore']
+    response['page'] = result['page']
+    response['content'] = result['content']
+    response['clientName'] = result['clientName']
+    response['date'] = result['date']
+    response['documentName'] = result['documentName']
+    response['id'] = result['id']
+    if result.get('canonicalId'):
+        response['canonicalId'] = result['canonicalId']
+    response['url'] = get_document_url(
+        client_name=result['clientName'][0],
+        document_name=result['documentName'][0],
+        date=result['date'][0],
+        page_number=result['page'][0]
+    )
+    return response
 
-    return response_list
+
+def get_embedding_fingerprint(query_embedding: list) -> str:
+    return hashlib.sha1(np.asarray(query_embedding, dtype=np.float32).tobytes()).hexdigest()
+
+
+def vector_search(query: str, result_count: int, *, client_names: list = None, document_names: list = None, start_date: datetime = None, end_date: datetime = None, include_history: bool = False, n_probes: int = None, ef_search: int = None, shared_scan: CollectionScan = None):
+    # shared_scan: the filtered chunks already fetched for another query of the same batch, used when cosmosSearch is unavailable
+    with trace_stage('get_models'):
+        embeddings_model, completions_model = get_models()
+    query_embedding = get_query_embedding(query, embeddings_model)
+
+    cache_key = (
+        get_embedding_fingerprint(query_embedding),
+        tuple(sorted(client_names)) if client_names else None,
+        result_count,
+        tuple(sorted(document_names)) if document_names else None,
+        start_date,
+        end_date,
+        n_probes,
+        ef_search,
+        include_history
+    )
+    cached_results = retrieval_cache.get(cache_key)
+    trace_detail('retrievalCache', 'miss' if cached_results is None else 'hit')
+    if cached_results is not None:
+        return [dict(result) for result in cached_results]
+    # Read before searching so an upload finishing mid-search leaves this entry stale
+    generation = corpus_generation.get()
+
+    with trace_stage('vector_search'):
+        if SEARCH_BACKEND == "local":
+            results = get_search_index().search(
+                query_embedding, result_count, client_names=client_names, document_names=document_names,
+                start_date=start_date, end_date=end_date, ef_search=ef_search, section_count=HIERARCHICAL_SECTION_COUNT, current_only=not include_history)
+        else:
+            db_client = get_db_client()
+            search_filter = build_search_filter(client_names, document_names, start_date, end_date, current_only=not include_history)
+            if HIERARCHICAL_SECTION_COUNT and db_client.centroid_collection is not None:
+                results = search_collection_hierarchical(db_client, query_embedding, result_count, HIERARCHICAL_SECTION_COUNT, search_filter, n_probes, ef_search, shared_scan)
+            else:
+                results = search_collection(db_client.collection, query_embedding, result_count, search_filter, n_probes, ef_search, shared_scan)
+
+    def exact_search() -> list[str]:
+        # Brute force over every candidate chunk, the ground truth for the approximate search above
+        if SEARCH_BACKEND == "local":
+            exact_results = get_search_index().search(query_embedding, result_count, client_names=client_names, document_names=document_names, start_date=start_date, end_date=end_date, exact=True, current_only=not include_history)
+        else:
+            collection = get_db_client().collection
+            search_filter = build_search_filter(client_names, document_names, start_date, end_date, current_only=not include_history)
+            if shared_scan is not None and shared_scan.covers(collection, search_filter):
+                exact_results = shared_scan.search(query_embedding, result_count)
+            else:
+                exact_results = scan_collection(collection, query_embedding, result_count, search_filter)
+        return [result['id'][0] for result in exact_results]
+
+    recall_monitor.maybe_shadow([result['id'][0] for result in results], result_count, exact_search)
+
+    formatted_results = [format_search_result(result) for result in results]
+    retrieval_cache.set(cache_key, formatted_results, generation)
+    return [dict(result) for result in formatted_results]
+
+
+def lexical_search(query: str, result_count: int, *, client_names: list = None, document_names: list = None, start_date: datetime = None, end_date: datetime = None, include_history: bool = False):
+    # BM25 over chunk content, no embedding round trip
+    with trace_stage('lexical_search'):
+        results = get_lexical_index().search(query, result_count, client_names=client_names, document_names=document_names, start_date=start_date, end_date=end_date, current_only=not include_history)
+    return [format_search_result(result) for result in results]
+
+
+def hybrid_search(query: str, result_count: int, *, client_names: list = None, document_names: list = None, start_date: datetime = None, end_date: datetime = None, include_history: bool = False, n_probes: int = None, ef_search: int = None):
+    candidate_count = result_count * HYBRID_CANDIDATE_FACTOR
+    vector_results = vector_search(query, candidate_count, client_names=client_names, document_names=document_names, start_date=start_date, end_date=end_date, include_history=include_history, n_probes=n_probes, ef_search=ef_search)
+    lexical_results = lexical_search(query, candidate_count, client_names=client_names, document_names=document_names, start_date=start_date, end_date=end_date, include_history=include_history)
+    return reciprocal_rank_fusion([vector_results, lexical_results], result_count)
+
+
+def search(query: str, result_count: int, *, client_names: list = None, document_names: list = None, start_date: datetime = None, end_date: datetime = None, include_history: bool = False, search_mode: str = "vector", n_probes: int = None, ef_search: int = None):
+    # Older uploads of a document are superseded by the newest one unless include_history is set.
+    # Extra candidates are fetched so that near-duplicates collapsed into one result still leave result_count
+    candidate_count = result_count * max(NEAR_DUPLICATE_CANDIDATE_FACTOR, 1)
+    if search_mode == "lexical":
+        return collapse_duplicates(lexical_search(query, candidate_count, client_names=client_names, document_names=document_names, start_date=start_date, end_date=end_date, include_history=include_history), result_count)
+    if search_mode == "hybrid":
+        return collapse_duplicates(hybrid_search(query, candidate_count, client_names=client_names, document_names=document_names, start_date=start_date, end_date=end_date, include_history=include_history, n_probes=n_probes, ef_search=ef_search), result_count)
+    if search_mode == "vector":
+        return collapse_duplicates(vector_search(query, candidate_count, client_names=client_names, document_names=document_names, start_date=start_date, end_date=end_date, include_history=include_history, n_probes=n_probes, ef_search=ef_search), result_count)
+    raise ValueError(f"Unsupported search mode '{search_mode}', expecting one of {', '.join(SEARCH_MODES)}")
+
+
+def get_related_excerpts(chunk_id: str, result_count: int = 5, include_history: bool = False) -> list[dict]:
+    # Precomputed neighbours of an excerpt, no embedding call or vector search. Near-duplicates of one
+    # another are collapsed like search results, keeping the closest of each group
+    related_chunks = get_db_client().find_related_chunks(chunk_id, include_history)
+    return collapse_duplicates([format_search_result(result) for result in related_chunks], result_count)
 
 
 def get_distinct_client_names():
@@ -176,13 +345,100 @@ def get_distinct_client_document_date_combinations():
     return distinct_combinations
 
 
-def generate_completion(query: str, result_count: int, client_names: list = None, word_limit: int = 300):
-    client_names = client_names[0].split(',')
-    if (len(client_names) == len(get_distinct_client_names())):
-        response_list = vector_search(query, result_count)
-    else:
-        response_list = vector_search_by_client(query, result_count, client_names)
+def parse_date_range(start_date: str = None, end_date: str = None) -> tuple[datetime, datetime]:
+    # Same YYYY-MM-DD format as the upload form, both ends inclusive
+    start_date = datetime.strptime(start_date, "%Y-%m-%d") if start_date else None
+    end_date = datetime.strptime(end_date, "%Y-%m-%d") if end_date else None
+    if start_date is not None and end_date is not None and start_date > end_date:
+        raise ValueError(f"start_date {start_date:%Y-%m-%d} is after end_date {end_date:%Y-%m-%d}")
+    return start_date, end_date
+
+
+def parse_names(names: list[str] = None) -> list[str]:
+    # Every entry may hold several comma separated names, e.g. ?client_names=A,B or ["A,B", "C"] in a request body
+    names = [name for value in names or [] for name in value.split(',') if name]
+    return names or None
+
+
+def retrieve_excerpts(query: str, result_count: int, *, client_names: list = None, document_names: list = None, start_date: datetime = None, end_date: datetime = None, include_history: bool = False, search_mode: str = "vector", n_probes: int = None, ef_search: int = None):
+    # Ranked excerpts and page links only, without waiting on the chat completion
+    client_names = parse_names(client_names)
+    document_names = parse_names(document_names)
+    return search(query, result_count, client_names=client_names, document_names=document_names, start_date=start_date, end_date=end_date, include_history=include_history, search_mode=search_mode, n_probes=n_probes, ef_search=ef_search)
+
+
+def explain_search(query: str, result_count: int, *, client_names: list = None, document_names: list = None, start_date: datetime = None, end_date: datetime = None, include_history: bool = False, search_mode: str = "vector", n_probes: int = None, ef_search: int = None, word_limit: int = 300, adaptive: bool = False, retrieval_only: bool = False) -> dict:
+    '''
+    The /search response plus a diagnostic block. Runs outside the single-flight layer so the
+    timings describe this request rather than one it was coalesced with.
+    '''
+    with tracing() as trace:
+        trace_detail('searchMode', search_mode)
+        trace_detail('searchBackend', SEARCH_BACKEND)
+        trace_detail('filters', {'documentNames': document_names, 'startDate': start_date, 'endDate': end_date, 'includeHistory': include_history})
+        with trace_stage('total'):
+            if retrieval_only:
+                response, results = None, retrieve_excerpts(query, result_count, client_names=client_names, document_names=document_names, start_date=start_date, end_date=end_date, include_history=include_history, search_mode=search_mode, n_probes=n_probes, ef_search=ef_search)
+            else:
+                parsed_client_names = parse_names(client_names)
+                parsed_document_names = parse_names(document_names)
+                response, results = compute_completion(query, result_count, client_names=parsed_client_names, document_names=parsed_document_names, start_date=start_date, end_date=end_date, include_history=include_history, search_mode=search_mode, n_probes=n_probes, ef_search=ef_search, word_limit=word_limit, adaptive=adaptive)
+    return {
+        "response": response,
+        "results": results,
+        "explain": trace.to_dict()
+    }
+
+
+def select_excerpts(response_list: list[dict],
+                    min_count: int = ADAPTIVE_MIN_EXCERPTS,
+                    max_count: int = ADAPTIVE_MAX_EXCERPTS,
+                    min_score: float = ADAPTIVE_MIN_SCORE,
+                    max_score_gap: float = ADAPTIVE_MAX_SCORE_GAP) -> list[dict]:
+    '''
+    Keep the leading excerpts until the cosine score falls below min_score or drops by more than
+    max_score_gap from the previous excerpt, never fewer than min_count or more than max_count.
+    '''
+    selected = []
+    for item in response_list[:max_count]:
+        if len(selected) >= min_count:
+            score = item['similarityScore']
+            if score < min_score or selected[-1]['similarityScore'] - score > max_score_gap:
+                break
+        selected.append(item)
+    return selected
+
+
+def generate_completion(query: str, result_count: int, *, client_names: list = None, document_names: list = None, start_date: datetime = None, end_date: datetime = None, include_history: bool = False, search_mode: str = "vector", n_probes: int = None, ef_search: int = None, word_limit: int = 300, adaptive: bool = False):
+    client_names = parse_names(client_names)
+    document_names = parse_names(document_names)
+    # Identical requests arriving together (e.g. several analysts opening the same questionnaire) share one computation
+    request_key = (
+        normalize_query(query),
+        result_count,
+        tuple(sorted(client_names)) if client_names else None,
+        tuple(sorted(document_names)) if document_names else None,
+        start_date,
+        end_date,
+        include_history,
+        search_mode,
+        n_probes,
+        ef_search,
+        word_limit,
+        adaptive
+    )
+    return completion_requests.do(request_key, compute_completion, query, result_count, client_names=client_names, document_names=document_names, start_date=start_date, end_date=end_date, include_history=include_history, search_mode=search_mode, n_probes=n_probes, ef_search=ef_search, word_limit=word_limit, adaptive=adaptive)
+
 
+def compute_completion(query: str, result_count: int, *, client_names: list = None, document_names: list = None, start_date: datetime = None, end_date: datetime = None, include_history: bool = False, search_mode: str = "vector", n_probes: int = None, ef_search: int = None, word_limit: int = 300, adaptive: bool = False):
+    response_list = search(query, result_count, client_names=client_names, document_names=document_names, start_date=start_date, end_date=end_date, include_history=include_history, search_mode=search_mode, n_probes=n_probes, ef_search=ef_search)
+    # Cut-offs are cosine scores, rank fusion and BM25 scores are on other scales
+    if adaptive and search_mode == "vector":
+        response_list = select_excerpts(response_list)
+    return (answer_from_excerpts(query, response_list, word_limit, search_mode), response_list[:result_count])
+
+
+def answer_from_excerpts(query: str, response_list: list[dict], word_limit: int = 300, search_mode: str = "vector") -> str:
     system_prompt = f'''
     Your are a financial advisor for a real estate investment fund called REIIF.
     Your purpose is to confidently answer due diligence queries about REIIF.
@@ -201,15 +457,84 @@ def generate_completion(query: str, result_count: int, client_names: list = None
     for index, item in enumerate(response_list):
         messages.append({"role": "system", "content": f"REIIF Documents Excerpt {index}: {item['content'][0]}"})
 
-    embeddings_model, completions_model = get_models()
+    with trace_stage('get_models'):
+        embeddings_model, completions_model = get_models()
+
+    # Completions run at temperature 0, so the same question over the same excerpts gets the same answer.
+    # Lexical searches never embed the query and are not cached.
+    query_embedding = get_query_embedding(query, embeddings_model) if search_mode != "lexical" else None
+    chunk_ids = [item['id'][0] for item in response_list]
+    if query_embedding is not None:
+        cached_answer = answer_cache.get(query_embedding, chunk_ids, word_limit, completions_model)
+        trace_detail('answerCache', 'miss' if cached_answer is None else 'hit')
+        if cached_answer is not None:
+            return cached_answer
 
+    trace_detail('promptExcerpts', len(response_list))
     openai_client = get_openai_client()
-    completion_response = openai_client.chat.completions.create(
-        model=completions_model,
-        messages=messages,
-        temperature=0
-    )
-    return (completion_response.choices[0].message.content, response_list[:result_count])
+    with trace_stage('completion'):
+        completion_response = openai_client.chat.completions.create(
+            model=completions_model,
+            messages=messages,
+            temperature=0
+        )
+    if getattr(completion_response, 'usage', None) is not None:
+        trace_detail('completionTokens', {
+            'prompt': completion_response.usage.prompt_tokens,
+            'completion': completion_response.usage.completion_tokens
+        })
+    answer = completion_response.choices[0].message.content
+    if query_embedding is not None:
+        answer_cache.set(query_embedding, chunk_ids, word_limit, completions_model, answer)
+    return answer
+
+
+def answer_questionnaire(questions: list[str], result_count: int, *, client_names: list = None, document_names: list = None, start_date: datetime = None, end_date: datetime = None, include_history: bool = False, word_limit: int = 300, retrieval_only: bool = False):
+    '''
+    Answer a whole questionnaire: embed the questions in batches, retrieve the excerpts of every question,
+    then run the completions with bounded parallelism. With the local backend the questions are scored
+    against the worker's index with matrix-matrix products; with Cosmos DB each question is one vector
+    search, run concurrently, so no in-process index is built for a backend that does not use one.
+    Yields one result per question as soon as it is ready, so the order follows completion, not input.
+    '''
+    client_names = parse_names(client_names)
+    document_names = parse_names(document_names)
+    embeddings_model, completions_model = get_models()
+    query_embeddings = get_query_embeddings(questions, embeddings_model)
+    candidate_count = result_count * max(NEAR_DUPLICATE_CANDIDATE_FACTOR, 1)
+    if SEARCH_BACKEND == "local":
+        search_results = get_search_index().search_many(query_embeddings, candidate_count, client_names=client_names, document_names=document_names, start_date=start_date, end_date=end_date, current_only=not include_history)
+        response_lists = [collapse_duplicates([format_search_result(result) for result in results], result_count) for results in search_results]
+    else:
+        # The embeddings were just cached, vector_search only runs the search. Where cosmosSearch is unavailable
+        # the filtered chunks are fetched once for the whole batch instead of once per question
+        shared_scan = CollectionScan(get_db_client().collection, build_search_filter(client_names, document_names, start_date, end_date, current_only=not include_history))
+        with ThreadPoolExecutor(max_workers=BATCH_SEARCH_CONCURRENCY, thread_name_prefix="batch-search") as search_executor:
+            search_results = list(search_executor.map(
+                lambda question: vector_search(question, candidate_count, client_names=client_names, document_names=document_names, start_date=start_date, end_date=end_date, include_history=include_history, shared_scan=shared_scan),
+                questions))
+        response_lists = [collapse_duplicates(results, result_count) for results in search_results]
+
+    if retrieval_only:
+        for index, (question, response_list) in enumerate(zip(questions, response_lists)):
+            yield {"index": index, "query": question, "response": None, "results": response_list}
+        return
+
+    executor = ThreadPoolExecutor(max_workers=BATCH_COMPLETION_CONCURRENCY, thread_name_prefix="batch-completion")
+    try:
+        futures = {
+            executor.submit(answer_from_excerpts, question, response_list, word_limit): index
+            for index, (question, response_list) in enumerate(zip(questions, response_lists))
+        }
+        for future in as_completed(futures):
+            index = futures[future]
+            try:
+                yield {"index": index, "query": questions[index], "response": future.result(), "results": response_lists[index]}
+            except Exception as e:
+                yield {"index": index, "query": questions[index], "Message": f"Error fetching response: {e}"}
+    finally:
+        # A client that disconnects mid-stream should not keep completions queued
+        executor.shutdown(wait=False, cancel_futures=True)
 
 
 def get_parsed_pdf(file_content: bytes, endpoint: str, api_key: str) -> DocumentParser:
@@ -227,11 +552,48 @@ async def get_vectorized_chunks(document_parser: DocumentParser, filename: str,
     embedding_model, completions_model = get_models()
     client_response_processor = ClientResponseProcessor(document_parser, filename, document)
     document_flow = client_response_processor.process_document()
+    near_duplicates = find_near_duplicates(document_flow.chunks) if NEAR_DUPLICATE_MAX_DISTANCE >= 0 else None
     vectorized_chunks = await convert_chunks_to_json(
-        document_flow.chunks, openai_client, embedding_model, in_prod
+        document_flow.chunks, openai_client, embedding_model, in_prod, near_duplicates
     )
     return vectorized_chunks
 
+def find_near_duplicates(chunks: list) -> dict:
+    '''
+    SimHash signature of every chunk, plus the canonical chunk (already stored or earlier in this upload)
+    each near-duplicate repeats, with the stored canonical embedding so it does not need embedding again.
+    '''
+    signatures = {}
+    for chunk in chunks:
+        words = get_body_words(chunk.content)
+        if len(words) >= NEAR_DUPLICATE_MIN_WORDS:
+            signatures[chunk.id] = compute_simhash(words)
+
+    db_client = get_db_client()
+    simhash_index = SimHashIndex(NEAR_DUPLICATE_MAX_DISTANCE)
+    bands = sorted({band for signature in signatures.values() for band in get_simhash_bands(signature)})
+    for candidate in db_client.find_simhash_candidates(bands):
+        # A re-uploaded chunk keeps its id and is rejected as a duplicate key, not merged with itself
+        if candidate['id'][0] not in signatures:
+            simhash_index.add(candidate['id'][0], int(candidate['simHash'], 16))
+
+    near_duplicates = {}
+    for chunk_id, signature in signatures.items():
+        near_duplicates[chunk_id] = {'simHash': format_simhash(signature), 'simHashBands': get_simhash_bands(signature)}
+        canonical_id = simhash_index.find(signature)
+        if canonical_id is None:
+            simhash_index.add(chunk_id, signature)
+        else:
+            near_duplicates[chunk_id]['canonicalId'] = canonical_id
+
+    stored_canonical_ids = list({entry['canonicalId'] for entry in near_duplicates.values() if entry.get('canonicalId') and entry['canonicalId'] not in signatures})
+    content_vectors = db_client.find_content_vectors(stored_canonical_ids) if stored_canonical_ids else {}
+    for entry in near_duplicates.values():
+        if entry.get('canonicalId') in content_vectors:
+            entry['contentVector'] = content_vectors[entry['canonicalId']]
+    print(f"{sum('canonicalId' in entry for entry in near_duplicates.values())} of {len(chunks)} chunks are near-duplicates")
+    return near_duplicates
+
 def add_documents_to_db(vectorized_chunks) -> bool:
     try:
         db_client = get_db_client()
@@ -1,34 +1,48 @@
 from typing import Union
-from fastapi import FastAPI, Query, UploadFile, Form, HTTPException, File, Request
+from fastapi import FastAPI, Query, UploadFile, Form, HTTPException, File, Request, Body, BackgroundTasks
 from fastapi.staticfiles import StaticFiles
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import JSONResponse
 from fastapi.responses import FileResponse
+from fastapi.responses import StreamingResponse
 from docx import Document
 from docx.document import Document as DocumentType
 
 from io import BytesIO
 import os
+import json
 
 from api_methods import (
     generate_completion,
+    retrieve_excerpts,
+    answer_questionnaire,
+    explain_search,
+    get_related_excerpts,
+    record_query,
+    persist_query,
+    suggest_queries,
+    parse_date_range,
     get_distinct_client_names,
     get_distinct_client_document_date_combinations,
     get_parsed_pdf,
     get_vectorized_chunks,
-    add_documents_to_db
+    add_documents_to_db,
+    get_cache_stats,
+    get_search_metrics
 )
 
 from functions import (
     create_pdf_and_upload_to_sharepoint,
     delete_documents_from_sharepoint,
     get_db_client,
-    get_document_url
+    get_document_url,
+    get_search_index,
+    start_corpus_event_poller
 )
 
 from datetime import datetime
 
-from constants import SHAREPOINT_BASE_URL, DI_ENDPOINT, DI_API_KEY
+from constants import SHAREPOINT_BASE_URL, DI_ENDPOINT, DI_API_KEY, SEARCH_BACKEND
 
 app = FastAPI()
 
@@ -43,23 +57,126 @@ app = FastAPI()
 #     allow_headers=["*"],  # Allows all headers
 # )
 
+@app.on_event("startup")
+def start_corpus_events():
+    # Each worker follows uploads and deletes made by the others from its first request on
+    try:
+        start_corpus_event_poller()
+    except Exception as e:
+        print(f"ERROR: Unable to start corpus event poller: {e}")
+
+@app.on_event("startup")
+def create_query_indices():
+    # Typeahead reads the most asked queries, sorted on the count index
+    try:
+        get_db_client().create_query_indices()
+    except Exception as e:
+        print(f"ERROR: Unable to create query indexes: {e}")
+
+@app.on_event("startup")
+def preload_search_index():
+    # The local index is mapped from the snapshot while the worker starts, not on its first search
+    if SEARCH_BACKEND != "local":
+        return
+    try:
+        get_search_index()
+    except Exception as e:
+        print(f"ERROR: Unable to load the search index: {e}")
+
 @app.get("/search")
 def read_root(
+    background_tasks: BackgroundTasks,
     query: str = Query(None, title="Query"),
     result_count: int = Query(5, title="Result Count"),
     word_limit: int = Query(300, title="Word Limit"),
-    client_names: list[str] = Query(None, title="Client Names")
+    client_names: list[str] = Query(None, title="Client Names"),
+    search_mode: str = Query("vector", title="Search Mode"),
+    retrieval_only: bool = Query(False, title="Retrieval Only"),
+    n_probes: int = Query(None, title="IVF Lists Probed"),
+    ef_search: int = Query(None, title="HNSW Search List Size"),
+    adaptive: bool = Query(False, title="Adaptive Excerpt Count"),
+    explain: bool = Query(False, title="Explain"),
+    include_history: bool = Query(False, title="Include Superseded Versions"),
+    document_names: list[str] = Query(None, title="Document Names"),
+    start_date: str = Query(None, title="Start Date (YYYY-MM-DD)"),
+    end_date: str = Query(None, title="End Date (YYYY-MM-DD)")
 ):
     try:
-        llm_response, vector_search_results = generate_completion(query, result_count, client_names, word_limit)
-        return {
-            "response": llm_response,
-            "results": vector_search_results
-        }
+        start_date, end_date = parse_date_range(start_date, end_date)
+        if explain:
+            response = explain_search(query, result_count, client_names=client_names, document_names=document_names, start_date=start_date, end_date=end_date, include_history=include_history, search_mode=search_mode, n_probes=n_probes, ef_search=ef_search, word_limit=word_limit, adaptive=adaptive, retrieval_only=retrieval_only)
+        elif retrieval_only:
+            response = {
+                "response": None,
+                "results": retrieve_excerpts(query, result_count, client_names=client_names, document_names=document_names, start_date=start_date, end_date=end_date, include_history=include_history, search_mode=search_mode, n_probes=n_probes, ef_search=ef_search)
+            }
+        else:
+            llm_response, vector_search_results = generate_completion(query, result_count, client_names=client_names, document_names=document_names, start_date=start_date, end_date=end_date, include_history=include_history, search_mode=search_mode, n_probes=n_probes, ef_search=ef_search, word_limit=word_limit, adaptive=adaptive)
+            response = {
+                "response": llm_response,
+                "results": vector_search_results
+            }
+        # Answered queries feed /typeahead, written to the database after the response is sent
+        record_query(query)
+        background_tasks.add_task(persist_query, query)
+        return response
     except Exception as e:
         return {"Message": f"Error fetching response: {e}"}
 
 
+@app.post("/search-batch")
+def search_batch(
+    questions: list[str] = Body(..., title="Questions"),
+    result_count: int = Body(5, title="Result Count"),
+    word_limit: int = Body(300, title="Word Limit"),
+    client_names: list[str] = Body(None, title="Client Names"),
+    retrieval_only: bool = Body(False, title="Retrieval Only"),
+    include_history: bool = Body(False, title="Include Superseded Versions"),
+    document_names: list[str] = Body(None, title="Document Names"),
+    start_date: str = Body(None, title="Start Date (YYYY-MM-DD)"),
+    end_date: str = Body(None, title="End Date (YYYY-MM-DD)")
+):
+    if not questions:
+        raise HTTPException(status_code=400, detail="No questions provided")
+    try:
+        start_date, end_date = parse_date_range(start_date, end_date)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"Invalid date range: {e}")
+
+    # Newline delimited JSON, one line per question as soon as its answer is ready
+    def stream_answers():
+        try:
+            for answer in answer_questionnaire(questions, result_count, client_names=client_names, document_names=document_names, start_date=start_date, end_date=end_date, include_history=include_history, word_limit=word_limit, retrieval_only=retrieval_only):
+                yield json.dumps(answer, default=str) + "\n"
+        except Exception as e:
+            yield json.dumps({"Message": f"Error answering questionnaire: {e}"}) + "\n"
+
+    return StreamingResponse(stream_answers(), media_type="application/x-ndjson")
+
+
+@app.get("/typeahead")
+def typeahead(
+    prefix: str = Query(..., title="Query Prefix"),
+    limit: int = Query(5, title="Suggestion Count")
+):
+    try:
+        return {"suggestions": suggest_queries(prefix, limit)}
+    except Exception as e:
+        return {"Message": f"Error fetching query suggestions: {e}"}
+
+
+@app.get("/related-excerpts")
+def related_excerpts(
+    chunk_id: str = Query(..., title="Chunk ID"),
+    result_count: int = Query(5, title="Result Count"),
+    include_history: bool = Query(False, title="Include Superseded Versions")
+):
+    try:
+        return {"results": get_related_excerpts(chunk_id, result_count, include_history)}
+    except Exception as e:
+        return {"Message": f"Error fetching related excerpts: {e}"}
+
+
 @app.get("/clients")
 def get_client_names():
     try:
@@ -154,6 +271,22 @@ async def delete_document(
     return JSONResponse(content={"message": f"Chunk {chunk_id} deleted successfully"}, status_code=200)
         
 
+@app.get("/cache-stats")
+def cache_stats():
+    try:
+        return get_cache_stats()
+    except Exception as e:
+        return {"Message": f"Error fetching cache statistics: {e}"}
+
+
+@app.get("/search-metrics")
+def search_metrics():
+    try:
+        return get_search_metrics()
+    except Exception as e:
+        return {"Message": f"Error fetching search metrics: {e}"}
+
+
 @app.get("/ping")
 def ping():
     return {"Message": "Healthy"}
@@ -0,0 +1,216 @@
+import argparse
+import copy
+import glob
+import json
+import os
+import time
+import tracemalloc
+
+import numpy as np
+
+from collection_search import (
+    cosine_similarity,
+    build_search_filter,
+    search_collection
+)
+
+from hnsw_index import HNSW_AVAILABLE
+
+from snapshot import read_vectorized_backups
+
+from vector_index import VectorIndex
+
+from vector_utils import (
+    normalize_vectors,
+    top_k_indices,
+    unwrap_field
+)
+
+DEFAULT_FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "data", "processed", "*", "*_parsed_vectorized.json")
+
+
+def load_corpus(fixture_pattern: str, copies: int, noise: float, rng: np.random.Generator) -> list[dict]:
+    '''
+    The *_parsed_vectorized.json fixtures, optionally grown with perturbed copies of every chunk
+    so latency can be measured on a corpus larger than the handful of checked-in documents.
+    '''
+    paths = sorted(glob.glob(fixture_pattern))
+    if not paths:
+        raise FileNotFoundError(f"No fixtures match {fixture_pattern}")
+    fixtures = read_vectorized_backups(paths)
+
+    corpus = list(fixtures)
+    for copy_number in range(1, copies):
+        for document in fixtures:
+            duplicate = copy.copy(document)
+            duplicate['id'] = [f"{unwrap_field(document['id'])}_copy{copy_number}"]
+            duplicate['contentVector'] = perturb(document['contentVector'], noise, rng).tolist()
+            corpus.append(duplicate)
+    return corpus
+
+
+def perturb(vector, noise: float, rng: np.random.Generator) -> np.ndarray:
+    # Gaussian noise scaled so that noise is roughly the relative norm of the perturbation
+    vector = np.asarray(vector, dtype=np.float64)
+    return vector + rng.normal(0, noise * np.linalg.norm(vector) / np.sqrt(vector.shape[0]), vector.shape[0])
+
+
+def build_queries(corpus: list[dict], query_file: str, query_count: int, noise: float, rng: np.random.Generator) -> list[list[float]]:
+    if query_file:
+        # Recorded query embeddings, a JSON list of vectors
+        with open(query_file, "r", encoding="utf-8") as file:
+            return json.load(file)[:query_count]
+    sources = rng.choice(len(corpus), size=query_count, replace=len(corpus) < query_count)
+    return [perturb(corpus[source]['contentVector'], noise, rng).tolist() for source in sources]
+
+
+def exact_top_ids(corpus: list[dict], queries: list, result_count: int, client_names: list = None) -> list[list[str]]:
+    candidates = [document for document in corpus if not client_names or unwrap_field(document['clientName']) in client_names]
+    matrix = normalize_vectors([document['contentVector'] for document in candidates]).astype(np.float64)
+    expected = []
+    for query in queries:
+        scores = matrix @ normalize_vectors(query).astype(np.float64)
+        expected.append([unwrap_field(candidates[index]['id']) for index in top_k_indices(scores, result_count)])
+    return expected
+
+
+def python_loop_strategy(corpus: list[dict], options: dict):
+    # The original per-client search: cosine similarity of every candidate in a Python loop, then a full sort
+    def search(query, result_count, client_names):
+        results = []
+        for document in corpus:
+            if client_names and unwrap_field(document['clientName']) not in client_names:
+                continue
+            results.append((cosine_similarity(document['contentVector'], query), unwrap_field(document['id'])))
+        results.sort(key=lambda result: result[0], reverse=True)
+        return [chunk_id for _, chunk_id in results[:result_count]]
+    return search, None, None
+
+
+def vector_index_strategy(index_options: dict, search_options: dict = None):
+    def build(corpus: list[dict], options: dict):
+        vectors_by_id = {unwrap_field(document['id']): document['contentVector'] for document in corpus}
+        vector_loader = lambda records: [vectors_by_id[unwrap_field(record['id'])] for record in records]
+        vector_index = VectorIndex.from_documents(corpus, vector_loader=vector_loader, **index_options)
+
+        def search(query, result_count, client_names):
+            results = vector_index.search(query, result_count, client_names=client_names, **(search_options or {}))
+            return [unwrap_field(result['id']) for result in results]
+        return search, vector_index.nbytes, None
+    return build
+
+
+def mongo_strategy(corpus: list[dict], options: dict):
+    # cosmosSearch aggregation when the server supports it, otherwise the same pre-filtered scan production falls back to.
+    # The scratch collection is dropped by the returned cleanup once the strategy has been measured
+    import pymongo
+    client = pymongo.MongoClient(options['mongo_uri'])
+    collection = client[options['mongo_database']][f"benchmark-{os.getpid()}"]
+
+    def cleanup():
+        collection.drop()
+        client.close()
+
+    collection.drop()
+    try:
+        collection.insert_many([copy.copy(document) for document in corpus])
+    except Exception:
+        cleanup()
+        raise
+
+    def search(query, result_count, client_names):
+        results = search_collection(collection, query, result_count, build_search_filter(client_names))
+        return [unwrap_field(result['id']) for result in results]
+    return search, None, cleanup
+
+
+def get_strategies(options: dict) -> dict:
+    strategies = {
+        'python-loop': python_loop_strategy,
+        'vectorized': vector_index_strategy({'index_kind': 'exact'}),
+        'exact-pq': vector_index_strategy({'index_kind': 'exact', 'storage': 'pq'}),
+        'two-stage-sections': vector_index_strategy({'index_kind': 'exact'}, {'section_count': options['section_count']})
+    }
+    if HNSW_AVAILABLE:
+        strategies['hnsw'] = vector_index_strategy({'index_kind': 'hnsw'})
+        strategies['hnsw-int8'] = vector_index_strategy({'index_kind': 'hnsw', 'storage': 'int8'})
+    if options.get('mongo_uri'):
+        strategies['mongo-aggregation'] = mongo_strategy
+    return strategies
+
+
+def run_strategy(build, corpus: list[dict], queries: list, expected: list[list[str]], result_count: int, client_names: list, options: dict) -> dict:
+    # build returns the search function, the index size in bytes (or None) and a cleanup callable (or None)
+    tracemalloc.start()
+    build_start = time.perf_counter()
+    search, index_bytes, cleanup = build(corpus, options)
+    build_seconds = time.perf_counter() - build_start
+    retained_bytes, peak_bytes = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    latencies = []
+    recalls = []
+    try:
+        search(queries[0], result_count, client_names)
+        for query, expected_ids in zip(queries, expected):
+            start = time.perf_counter()
+            found_ids = search(query, result_count, client_names)
+            latencies.append((time.perf_counter() - start) * 1000)
+            recalls.append(len(set(found_ids) & set(expected_ids)) / len(expected_ids) if expected_ids else 1.0)
+    finally:
+        if cleanup is not None:
+            cleanup()
+
+    return {
+        'recall': float(np.mean(recalls)),
+        'p50Ms': float(np.percentile(latencies, 50)),
+        'p99Ms': float(np.percentile(latencies, 99)),
+        'buildSeconds': build_seconds,
+        'indexMb': index_bytes / 2**20 if index_bytes is not None else None,
+        'retainedMb': retained_bytes / 2**20,
+        'peakMb': peak_bytes / 2**20
+    }
+
+
+def print_report(report: dict, result_count: int):
+    print(f"{'strategy':<20} {f'recall@{result_count}':>10} {'p50 ms':>9} {'p99 ms':>9} {'build s':>9} {'index MB':>9} {'retained MB':>12} {'peak MB':>9}")
+    for name, metrics in report.items():
+        index_mb = f"{metrics['indexMb']:.2f}" if metrics['indexMb'] is not None else "-"
+        print(f"{name:<20} {metrics['recall']:>10.3f} {metrics['p50Ms']:>9.3f} {metrics['p99Ms']:>9.3f} {metrics['buildSeconds']:>9.2f} {index_mb:>9} {metrics['retainedMb']:>12.2f} {metrics['peakMb']:>9.2f}")
+
+
+if __name__ == "__main__":
+    # Runs offline against the checked-in fixtures, e.g. python benchmark.py --copies 50 --queries 200
+    parser = argparse.ArgumentParser(description="Compare recall@k, latency and memory of the available search strategies")
+    parser.add_argument("--fixtures", default=DEFAULT_FIXTURES, help="Glob of *_parsed_vectorized.json fixtures")
+    parser.add_argument("--copies", type=int, default=1, help="Grow the corpus with perturbed copies of every fixture chunk")
+    parser.add_argument("--queries", type=int, default=100, help="Number of queries")
+    parser.add_argument("--query-file", help="JSON list of recorded query embeddings to use instead of perturbed chunks")
+    parser.add_argument("--noise", type=float, default=0.3, help="Relative norm of the perturbation applied to chunk embeddings")
+    parser.add_argument("--result-count", type=int, default=5)
+    parser.add_argument("--client-names", nargs="*", help="Restrict searches to these clients")
+    parser.add_argument("--section-count", type=int, default=8, help="Sections kept by the two-stage strategy")
+    parser.add_argument("--strategies", nargs="*", help="Subset of strategies to run")
+    parser.add_argument("--mongo-uri", help="MongoDB or Cosmos DB connection string to also benchmark the aggregation path")
+    parser.add_argument("--mongo-database", default="benchmark")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", help="Write the report as JSON to this path")
+    arguments = parser.parse_args()
+
+    rng = np.random.default_rng(arguments.seed)
+    corpus = load_corpus(arguments.fixtures, arguments.copies, arguments.noise, rng)
+    queries = build_queries(corpus, arguments.query_file, arguments.queries, arguments.noise, rng)
+    expected = exact_top_ids(corpus, queries, arguments.result_count, arguments.client_names)
+    print(f"Benchmarking {len(queries)} queries over {len(corpus)} chunks")
+
+    options = vars(arguments)
+    report = {}
+    for name, build in get_strategies(options).items():
+        if arguments.strategies and name not in arguments.strategies:
+            continue
+        report[name] = run_strategy(build, corpus, queries, expected, arguments.result_count, arguments.client_names, options)
+
+    print_report(report, arguments.result_count)
+    if arguments.output:
+        with open(arguments.output, "w", encoding="utf-8") as file:
+            json.dump({'chunks': len(corpus), 'queries': len(queries), 'resultCount': arguments.result_count, 'strategies': report}, file, indent=2)
@@ -0,0 +1,214 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable
+
+import numpy as np
+
+from vector_utils import unwrap_field
+
+_MISSING = object()
+
+
+class LRUCache:
+    '''
+    Thread-safe LRU cache with an optional per-entry time to live.
+    Expired or stale entries count as misses and are dropped when they are next looked up.
+    '''
+
+    def __init__(self, max_size: int, ttl_seconds: float = None):
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self.entries: OrderedDict = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, key, default=None, is_stale: Callable[[object], bool] = None):
+        # is_stale runs with the lock held, it must not block
+        with self.lock:
+            value, expires_at = self.entries.get(key, (_MISSING, None))
+            if value is not _MISSING and ((expires_at is not None and expires_at <= time.monotonic()) or (is_stale is not None and is_stale(value))):
+                del self.entries[key]
+                value = _MISSING
+            if value is _MISSING:
+                self.misses += 1
+                return default
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value):
+        expires_at = time.monotonic() + self.ttl_seconds if self.ttl_seconds else None
+        with self.lock:
+            self.entries[key] = (value, expires_at)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def pop(self, key, default=None):
+        with self.lock:
+            value, _ = self.entries.pop(key, (default, None))
+            return value
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def stats(self) -> dict:
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self.entries),
+                'maxSize': self.max_size,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hitRate': self.hits / lookups if lookups else 0.0
+            }
+
+
+class GenerationalCache(LRUCache):
+    '''
+    LRU cache whose entries are stamped with the corpus generation they were computed at.
+    Any upload or delete moves the generation on, so older entries read as misses.
+    '''
+
+    def __init__(self, max_size: int, get_generation: Callable[[], int], ttl_seconds: float = None):
+        super().__init__(max_size, ttl_seconds)
+        self.get_generation = get_generation
+
+    def get(self, key, default=None):
+        # Read before taking the cache lock, so no lookup ever waits on get_generation
+        generation = self.get_generation()
+        entry = super().get(key, _MISSING, lambda entry: entry[0] != generation)
+        return default if entry is _MISSING else entry[1]
+
+    def set(self, key, value, generation: int = None):
+        # Pass the generation read before computing value, so a concurrent change leaves the entry stale
+        super().set(key, (self.get_generation() if generation is None else generation, value))
+
+
+class SemanticAnswerCache:
+    '''
+    Completions keyed by (completion deployment, word limit, retrieved chunk ids) plus the query embedding.
+    Without a similarity threshold only the same embedding matches; with one, any cached query whose
+    cosine similarity reaches it reuses the answer. Entries citing a chunk that is deleted or
+    re-ingested are dropped through corpus_events, and all entries expire after ttl_seconds.
+    '''
+
+    def __init__(self, max_size: int, similarity_threshold: float = None, ttl_seconds: float = None):
+        self.max_size = max_size
+        self.similarity_threshold = similarity_threshold
+        self.ttl_seconds = ttl_seconds
+        # entry id -> (key, unit query vector, answer, expires at), in LRU order
+        self.entries: OrderedDict = OrderedDict()
+        self.entry_ids_by_key: dict[tuple, set] = {}
+        self.entry_ids_by_chunk: dict[str, set] = {}
+        self.next_entry_id = 0
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    @staticmethod
+    def make_key(chunk_ids: list[str], word_limit: int, completions_model: str) -> tuple:
+        # Chunk order is kept, it is the order of the excerpts in the prompt
+        return (completions_model, word_limit, tuple(chunk_ids))
+
+    @staticmethod
+    def to_unit_vector(query_embedding) -> np.ndarray:
+        vector = np.asarray(query_embedding, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def get(self, query_embedding, chunk_ids: list[str], word_limit: int, completions_model: str):
+        query_vector = self.to_unit_vector(query_embedding)
+        with self.lock:
+            best_entry_id, best_score = None, None
+            now = time.monotonic()
+            for entry_id in list(self.entry_ids_by_key.get(self.make_key(chunk_ids, word_limit, completions_model), ())):
+                expires_at = self.entries[entry_id][3]
+                if expires_at is not None and expires_at <= now:
+                    self.remove_entry(entry_id)
+                    continue
+                entry_vector = self.entries[entry_id][1]
+                if self.similarity_threshold is None:
+                    if np.array_equal(entry_vector, query_vector):
+                        best_entry_id = entry_id
+                        break
+                    continue
+                score = float(entry_vector @ query_vector)
+                if score >= self.similarity_threshold and (best_score is None or score > best_score):
+                    best_entry_id, best_score = entry_id, score
+
+            if best_entry_id is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(best_entry_id)
+            self.hits += 1
+            return self.entries[best_entry_id][2]
+
+    def set(self, query_embedding, chunk_ids: list[str], word_limit: int, completions_model: str, answer: str):
+        key = self.make_key(chunk_ids, word_limit, completions_model)
+        expires_at = time.monotonic() + self.ttl_seconds if self.ttl_seconds else None
+        with self.lock:
+            entry_id = self.next_entry_id
+            self.next_entry_id += 1
+            self.entries[entry_id] = (key, self.to_unit_vector(query_embedding), answer, expires_at)
+            self.entry_ids_by_key.setdefault(key, set()).add(entry_id)
+            for chunk_id in chunk_ids:
+                self.entry_ids_by_chunk.setdefault(chunk_id, set()).add(entry_id)
+            while len(self.entries) > self.max_size:
+                self.remove_entry(next(iter(self.entries)))
+                self.evictions += 1
+
+    def remove_entry(self, entry_id: int):
+        key = self.entries.pop(entry_id)[0]
+        key_entries = self.entry_ids_by_key[key]
+        key_entries.discard(entry_id)
+        if not key_entries:
+            del self.entry_ids_by_key[key]
+        for chunk_id in key[2]:
+            chunk_entries = self.entry_ids_by_chunk.get(chunk_id)
+            if chunk_entries is not None:
+                chunk_entries.discard(entry_id)
+                if not chunk_entries:
+                    del self.entry_ids_by_chunk[chunk_id]
+
+    def invalidate_chunks(self, chunk_ids):
+        with self.lock:
+            for chunk_id in chunk_ids:
+                for entry_id in list(self.entry_ids_by_chunk.get(chunk_id, ())):
+                    self.remove_entry(entry_id)
+                    self.invalidations += 1
+
+    def documents_added(self, documents: list[dict]):
+        # A chunk id that is added again has been re-ingested, answers citing the old text are stale
+        self.invalidate_chunks(unwrap_field(document['id']) for document in documents)
+
+    def documents_removed(self, chunk_ids: list[str]):
+        self.invalidate_chunks(chunk_ids)
+
+    def stats(self) -> dict:
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self.entries),
+                'maxSize': self.max_size,
+                'similarityThreshold': self.similarity_threshold,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'invalidations': self.invalidations,
+                'hitRate': self.hits / lookups if lookups else 0.0
+            }
@@ -0,0 +1,65 @@
+import re
+
+import numpy as np
+
+from vector_utils import (
+    normalize_vectors,
+    unwrap_field
+)
+
+# OMProcessor and ClientResponseProcessor stamp the heading hierarchy into every chunk
+HEADING_TAGS_PATTERN = re.compile(r"Context Heading Tags: (.*?) \| Content:")
+
+
+def get_document_key(document: dict) -> str:
+    # Chunk ids are <client_name>_<document_name>_<date>_chunk_<n>
+    return unwrap_field(document['id']).rsplit('_chunk_', 1)[0]
+
+
+def get_version_key(document: dict) -> tuple[str, str]:
+    # Uploads of the same document on different dates are versions of one another
+    return unwrap_field(document['clientName']), unwrap_field(document['documentName'])
+
+
+def get_section_name(document: dict) -> str:
+    if document.get('section'):
+        return document['section']
+    match = HEADING_TAGS_PATTERN.search(unwrap_field(document['content']) or "")
+    if match and match.group(1).strip():
+        return match.group(1).strip()
+    # Chunks parsed without a heading hierarchy are grouped by page instead
+    return f"Page {unwrap_field(document['page'])}"
+
+
+def get_section_key(document: dict) -> str:
+    return document.get('sectionKey') or f"{get_document_key(document)}|{get_section_name(document)}"
+
+
+def compute_centroids(documents: list[dict]) -> list[dict]:
+    '''
+    One centroid per document and one per section, stored in the same shape as chunks
+    (id, clientName, documentName, date, contentVector) so they share the vector index layout.
+    '''
+    groups: dict[str, list[dict]] = {}
+    for document in documents:
+        if not document.get('contentVector'):
+            continue
+        groups.setdefault(('document', get_document_key(document)), []).append(document)
+        groups.setdefault(('section', get_section_key(document)), []).append(document)
+
+    centroids = []
+    for (level, key), members in groups.items():
+        centroid_vector = normalize_vectors(normalize_vectors([member['contentVector'] for member in members]).sum(axis=0))
+        centroids.append({
+            'id': f"{level}|{key}",
+            'level': level,
+            'documentKey': get_document_key(members[0]),
+            'sectionKey': key if level == 'section' else None,
+            'section': get_section_name(members[0]) if level == 'section' else None,
+            'clientName': members[0]['clientName'],
+            'documentName': members[0]['documentName'],
+            'date': members[0]['date'],
+            'chunkCount': len(members),
+            'contentVector': centroid_vector.astype(np.float64).tolist()
+        })
+    return centroids
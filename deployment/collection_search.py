@@ -0,0 +1,145 @@
+import threading
+from datetime import datetime
+
+import bson
+import numpy as np
+from pymongo.errors import OperationFailure
+
+from vector_index import VectorIndex
+
+from search_trace import (
+    get_trace,
+    trace_append,
+    trace_count,
+    trace_detail,
+    trace_entry,
+    trace_stage
+)
+
+
+def count_transferred_bytes(documents):
+    # Only encoded again when the request is being explained
+    if get_trace() is None:
+        yield from documents
+        return
+    for document in documents:
+        trace_count('mongoDocumentsFetched', 1)
+        trace_count('mongoBytesTransferred', len(bson.encode(document)))
+        yield document
+
+
+def cosine_similarity(vec1, vec2):
+    dot_product = np.dot(vec1, vec2)
+    norm_vec1 = np.linalg.norm(vec1)
+    norm_vec2 = np.linalg.norm(vec2)
+    return dot_product / (norm_vec1 * norm_vec2)
+
+
+def build_search_filter(client_names: list = None, document_names: list = None, start_date: datetime = None, end_date: datetime = None, current_only: bool = False) -> dict:
+    search_filter = {}
+    if client_names:
+        search_filter['clientName'] = {'$in': client_names}
+    if document_names:
+        search_filter['documentName'] = {'$in': document_names}
+    if start_date or end_date:
+        date_filter = {}
+        if start_date:
+            date_filter['$gte'] = start_date
+        if end_date:
+            date_filter['$lte'] = end_date
+        search_filter['date'] = date_filter
+    if current_only:
+        # Chunks ingested before versions were tracked have no isCurrent and are treated as current
+        search_filter['isCurrent'] = {'$ne': False}
+    return search_filter
+
+
+class CollectionScan:
+    '''
+    The chunks of a collection matching one search filter, fetched and indexed on the first search and then
+    scored for every later query, e.g. all questions of a batch on a backend that cannot run cosmosSearch.
+    '''
+
+    def __init__(self, collection, search_filter: dict = None):
+        self.collection = collection
+        self.search_filter = search_filter or {}
+        self.vector_index = None
+        self.lock = threading.Lock()
+
+    def covers(self, collection, search_filter: dict = None) -> bool:
+        return collection == self.collection and (search_filter or {}) == self.search_filter
+
+    def search(self, query_embedding: list, result_count: int) -> list[dict]:
+        # Pre-filter in the database, score every candidate in one matrix-vector product
+        trace_append('searchPath', f'mongo-scan:{self.collection.name}')
+        with trace_stage('mongo_scan'):
+            with self.lock:
+                if self.vector_index is None:
+                    filtered_documents = count_transferred_bytes(self.collection.find(self.search_filter, {'_id': 0, 'relatedChunks': 0}))
+                    self.vector_index = VectorIndex.from_documents(filtered_documents)
+            return self.vector_index.search(query_embedding, result_count)
+
+
+def scan_collection(collection, query_embedding: list, result_count: int, search_filter: dict = None) -> list[dict]:
+    return CollectionScan(collection, search_filter).search(query_embedding, result_count)
+
+
+def search_collection(collection, query_embedding: list, result_count: int, search_filter: dict = None, n_probes: int = None, ef_search: int = None, shared_scan: CollectionScan = None) -> list[dict]:
+    cosmos_search = {
+        "vector": query_embedding,
+        "path": "contentVector",
+        "k": result_count
+    }
+    if search_filter:
+        cosmos_search["filter"] = search_filter
+    # nProbes applies to vector-ivf indexes, efSearch to vector-hnsw; the index defaults are used when unset
+    if n_probes:
+        cosmos_search["nProbes"] = n_probes
+    if ef_search:
+        cosmos_search["efSearch"] = ef_search
+
+    pipeline = [{
+        '$search': {
+            "cosmosSearch": cosmos_search,
+            "returnStoredSource": True
+        }
+    }, {
+        '$project': {
+            'similarityScore': {
+                '$meta': 'searchScore'
+            },
+            'document': '$$ROOT'
+        }
+    }, {
+        '$project': {
+            'document.contentVector': 0,
+            'document.relatedChunks': 0
+        }
+    }]
+
+    trace_append('searchPath', f'cosmos-search:{collection.name}')
+    trace_entry('indexParameters', collection.name, {key: value for key, value in cosmos_search.items() if key != 'vector'})
+    try:
+        with trace_stage(f'cosmos_search.{collection.name}'):
+            results = list(count_transferred_bytes(collection.aggregate(pipeline)))
+        trace_count('candidatesFetched', len(results))
+    except (OperationFailure, NotImplementedError) as e:
+        # Backend cannot run a (filtered) cosmosSearch, e.g. a local Mongo instance
+        print(f"Vector search unavailable, falling back to local scoring: {e}")
+        if shared_scan is not None and shared_scan.covers(collection, search_filter):
+            return shared_scan.search(query_embedding, result_count)
+        return scan_collection(collection, query_embedding, result_count, search_filter)
+
+    return [{**result['document'], 'similarityScore': result['similarityScore']} for result in results]
+
+
+def search_collection_hierarchical(db_client, query_embedding: list, result_count: int, section_count: int, search_filter: dict = None, n_probes: int = None, ef_search: int = None, shared_scan: CollectionScan = None) -> list[dict]:
+    # Stage one finds the closest sections among the centroids, stage two searches only their chunks
+    trace_detail('sectionCount', section_count)
+    centroid_filter = {**(search_filter or {}), 'level': 'section'}
+    sections = search_collection(db_client.centroid_collection, query_embedding, section_count, centroid_filter, n_probes, ef_search)
+    if not sections:
+        return search_collection(db_client.collection, query_embedding, result_count, search_filter, n_probes, ef_search, shared_scan)
+
+    chunk_filter = {**(search_filter or {}), 'sectionKey': {'$in': [section['sectionKey'] for section in sections]}}
+    return search_collection(db_client.collection, query_embedding, result_count, chunk_filter, n_probes, ef_search)
@@ -12,6 +12,118 @@ TARGET_PDF_PATH = "../data/raw/BakerFinancialGroup_Responses_28-02-2023.pdf"
 CONNECTION_STRING = os.environ.get("COSMOS_CONNECTION_STRING")
 DATABASE_NAME = "db-ddq-us-east-1"
 COLLECTION_NAME = "collection-ddq-knowledge-base"
+CENTROID_COLLECTION_NAME = "collection-ddq-section-centroids"
+QUERY_COLLECTION_NAME = "collection-ddq-search-queries"
+CORPUS_EVENT_COLLECTION_NAME = "collection-ddq-corpus-events"
+
+# ------------------------- Search Constants --------------------
+
+VECTOR_DIMENSIONS = 1536
+
+# Cosmos DB vector index: "vector-ivf" or "vector-hnsw" (on tiers that support it)
+COSMOS_VECTOR_INDEX_KIND = os.environ.get("COSMOS_VECTOR_INDEX_KIND", "vector-ivf")
+COSMOS_HNSW_M = int(os.environ.get("COSMOS_HNSW_M", 16))
+COSMOS_HNSW_EF_CONSTRUCTION = int(os.environ.get("COSMOS_HNSW_EF_CONSTRUCTION", 64))
+# An IVF index is rebuilt once its numLists is this many times off the value for the current document count
+NUM_LISTS_DRIFT_RATIO = float(os.environ.get("NUM_LISTS_DRIFT_RATIO", 2.0))
+
+# "cosmos" runs vector search in the database, "local" uses the in-process index
+SEARCH_BACKEND = os.environ.get("SEARCH_BACKEND", "cosmos")
+# "exact" scans each partition with one matrix-vector product. "hnsw" adds an hnswlib graph per partition
+# (optional dependency, pip install hnswlib), worth it once partitions reach tens of thousands of rows
+LOCAL_INDEX_KIND = os.environ.get("LOCAL_INDEX_KIND", "exact")
+HNSW_M = int(os.environ.get("HNSW_M", 16))
+HNSW_EF_CONSTRUCTION = int(os.environ.get("HNSW_EF_CONSTRUCTION", 200))
+HNSW_EF_SEARCH = int(os.environ.get("HNSW_EF_SEARCH", 64))
+
+# "float32", "int8" (4x smaller) or "pq" (product quantization, dimensions / PQ_SUBSPACES bytes per vector)
+LOCAL_INDEX_STORAGE = os.environ.get("LOCAL_INDEX_STORAGE", "float32")
+LOCAL_INDEX_RESCORE = os.environ.get("LOCAL_INDEX_RESCORE", "true").lower() == "true"
+RESCORE_FACTOR = 4
+PQ_SUBSPACES = int(os.environ.get("PQ_SUBSPACES", 384))
+PQ_CENTROIDS = 256
+PQ_TRAINING_ITERATIONS = 15
+# Quantizers (int8 scale, PQ codebooks) are refitted on a sample of at most QUANTIZER_TRAINING_SAMPLE vectors
+# whenever a partition is compacted or has grown QUANTIZER_RETRAIN_GROWTH times since it was last fitted
+QUANTIZER_TRAINING_SAMPLE = int(os.environ.get("QUANTIZER_TRAINING_SAMPLE", 20000))
+QUANTIZER_RETRAIN_GROWTH = float(os.environ.get("QUANTIZER_RETRAIN_GROWTH", 2))
+
+# Two-stage search: rank section centroids first, then score only the chunks of the best sections (0 disables)
+HIERARCHICAL_SECTION_COUNT = int(os.environ.get("HIERARCHICAL_SECTION_COUNT", 0))
+
+# Partitions are scored on SEARCH_WORKERS threads once a query spans at least PARALLEL_SEARCH_MIN_ROWS rows.
+# Only the NumPy scans fan out (exact, quantized and two-stage, the default path): their matrix products release
+# the GIL. HNSW graph walks stay on the request thread, a filtered hnswlib walk calls back into Python per row
+SEARCH_WORKERS = int(os.environ.get("SEARCH_WORKERS", os.cpu_count() or 1))
+PARALLEL_SEARCH_MIN_ROWS = int(os.environ.get("PARALLEL_SEARCH_MIN_ROWS", 10000))
+
+# /search modes: "vector", "lexical" (BM25 only, no embedding call) or "hybrid" (reciprocal-rank fusion of both)
+SEARCH_MODES = ("vector", "lexical", "hybrid")
+BM25_K1 = 1.2
+BM25_B = 0.75
+RRF_K = 60
+# Each ranking fused in hybrid mode contributes result_count * HYBRID_CANDIDATE_FACTOR candidates
+HYBRID_CANDIDATE_FACTOR = 4
+
+# Query embeddings are cached per normalized query text and embedding deployment
+QUERY_EMBEDDING_CACHE_SIZE = int(os.environ.get("QUERY_EMBEDDING_CACHE_SIZE", 1024))
+QUERY_EMBEDDING_CACHE_TTL_SECONDS = int(os.environ.get("QUERY_EMBEDDING_CACHE_TTL_SECONDS", 24 * 60 * 60))
+
+# Ranked search results per (query embedding, clients, result count, filters), dropped after any upload or delete
+# in any worker, and in any case after RETRIEVAL_CACHE_TTL_SECONDS
+RETRIEVAL_CACHE_SIZE = int(os.environ.get("RETRIEVAL_CACHE_SIZE", 1024))
+RETRIEVAL_CACHE_TTL_SECONDS = int(os.environ.get("RETRIEVAL_CACHE_TTL_SECONDS", 10 * 60))
+
+# Completions per (query embedding, retrieved chunks, word limit, deployment). With a similarity threshold,
+# e.g. 0.98, near-identical phrasings that retrieve the same chunks share an answer
+ANSWER_CACHE_SIZE = int(os.environ.get("ANSWER_CACHE_SIZE", 512))
+ANSWER_CACHE_SIMILARITY_THRESHOLD = float(os.environ["ANSWER_CACHE_SIMILARITY_THRESHOLD"]) if os.environ.get("ANSWER_CACHE_SIMILARITY_THRESHOLD") else None
+ANSWER_CACHE_TTL_SECONDS = int(os.environ.get("ANSWER_CACHE_TTL_SECONDS", 60 * 60))
+
+# Adaptive excerpt selection: after the first ADAPTIVE_MIN_EXCERPTS, stop at the first vector search score
+# below ADAPTIVE_MIN_SCORE or ADAPTIVE_MAX_SCORE_GAP under the previous excerpt, at most ADAPTIVE_MAX_EXCERPTS
+ADAPTIVE_MIN_EXCERPTS = int(os.environ.get("ADAPTIVE_MIN_EXCERPTS", 1))
+ADAPTIVE_MAX_EXCERPTS = int(os.environ.get("ADAPTIVE_MAX_EXCERPTS", 10))
+ADAPTIVE_MIN_SCORE = float(os.environ.get("ADAPTIVE_MIN_SCORE", 0.75))
+ADAPTIVE_MAX_SCORE_GAP = float(os.environ.get("ADAPTIVE_MAX_SCORE_GAP", 0.05))
+
+# Batch questionnaires: texts per embeddings API call, questions searched concurrently against Cosmos DB
+# and completions run concurrently
+EMBEDDING_BATCH_SIZE = int(os.environ.get("EMBEDDING_BATCH_SIZE", 16))
+BATCH_SEARCH_CONCURRENCY = int(os.environ.get("BATCH_SEARCH_CONCURRENCY", 4))
+BATCH_COMPLETION_CONCURRENCY = int(os.environ.get("BATCH_COMPLETION_CONCURRENCY", 8))
+
+# Fraction of vector searches shadowed by an exact search to measure recall@k of the served results. Off by
+# default on Cosmos DB, where the exact search fetches every filtered chunk from the collection
+RECALL_SAMPLE_RATE = float(os.environ.get("RECALL_SAMPLE_RATE", 0.01 if SEARCH_BACKEND == "local" else 0))
+RECALL_WINDOW_SIZE = int(os.environ.get("RECALL_WINDOW_SIZE", 1000))
+RECALL_ALERT_THRESHOLD = float(os.environ.get("RECALL_ALERT_THRESHOLD", 0.9))
+
+# Uploaded chunks whose SimHash is within NEAR_DUPLICATE_MAX_DISTANCE bits (at most 3) of a stored chunk reuse its
+# embedding and are collapsed into one result per group, fetching NEAR_DUPLICATE_CANDIDATE_FACTOR times the
+# requested results first (negative distance disables). Chunks under NEAR_DUPLICATE_MIN_WORDS words are never merged
+NEAR_DUPLICATE_MAX_DISTANCE = int(os.environ.get("NEAR_DUPLICATE_MAX_DISTANCE", 3))
+NEAR_DUPLICATE_MIN_WORDS = int(os.environ.get("NEAR_DUPLICATE_MIN_WORDS", 20))
+NEAR_DUPLICATE_CANDIDATE_FACTOR = int(os.environ.get("NEAR_DUPLICATE_CANDIDATE_FACTOR", 2))
+
+# Every worker process polls the shared log of uploads and deletes this often to update its in-memory
+# indexes and caches, and the corpus generation stamped on cached search results; log entries expire
+# after CORPUS_EVENT_RETENTION_SECONDS
+CORPUS_EVENT_POLL_SECONDS = float(os.environ.get("CORPUS_EVENT_POLL_SECONDS", 2))
+CORPUS_EVENT_RETENTION_SECONDS = int(os.environ.get("CORPUS_EVENT_RETENTION_SECONDS", 24 * 60 * 60))
+
+# Typeahead over previously submitted /search queries: most distinct queries kept, and how often each
+# worker reloads the counts recorded by every worker
+TYPEAHEAD_MAX_QUERIES = int(os.environ.get("TYPEAHEAD_MAX_QUERIES", 10000))
+TYPEAHEAD_REFRESH_SECONDS = int(os.environ.get("TYPEAHEAD_REFRESH_SECONDS", 300))
+
+# Neighbours precomputed per chunk for /related-excerpts, refreshed in the background on upload and delete (0 disables).
+# Existing chunks among the RELATED_CHUNK_CANDIDATE_FACTOR * RELATED_CHUNK_COUNT nearest of an uploaded chunk are rechecked
+RELATED_CHUNK_COUNT = int(os.environ.get("RELATED_CHUNK_COUNT", 10))
+RELATED_CHUNK_CANDIDATE_FACTOR = int(os.environ.get("RELATED_CHUNK_CANDIDATE_FACTOR", 3))
+
+# Directory of the memory-mapped vector snapshot shared by all workers, unset to build from the collection
+SNAPSHOT_DIRECTORY = os.environ.get("SNAPSHOT_DIRECTORY")
 
 # ------------------------- OpenAI Constants --------------------
 
@@ -1,14 +1,76 @@
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import numpy as np
 import pymongo
+from pymongo import UpdateOne
 from pymongo.errors import DuplicateKeyError
 
+from constants import (
+    VECTOR_DIMENSIONS,
+    COSMOS_VECTOR_INDEX_KIND,
+    COSMOS_HNSW_M,
+    COSMOS_HNSW_EF_CONSTRUCTION,
+    NUM_LISTS_DRIFT_RATIO,
+    CORPUS_EVENT_RETENTION_SECONDS,
+    RELATED_CHUNK_COUNT,
+    RELATED_CHUNK_CANDIDATE_FACTOR,
+    BATCH_SEARCH_CONCURRENCY
+)
+
+from index_events import (
+    corpus_events,
+    get_process_id
+)
+
+from centroids import (
+    compute_centroids,
+    get_document_key,
+    get_section_key,
+    get_version_key
+)
+
+from related_chunks import (
+    compute_neighbours,
+    find_affected_rows,
+    get_duplicate_group,
+    load_neighbour_matrix,
+    merge_new_neighbours
+)
+
+from collection_search import search_collection
+
+# Fields read to score a chunk's neighbours and tell which version and near-duplicate group they belong to
+NEIGHBOUR_PROJECTION = {'_id': 0, 'id': 1, 'clientName': 1, 'documentName': 1, 'canonicalId': 1, 'contentVector': 1}
+
+# Neighbour lists are refreshed one upload or delete at a time, after the request that made it has returned
+_related_chunks_executor: ThreadPoolExecutor = None
+_related_chunks_executor_lock = threading.Lock()
+
+
+def get_related_chunks_executor() -> ThreadPoolExecutor:
+    global _related_chunks_executor
+    with _related_chunks_executor_lock:
+        if _related_chunks_executor is None:
+            _related_chunks_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="related-chunks")
+    return _related_chunks_executor
+
 
 class DatabaseClient:
 
-    def __init__(self, connection_string, database_name, collection_name):
+    def __init__(self, connection_string, database_name, collection_name, centroid_collection_name=None, query_collection_name=None, event_collection_name=None):
         self.client = pymongo.MongoClient(connection_string)
         self.collection_name = collection_name
         self.db = self.client[database_name]
         self.collection = self.db[collection_name]
+        # Document and section centroids for two-stage search, kept in step with the chunks
+        self.centroid_collection = self.db[centroid_collection_name] if centroid_collection_name else None
+        # Submitted search queries and how often each was asked, for typeahead
+        self.query_collection = self.db[query_collection_name] if query_collection_name else None
+        # Log of uploads and deletes replayed by the other worker processes, see CorpusEventPoller
+        self.event_collection = self.db[event_collection_name] if event_collection_name else None
 
     def setup_collection(self, collection_name=""):
         collection_name = collection_name if collection_name else self.collection_name
@@ -21,40 +83,57 @@ class DatabaseClient:
 
         return self.db[collection_name]
 
-    def create_indices(self,
-                       collection=None,
-                       vector_index_name="VectorSearchIndex"):
-        collection = collection if collection else self.collection
-        vector_index_exists = False
+    @staticmethod
+    def compute_num_lists(document_count: int) -> int:
+        # Set numLists based on document count as recommended by Microsoft's best practices
+        return max(1, int(document_count /
+                          1000)) if document_count <= 1000000 else int(
+                              document_count**0.5)
+
+    def get_vector_index_options(self, collection, kind: str = COSMOS_VECTOR_INDEX_KIND) -> dict:
+        options = {
+            'kind': kind,
+            'similarity': 'COS',
+            'dimensions': VECTOR_DIMENSIONS,
+        }
+        if kind == 'vector-ivf':
+            options['numLists'] = self.compute_num_lists(collection.count_documents({}))
+        elif kind == 'vector-hnsw':
+            options['m'] = COSMOS_HNSW_M
+            options['efConstruction'] = COSMOS_HNSW_EF_CONSTRUCTION
+        else:
+            raise ValueError(f"Unsupported vector index kind '{kind}', expecting 'vector-ivf' or 'vector-hnsw'")
+        return options
+
+    def get_vector_index(self, collection=None, vector_index_name="VectorSearchIndex") -> dict:
+        collection = collection if collection is not None else self.collection
         for index in collection.list_indexes():
             if index['name'] == vector_index_name:
-                vector_index_exists = True
+                return index
+        return None
 
-        document_count = collection.count_documents({})
+    def create_vector_index(self, collection, vector_index_name: str, kind: str = COSMOS_VECTOR_INDEX_KIND):
+        options = self.get_vector_index_options(collection, kind)
+        self.db.command({
+            'createIndexes':
+            collection.name,
+            'indexes': [{
+                'name': vector_index_name,
+                'key': {
+                    "contentVector": "cosmosSearch"
+                },
+                'cosmosSearchOptions': options
+            }]
+        })
+        print(f"Created vector index {vector_index_name} with options {options}")
 
-        # Set numLists based on document count as recommended by Microsoft's best practices
-        num_lists = max(1, int(document_count /
-                               1000)) if document_count <= 1000000 else int(
-                                   document_count**0.5)
-
-        if not vector_index_exists:
-            self.db.command({
-                'createIndexes':
-                collection.name,
-                'indexes': [{
-                    'name': vector_index_name,
-                    'key': {
-                        "contentVector": "cosmosSearch"
-                    },
-                    'cosmosSearchOptions': {
-                        'kind': 'vector-ivf',
-                        'numLists': num_lists,
-                        'similarity': 'COS',
-                        'dimensions': 1536,
-                    }
-                }]
-            })
-            print(f"Created vector index {vector_index_name}")
+    def create_indices(self,
+                       collection=None,
+                       vector_index_name="VectorSearchIndex",
+                       kind: str = COSMOS_VECTOR_INDEX_KIND):
+        collection = collection if collection is not None else self.collection
+        if self.get_vector_index(collection, vector_index_name) is None:
+            self.create_vector_index(collection, vector_index_name, kind)
         else:
             print(f"Using existing vector index {vector_index_name}")
 
@@ -62,27 +141,384 @@ class DatabaseClient:
         unique_index = [("id", pymongo.ASCENDING)]
         collection.create_index(unique_index, unique=True)
 
+        # Indexes on the fields used by the cosmosSearch pre-filter
+        for fieldname in ["clientName", "documentName", "date", "sectionKey", "isCurrent", "simHashBands", "canonicalId"]:
+            collection.create_index([(fieldname, pymongo.ASCENDING)])
+
+        # Chunks listing a deleted chunk among their neighbours
+        collection.create_index([("relatedChunks.id", pymongo.ASCENDING)])
+
+        # Compound indexes for searches scoped to a client and a document or date range, so the
+        # pre-filter (and the local scoring fallback) only reads the matching slice
+        collection.create_index([("clientName", pymongo.ASCENDING), ("date", pymongo.ASCENDING)])
+        collection.create_index([("clientName", pymongo.ASCENDING), ("documentName", pymongo.ASCENDING), ("date", pymongo.ASCENDING)])
+
+        # The chunk collection's companions are indexed along with it
+        if collection is self.collection:
+            self.create_centroid_indices()
+            self.create_query_indices()
+
+    def rebuild_vector_index_if_drifted(self,
+                                        collection=None,
+                                        vector_index_name="VectorSearchIndex",
+                                        kind: str = COSMOS_VECTOR_INDEX_KIND,
+                                        drift_ratio: float = NUM_LISTS_DRIFT_RATIO,
+                                        force: bool = False) -> bool:
+        '''
+        Rebuild the vector index when its kind differs from the configured one, or when an IVF index's
+        numLists is off from the value the current document count calls for by at least drift_ratio.
+        Returns whether the index was rebuilt. Searches fall back to scoring locally while it rebuilds.
+        '''
+        collection = collection if collection is not None else self.collection
+        index = self.get_vector_index(collection, vector_index_name)
+        if index is None:
+            self.create_vector_index(collection, vector_index_name, kind)
+            return True
+
+        current_options = index.get('cosmosSearchOptions', {})
+        reason = "forced" if force else None
+        if reason is None and current_options.get('kind') != kind:
+            reason = f"kind {current_options.get('kind')} != {kind}"
+        if reason is None and kind == 'vector-ivf':
+            current_num_lists = current_options.get('numLists') or 1
+            target_num_lists = self.compute_num_lists(collection.count_documents({}))
+            if max(current_num_lists, target_num_lists) / min(current_num_lists, target_num_lists) >= drift_ratio:
+                reason = f"numLists {current_num_lists} -> {target_num_lists}"
+
+        if reason is None:
+            print(f"Vector index {vector_index_name} is up to date")
+            return False
+
+        print(f"Rebuilding vector index {vector_index_name}: {reason}")
+        collection.drop_index(vector_index_name)
+        self.create_vector_index(collection, vector_index_name, kind)
+        return True
+
+    def create_centroid_indices(self, vector_index_name="CentroidVectorSearchIndex"):
+        if self.centroid_collection is None:
+            return
+        if self.centroid_collection.count_documents({}) == 0:
+            self.update_centroids()
+        self.create_indices(self.centroid_collection, vector_index_name)
+        self.centroid_collection.create_index([("level", pymongo.ASCENDING)])
+        self.centroid_collection.create_index([("documentKey", pymongo.ASCENDING)])
+
+    def update_centroids(self, document_keys: set = None):
+        '''
+        Recompute the centroids of the given documents, or of the whole collection when document_keys is None.
+        Documents without chunks left simply lose their centroids.
+        '''
+        if self.centroid_collection is None:
+            return
+        if document_keys is None:
+            query = {}
+            self.centroid_collection.delete_many({})
+        else:
+            if not document_keys:
+                return
+            # Chunk ids are prefixed by their document key
+            pattern = "|".join(re.escape(document_key) for document_key in document_keys)
+            query = {"id": {"$regex": f"^(?:{pattern})_chunk_"}}
+            self.centroid_collection.delete_many({"documentKey": {"$in": list(document_keys)}})
+
+        documents = list(self.collection.find(query, {'_id': 0, 'relatedChunks': 0}))
+        # Chunks ingested before sections were recorded get their section key backfilled
+        for document in documents:
+            if not document.get('sectionKey'):
+                document['sectionKey'] = get_section_key(document)
+                self.collection.update_one({'id': document['id']}, {'$set': {'sectionKey': document['sectionKey']}})
+
+        centroids = compute_centroids(documents)
+        if centroids:
+            self.centroid_collection.insert_many(centroids)
+
+    def update_current_versions(self, version_keys: set = None) -> tuple[list[str], list[str]]:
+        '''
+        Flag the chunks and centroids of the newest dated upload of each (clientName, documentName)
+        with isCurrent, and every older upload of the same document with isCurrent False.
+        Only the given version keys are refreshed, or the whole collection when version_keys is None.
+        Returns the ids of the chunks that became current and of those that became superseded.
+        '''
+        if version_keys is not None and not version_keys:
+            return [], []
+        pipeline = []
+        if version_keys is not None:
+            pipeline.append({"$match": {"$or": [
+                {"clientName": client_name, "documentName": document_name} for client_name, document_name in version_keys
+            ]}})
+        pipeline += [
+            {"$unwind": "$clientName"},
+            {"$unwind": "$documentName"},
+            {"$unwind": "$date"},
+            {"$group": {"_id": {"clientName": "$clientName", "documentName": "$documentName"}, "latestDate": {"$max": "$date"}}}
+        ]
+        latest_versions = list(self.collection.aggregate(pipeline))
+
+        collections = [self.collection] if self.centroid_collection is None else [self.collection, self.centroid_collection]
+        current_ids, superseded_ids = [], []
+        for latest_version in latest_versions:
+            version_query = latest_version['_id']
+            current_ids += [chunk['id'][0] for chunk in self.collection.find(
+                {**version_query, "date": latest_version['latestDate'], "isCurrent": {"$ne": True}}, {'_id': 0, 'id': 1})]
+            superseded_ids += [chunk['id'][0] for chunk in self.collection.find(
+                {**version_query, "date": {"$ne": latest_version['latestDate']}, "isCurrent": {"$ne": False}}, {'_id': 0, 'id': 1})]
+            for collection in collections:
+                collection.update_many({**version_query, "date": latest_version['latestDate']}, {"$set": {"isCurrent": True}})
+                collection.update_many({**version_query, "date": {"$ne": latest_version['latestDate']}}, {"$set": {"isCurrent": False}})
+        return current_ids, superseded_ids
+
+    def schedule_related_chunks_update(self, added_ids: list = None, removed_ids: list = None):
+        def update():
+            try:
+                self.update_related_chunks(added_ids, removed_ids)
+            except Exception as e:
+                print(f"ERROR: Unable to update related chunks: {e}")
+        get_related_chunks_executor().submit(update)
+
+    def update_related_chunks(self, added_ids: list = None, removed_ids: list = None, neighbour_count: int = RELATED_CHUNK_COUNT):
+        '''
+        Refresh the precomputed neighbours (relatedChunks) of the chunks an upload or delete can change,
+        or of every chunk when neither added_ids nor removed_ids is given. Chunks that became current count as
+        added and chunks that became superseded as removed, superseded chunks are never listed as neighbours.
+        With a vector index, each added chunk and each chunk that lost a neighbour is looked up with one cosmosSearch
+        k-NN query, run concurrently, and the added chunks are merged into the stored lists of their nearest chunks.
+        A full refresh, or one without a vector index (e.g. a local Mongo), scores every stored vector.
+        '''
+        if neighbour_count <= 0:
+            return
+        if (added_ids is None and removed_ids is None) or self.get_vector_index() is None:
+            self.score_related_chunks(added_ids, removed_ids, neighbour_count)
+            return
+
+        # The nearest chunks of each added chunk, beyond its own neighbours, are the existing chunks it can enter the list of
+        added_chunks = list(self.collection.find({'id': {'$in': added_ids or []}}, NEIGHBOUR_PROJECTION))
+        added_candidates = self.search_neighbours_many(added_chunks, neighbour_count * RELATED_CHUNK_CANDIDATE_FACTOR)
+        related = {chunk['id'][0]: candidates[:neighbour_count] for chunk, candidates in zip(added_chunks, added_candidates)}
+        candidate_ids = {candidate['id'] for candidates in added_candidates for candidate in candidates} - set(related)
+
+        # Chunks that listed a deleted or superseded chunk need a replacement neighbour, which only a new query finds
+        query_ids = set()
+        if removed_ids:
+            query_ids.update(chunk['id'][0] for chunk in self.collection.find({'relatedChunks.id': {'$in': removed_ids}}, {'_id': 0, 'id': 1}))
+        query_ids -= set(related)
+
+        # Every other candidate is scored against the added chunks in one matrix product and merged into its stored list
+        merge_ids = list(candidate_ids - query_ids)
+        if merge_ids:
+            documents = list(self.collection.find({'id': {'$in': merge_ids}}, {**NEIGHBOUR_PROJECTION, 'relatedChunks': 1}))
+            chunk_ids, matrix, related_chunks, groups = load_neighbour_matrix(documents + added_chunks)
+            rows = {chunk_id: row for row, chunk_id in enumerate(chunk_ids)}
+            # Chunks never given a list have nothing to merge into
+            query_ids.update(chunk_id for chunk_id in merge_ids if chunk_id in rows and related_chunks[rows[chunk_id]] is None)
+            target_rows = np.asarray([rows[chunk_id] for chunk_id in merge_ids if chunk_id in rows and chunk_id not in query_ids], dtype=np.int64)
+            new_rows = np.asarray([rows[chunk_id] for chunk_id in related if chunk_id in rows], dtype=np.int64)
+            if len(target_rows) and len(new_rows):
+                related.update(merge_new_neighbours(chunk_ids, matrix, related_chunks, target_rows, new_rows, neighbour_count, groups))
+
+        query_chunks = list(self.collection.find({'id': {'$in': list(query_ids)}}, NEIGHBOUR_PROJECTION))
+        related.update(zip([chunk['id'][0] for chunk in query_chunks], self.search_neighbours_many(query_chunks, neighbour_count)))
+        self.write_related_chunks(related)
+
+    def search_neighbours_many(self, chunks: list[dict], neighbour_count: int) -> list[list[dict]]:
+        if len(chunks) <= 1:
+            return [self.search_neighbours(chunk, neighbour_count) for chunk in chunks]
+        with ThreadPoolExecutor(max_workers=BATCH_SEARCH_CONCURRENCY, thread_name_prefix="related-chunks-search") as executor:
+            return list(executor.map(lambda chunk: self.search_neighbours(chunk, neighbour_count), chunks))
+
+    def write_related_chunks(self, related: dict[str, list[dict]]):
+        if related:
+            self.collection.bulk_write([UpdateOne({'id': chunk_id}, {'$set': {'relatedChunks': neighbours}}) for chunk_id, neighbours in related.items()], ordered=False)
+        print(f"Updated related chunks of {len(related)} chunks")
+
+    def search_neighbours(self, chunk: dict, neighbour_count: int) -> list[dict]:
+        # Other versions of the chunk's own document and its near-duplicates repeat it almost verbatim
+        # and are left out, twice as many current chunks are fetched to make up for them
+        results = search_collection(self.collection, chunk['contentVector'], 2 * neighbour_count + 1, {'isCurrent': {'$ne': False}})
+        version_key, document_key, duplicate_group = get_version_key(chunk), get_document_key(chunk), get_duplicate_group(chunk)
+        neighbours = [
+            {'id': result['id'][0], 'similarityScore': result['similarityScore']}
+            for result in results
+            if get_duplicate_group(result) != duplicate_group and (get_version_key(result) != version_key or get_document_key(result) == document_key)
+        ]
+        return neighbours[:neighbour_count]
+
+    def score_related_chunks(self, added_ids: list = None, removed_ids: list = None, neighbour_count: int = RELATED_CHUNK_COUNT):
+        # Every vector loaded and scored in memory, chunks without stored neighbours yet are always refreshed
+        chunk_ids, matrix, related_chunks, groups = load_neighbour_matrix(
+            self.collection.find({}, {**NEIGHBOUR_PROJECTION, 'isCurrent': 1, 'relatedChunks': 1}))
+        if not chunk_ids:
+            return
+
+        if added_ids is None and removed_ids is None:
+            target_rows = np.arange(len(chunk_ids))
+        else:
+            rows = {chunk_id: row for row, chunk_id in enumerate(chunk_ids)}
+            new_rows = np.asarray([rows[chunk_id] for chunk_id in added_ids or [] if chunk_id in rows], dtype=np.int64)
+            target_rows = set(find_affected_rows(matrix, related_chunks, new_rows, neighbour_count, groups).tolist())
+            # Chunks that listed a deleted or superseded chunk need a replacement neighbour
+            removed_ids = set(removed_ids or [])
+            target_rows.update(row for row, related in enumerate(related_chunks)
+                               if related and any(neighbour['id'] in removed_ids for neighbour in related))
+            target_rows = np.asarray(sorted(target_rows), dtype=np.int64)
+        if not len(target_rows):
+            return
+
+        self.write_related_chunks(compute_neighbours(chunk_ids, matrix, target_rows, neighbour_count, groups))
+
+    def find_related_chunks(self, chunk_id: str, include_history: bool = False) -> list[dict]:
+        # The stored neighbour list, then one lookup of the neighbours on the unique id index
+        chunk = self.collection.find_one({'id': chunk_id}, {'_id': 0, 'id': 1, 'canonicalId': 1, 'relatedChunks': 1})
+        if chunk is None:
+            raise ValueError(f"Chunk {chunk_id} not found")
+        scores = {neighbour['id']: neighbour['similarityScore'] for neighbour in chunk.get('relatedChunks') or []}
+        # Lists stored before near-duplicates were left out can still cite the chunk's own group
+        duplicate_group = get_duplicate_group(chunk)
+        query = {'id': {'$in': list(scores)}}
+        if not include_history:
+            query['isCurrent'] = {'$ne': False}
+        documents = {
+            document['id'][0]: document
+            for document in self.collection.find(query, {'_id': 0, 'contentVector': 0, 'relatedChunks': 0})
+        }
+        return [
+            {**documents[neighbour_id], 'similarityScore': score}
+            for neighbour_id, score in scores.items()
+            if neighbour_id in documents and get_duplicate_group(documents[neighbour_id]) != duplicate_group
+        ]
+
     def add_data_to_collection(self, data):
+        added_documents = []
         for document in data:
             try:
                 self.collection.insert_one(document)
+                added_documents.append(document)
             except DuplicateKeyError:
                 print(
                     f"ERROR: Attempting to add duplicate id {document['id']}")
                 continue
+        self.update_centroids({get_document_key(document) for document in added_documents})
+        current_ids, superseded_ids = self.update_current_versions({get_version_key(document) for document in added_documents})
+        if added_documents:
+            added_ids = [document['id'][0] for document in added_documents]
+            self.schedule_related_chunks_update(added_ids=added_ids + [chunk_id for chunk_id in current_ids if chunk_id not in added_ids],
+                                                removed_ids=superseded_ids)
+        # Logged before publishing, so an index subscribing in between still finds the event when it catches up
+        self.record_corpus_event("added", [document['id'][0] for document in added_documents])
+        corpus_events.publish_documents_added(added_documents)
 
     def remove_data_from_collection(self,
                                     fieldname: str = None,
                                     substring: str = None,
                                     delete_all: bool = False):
         if delete_all:
-            self.collection.delete_many({})
+            query = {}
         else:
             if fieldname is None or substring is None:
                 raise ValueError(
                     "fieldname and substring must be provided unless delete_all is True"
                 )
-            self.collection.delete_many({fieldname: {"$regex": substring}})
+            query = {fieldname: {"$regex": substring}}
+        removed_documents = list(self.collection.find(query, {'_id': 0, 'id': 1, 'clientName': 1, 'documentName': 1}))
+        removed_ids = [document['id'][0] for document in removed_documents]
+        if not delete_all:
+            self.regroup_near_duplicates(removed_ids)
+        self.collection.delete_many(query)
+        self.update_centroids(None if delete_all else {get_document_key({'id': chunk_id}) for chunk_id in removed_ids})
+        # Deleting the newest upload of a document makes the previous one current again
+        if not delete_all:
+            current_ids, superseded_ids = self.update_current_versions({get_version_key(document) for document in removed_documents})
+            if removed_ids:
+                self.schedule_related_chunks_update(added_ids=current_ids, removed_ids=removed_ids + superseded_ids)
+        self.record_corpus_event("removed", removed_ids)
+        corpus_events.publish_documents_removed(removed_ids)
+
+    def find_simhash_candidates(self, bands: list[str]) -> list[dict]:
+        # Canonical chunks sharing at least one SimHash band, near-duplicates only ever point at these
+        if not bands:
+            return []
+        query = {'simHashBands': {'$in': bands}, 'canonicalId': {'$exists': False}}
+        return list(self.collection.find(query, {'_id': 0, 'id': 1, 'simHash': 1}))
+
+    def regroup_near_duplicates(self, removed_ids: list[str]):
+        # Near-duplicates of a deleted canonical chunk are kept, the first of them becomes the new canonical chunk
+        duplicates = self.collection.find({'canonicalId': {'$in': removed_ids}, 'id': {'$nin': removed_ids}}, {'_id': 0, 'id': 1, 'canonicalId': 1})
+        groups: dict[str, list[str]] = {}
+        for duplicate in duplicates:
+            groups.setdefault(duplicate['canonicalId'], []).append(duplicate['id'][0])
+        for chunk_ids in groups.values():
+            self.collection.update_one({'id': chunk_ids[0]}, {'$unset': {'canonicalId': ""}})
+            if len(chunk_ids) > 1:
+                self.collection.update_many({'id': {'$in': chunk_ids[1:]}}, {'$set': {'canonicalId': chunk_ids[0]}})
+
+    def create_event_indices(self):
+        if self.event_collection is None:
+            return
+        self.event_collection.create_index([("sequence", pymongo.ASCENDING)])
+        self.event_collection.create_index([("createdAt", pymongo.ASCENDING)], expireAfterSeconds=CORPUS_EVENT_RETENTION_SECONDS)
+
+    def record_corpus_event(self, kind: str, chunk_ids: list[str]):
+        if self.event_collection is None or not chunk_ids:
+            return
+        # One shared counter orders the events of every process
+        counter = self.event_collection.find_one_and_update(
+            {'_id': 'sequence'},
+            {'$inc': {'value': 1}},
+            upsert=True,
+            return_document=pymongo.ReturnDocument.AFTER
+        )
+        self.event_collection.insert_one({
+            'sequence': counter['value'],
+            'kind': kind,
+            'chunkIds': chunk_ids,
+            'origin': get_process_id(),
+            'createdAt': datetime.now()
+        })
+
+    def get_corpus_sequence(self) -> int:
+        if self.event_collection is None:
+            return 0
+        counter = self.event_collection.find_one({'_id': 'sequence'})
+        return counter['value'] if counter else 0
+
+    def find_corpus_events(self, after_sequence: int) -> list[dict]:
+        if self.event_collection is None:
+            return []
+        return list(self.event_collection.find({'sequence': {'$gt': after_sequence}}, {'_id': 0}).sort('sequence', pymongo.ASCENDING))
+
+    def retains_corpus_events_after(self, sequence: int) -> bool:
+        # Replaying the log from sequence only brings a copy of the corpus up to date if no event after it has expired
+        if self.event_collection is None:
+            return False
+        if sequence >= self.get_corpus_sequence():
+            return True
+        return self.event_collection.find_one({'sequence': sequence + 1}, {'_id': 1}) is not None
+
+    def find_chunks(self, ids: list[str]) -> list[dict]:
+        return list(self.collection.find({'id': {'$in': ids}}, {'_id': 0, 'relatedChunks': 0}))
+
+    def create_query_indices(self):
+        if self.query_collection is None:
+            return
+        self.query_collection.create_index([("query", pymongo.ASCENDING)], unique=True)
+        self.query_collection.create_index([("count", pymongo.DESCENDING)])
+
+    def record_query(self, normalized_query: str, text: str):
+        if self.query_collection is None:
+            return
+        self.query_collection.update_one(
+            {'query': normalized_query},
+            {'$inc': {'count': 1}, '$set': {'text': text, 'lastAsked': datetime.now()}},
+            upsert=True
+        )
+
+    def find_recorded_queries(self, limit: int) -> list[dict]:
+        if self.query_collection is None:
+            return []
+        return list(self.query_collection.find({}, {'_id': 0, 'query': 1, 'text': 1, 'count': 1}).sort('count', pymongo.DESCENDING).limit(limit))
+
+    def find_content_vectors(self, ids: list) -> dict:
+        documents = self.collection.find({'id': {'$in': ids}}, {'_id': 0, 'id': 1, 'contentVector': 1})
+        return {document['id'][0]: document['contentVector'] for document in documents}
 
     def find_documents_by_substring(self, fieldname: str, substring: str):
         regex = {"$regex": substring}
@@ -5,6 +5,11 @@ from classes import (
     DocumentChunk
 )
 
+from centroids import (
+    get_section_key,
+    get_section_name
+)
+
 from tenacity import retry, wait_random_exponential, stop_after_attempt
 import time
     
@@ -17,14 +22,29 @@ def generate_embeddings(text, client, model="text-embedding-ada-002"): # model =
     time.sleep(0.5) # rest period to avoid rate limiting on AOAI for free tier
     return client.embeddings.create(input = [text], model=model).data[0].embedding
 
-async def convert_chunks_to_json(chunks: list[DocumentChunk], client, embedding_model, in_prod = False):
+@retry(wait=wait_random_exponential(min=1, max=20), stop=stop_after_attempt(5))
+def generate_embeddings_batch(texts: list[str], client, model="text-embedding-ada-002") -> list[list[float]]:
+    '''
+    Generate embeddings for several texts in a single embeddings API call.
+    '''
+    response = client.embeddings.create(input=texts, model=model)
+    return [item.embedding for item in sorted(response.data, key=lambda item: item.index)]
+
+async def convert_chunks_to_json(chunks: list[DocumentChunk], client, embedding_model, in_prod = False, near_duplicates: dict = None):
     items = []
     n = 0
     title_embeddings = None
+    vectors_by_id = {}
     for chunk in chunks:
         item = {}
         n += 1
-        content_embeddings = generate_embeddings(chunk.content, client, embedding_model)
+        near_duplicate = near_duplicates.get(chunk.id, {}) if near_duplicates else {}
+        # A near-duplicate of a stored or earlier chunk reuses its embedding instead of requesting one
+        content_embeddings = near_duplicate.get('contentVector') or vectors_by_id.get(near_duplicate.get('canonicalId'))
+        if content_embeddings is None:
+            near_duplicate = {key: value for key, value in near_duplicate.items() if key != 'canonicalId'}
+            content_embeddings = generate_embeddings(chunk.content, client, embedding_model)
+        vectors_by_id[chunk.id] = content_embeddings
         item['id'] = chunk.id,
         item['clientName'] = chunk.client_name,
         item['documentName'] = chunk.document_name,
@@ -32,6 +52,11 @@ async def convert_chunks_to_json(chunks: list[DocumentChunk], client, embedding_
         item['page'] = chunk.page_number,
         item['content'] = chunk.content,
         item['contentVector'] = content_embeddings
+        item['section'] = get_section_name(item)
+        item['sectionKey'] = get_section_key(item)
+        for key in ('simHash', 'simHashBands', 'canonicalId'):
+            if key in near_duplicate:
+                item[key] = near_duplicate[key]
         item['@search.action'] = 'upload'
         print("Creating embeddings for item:", n, "/", len(chunks), end='\r')
         items.append(item)
@@ -7,6 +7,8 @@ import requests
 from requests.models import Response
 from urllib.parse import quote
 from datetime import datetime
+import threading
+import time
 
 import base64
 
@@ -20,17 +22,60 @@ from constants import (
     CONNECTION_STRING,
     DATABASE_NAME,
     COLLECTION_NAME,
+    CENTROID_COLLECTION_NAME,
+    QUERY_COLLECTION_NAME,
+    CORPUS_EVENT_COLLECTION_NAME,
     APP_CLIENT_ID,
     APP_TENANT_ID,
     KEY_VAULT_URL,
     GRAPH_API_ENDPOINT,
-    SHAREPOINT_BASE_URL
+    SHAREPOINT_BASE_URL,
+    LOCAL_INDEX_KIND,
+    LOCAL_INDEX_STORAGE,
+    LOCAL_INDEX_RESCORE,
+    SNAPSHOT_DIRECTORY,
+    TYPEAHEAD_MAX_QUERIES,
+    TYPEAHEAD_REFRESH_SECONDS
 )
 
 from database import (
     DatabaseClient
 )
 
+from vector_index import (
+    VectorIndex
+)
+
+from lexical_index import (
+    BM25Index
+)
+
+from index_events import (
+    CorpusEventPoller,
+    corpus_events,
+    corpus_generation
+)
+
+from typeahead import (
+    QueryTypeahead
+)
+
+from snapshot import (
+    VectorSnapshot
+)
+
+_db_client: DatabaseClient = None
+_db_client_lock = threading.Lock()
+_search_index: VectorIndex = None
+_search_index_lock = threading.Lock()
+_lexical_index: BM25Index = None
+_lexical_index_lock = threading.Lock()
+_corpus_event_poller: CorpusEventPoller = None
+_corpus_event_poller_lock = threading.Lock()
+_query_typeahead: QueryTypeahead = None
+_query_typeahead_loaded_at = 0.0
+_query_typeahead_lock = threading.Lock()
+
 def get_service_management_client():
     return CognitiveServicesManagementClient(
         credential=DefaultAzureCredential(),
@@ -47,11 +92,108 @@ def get_openai_client() -> AzureOpenAI:
 
 
 def get_db_client() -> DatabaseClient:
-    return DatabaseClient(
-        connection_string=CONNECTION_STRING,
-        database_name=DATABASE_NAME,
-        collection_name=COLLECTION_NAME
-    )
+    # MongoClient keeps a thread-safe connection pool, one per worker avoids a new handshake per request
+    global _db_client
+    with _db_client_lock:
+        if _db_client is None:
+            _db_client = DatabaseClient(
+                connection_string=CONNECTION_STRING,
+                database_name=DATABASE_NAME,
+                collection_name=COLLECTION_NAME,
+                centroid_collection_name=CENTROID_COLLECTION_NAME,
+                query_collection_name=QUERY_COLLECTION_NAME,
+                event_collection_name=CORPUS_EVENT_COLLECTION_NAME
+            )
+    return _db_client
+
+def start_corpus_event_poller() -> CorpusEventPoller:
+    # Uploads and deletes handled by other workers reach this worker's indexes and caches through the shared log
+    global _corpus_event_poller
+    with _corpus_event_poller_lock:
+        if _corpus_event_poller is None:
+            db_client = get_db_client()
+            db_client.create_event_indices()
+            _corpus_event_poller = CorpusEventPoller(db_client, corpus_events, generation=corpus_generation)
+            _corpus_event_poller.start()
+    return _corpus_event_poller
+
+def get_search_index() -> VectorIndex:
+    # Built once per worker, shared by every request
+    global _search_index
+    corpus_event_poller = start_corpus_event_poller()
+    with _search_index_lock:
+        if _search_index is None:
+            # Changes made while the index loads, or since its snapshot was written, are replayed into it once it is subscribed
+            search_index, loaded_sequence = load_search_index()
+            corpus_events.subscribe(search_index)
+            corpus_event_poller.replay(search_index, loaded_sequence)
+            _search_index = search_index
+    return _search_index
+
+def get_lexical_index() -> BM25Index:
+    # Built once per worker from chunk content only, vectors are never read
+    global _lexical_index
+    corpus_event_poller = start_corpus_event_poller()
+    with _lexical_index_lock:
+        if _lexical_index is None:
+            loaded_sequence = get_db_client().get_corpus_sequence()
+            lexical_index = BM25Index.from_documents(get_db_client().collection.find({}, {'_id': 0, 'contentVector': 0, 'relatedChunks': 0}))
+            corpus_events.subscribe(lexical_index)
+            corpus_event_poller.replay(lexical_index, loaded_sequence)
+            _lexical_index = lexical_index
+    return _lexical_index
+
+def get_query_typeahead() -> QueryTypeahead:
+    # Reloaded periodically so each worker also suggests the queries recorded by the others
+    global _query_typeahead, _query_typeahead_loaded_at
+    with _query_typeahead_lock:
+        if _query_typeahead is None or time.monotonic() - _query_typeahead_loaded_at > TYPEAHEAD_REFRESH_SECONDS:
+            _query_typeahead = QueryTypeahead.from_documents(
+                get_db_client().find_recorded_queries(TYPEAHEAD_MAX_QUERIES),
+                max_queries=TYPEAHEAD_MAX_QUERIES
+            )
+            _query_typeahead_loaded_at = time.monotonic()
+    return _query_typeahead
+
+def load_search_index() -> tuple[VectorIndex, int]:
+    # The index and the corpus event sequence it reflects, the events after it are replayed into it
+    index_options = {
+        'index_kind': LOCAL_INDEX_KIND,
+        'storage': LOCAL_INDEX_STORAGE
+    }
+    db_client = get_db_client()
+    loaded_sequence = db_client.get_corpus_sequence()
+    snapshot = open_vector_snapshot(db_client) if SNAPSHOT_DIRECTORY else None
+    if snapshot is None:
+        search_index = VectorIndex.from_documents(
+            db_client.collection.find({}, {'_id': 0, 'relatedChunks': 0}),
+            vector_loader=load_content_vectors if LOCAL_INDEX_RESCORE else None,
+            **index_options
+        )
+        return search_index, loaded_sequence
+
+    if not LOCAL_INDEX_RESCORE:
+        index_options['vector_loader'] = None
+    return VectorIndex.from_snapshot(snapshot, **index_options), snapshot.event_sequence
+
+def open_vector_snapshot(db_client: DatabaseClient) -> VectorSnapshot:
+    # Written out of band by python maintenance.py refresh-snapshot, workers only map it.
+    # Chunks uploaded since are rescored with their vectors from the collection
+    try:
+        snapshot = VectorSnapshot(SNAPSHOT_DIRECTORY, fallback_loader=load_content_vectors)
+    except (OSError, ValueError, KeyError) as e:
+        print(f"WARNING: No usable vector snapshot in {SNAPSHOT_DIRECTORY}, building the index from the collection: {e}")
+        return None
+    if not db_client.retains_corpus_events_after(snapshot.event_sequence):
+        print(f"WARNING: Vector snapshot in {SNAPSHOT_DIRECTORY} predates the retained corpus events, building the index from the collection")
+        return None
+    return snapshot
+
+def load_content_vectors(records: list[dict]) -> list:
+    # Full precision vectors for rescoring candidates found on quantized codes
+    ids = [record['id'][0] for record in records]
+    content_vectors = get_db_client().find_content_vectors(ids)
+    return [content_vectors[chunk_id] for chunk_id in ids]
 
 def format_date(date_obj: datetime) -> str:
     try:
@@ -0,0 +1,102 @@
+import threading
+
+import numpy as np
+
+from constants import (
+    HNSW_M,
+    HNSW_EF_CONSTRUCTION,
+    HNSW_EF_SEARCH
+)
+
+# Optional: only needed for index_kind="hnsw"
+try:
+    import hnswlib
+except ImportError:
+    hnswlib = None
+
+HNSW_AVAILABLE = hnswlib is not None
+
+# Initial capacity of a graph, doubled whenever an add would overflow it
+INITIAL_CAPACITY = 1024
+
+
+class HNSWGraph:
+    '''
+    Hierarchical navigable small world graph over unit-normalized vectors, built and walked by hnswlib
+    in C++ (inner product space, so the score is 1 - distance). Labels are the row numbers of the owning
+    partition. hnswlib keeps its own float32 copy of every vector, whatever the partition's storage.
+    '''
+
+    def __init__(self,
+                 dimensions: int,
+                 m: int = HNSW_M,
+                 ef_construction: int = HNSW_EF_CONSTRUCTION,
+                 ef_search: int = HNSW_EF_SEARCH,
+                 seed: int = 42):
+        if hnswlib is None:
+            raise ValueError("index_kind 'hnsw' needs the hnswlib package, install it with pip install hnswlib")
+        self.dimensions = dimensions
+        self.m = m
+        self.ef_construction = ef_construction
+        self.ef_search = ef_search
+        self.index = hnswlib.Index(space='ip', dim=dimensions)
+        self.index.init_index(max_elements=INITIAL_CAPACITY, M=m, ef_construction=ef_construction, random_seed=seed)
+        # hnswlib searches are not safe against a concurrent add or resize, nor is the shared ef setting
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return self.index.get_current_count()
+
+    @property
+    def nbytes(self) -> int:
+        # Vectors, links and labels as hnswlib serializes them, close to what it holds in memory
+        return self.index.index_file_size()
+
+    def add(self, row_ids: np.ndarray, vectors: np.ndarray):
+        if not len(row_ids):
+            return
+        with self.lock:
+            needed = self.index.get_current_count() + len(row_ids)
+            if needed > self.index.get_max_elements():
+                self.index.resize_index(max(needed, 2 * self.index.get_max_elements()))
+            self.index.add_items(np.ascontiguousarray(vectors, dtype=np.float32), row_ids)
+
+    def get_state(self) -> dict:
+        # hnswlib's own serialization: scalar parameters plus the level 0 block, links and label maps
+        with self.lock:
+            params = self.index.__getstate__()[0]
+        return {key: np.asarray(value) for key, value in params.items()}
+
+    def load_state(self, state: dict):
+        # Replaces the graph with one saved by get_state over the same rows
+        params = {key: value.item() if value.ndim == 0 else value for key, value in state.items()}
+        if params['dim'] != self.dimensions:
+            raise ValueError(f"Saved HNSW graph has {params['dim']} dimensions, expecting {self.dimensions}")
+        index = hnswlib.Index.__new__(hnswlib.Index)
+        try:
+            index.__setstate__((params,))
+        except RuntimeError as e:
+            raise ValueError(f"Saved HNSW graph cannot be restored: {e}")
+        with self.lock:
+            self.index = index
+
+    def search(self, query_vector: np.ndarray, k: int, ef_search: int = None, allowed: np.ndarray = None) -> tuple[np.ndarray, np.ndarray]:
+        '''
+        Top k rows by inner product. Rows outside `allowed` are traversed but never returned. Returns None
+        when hnswlib cannot find k allowed rows, e.g. behind a very selective filter.
+        '''
+        with self.lock:
+            count = self.index.get_current_count()
+            if count == 0:
+                return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+            k = min(k, count)
+            row_filter = None
+            if allowed is not None:
+                allowed_rows = allowed.shape[0]
+                row_filter = lambda row: row < allowed_rows and bool(allowed[row])
+            self.index.set_ef(max(ef_search or self.ef_search, k))
+            try:
+                labels, distances = self.index.knn_query(query_vector.reshape(1, -1), k=k, num_threads=1, filter=row_filter)
+            except RuntimeError:
+                return None
+        return labels[0].astype(np.int64), (1 - distances[0]).astype(np.float32)
@@ -0,0 +1,157 @@
+import os
+import socket
+import threading
+import time
+
+from constants import CORPUS_EVENT_POLL_SECONDS
+
+# A sequence number taken by a writer whose event has not shown up after this long is given up on
+MAX_EVENT_GAP_SECONDS = 30
+
+
+def get_process_id() -> str:
+    # Evaluated per call so forked workers never share the id of the process they were forked from
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+class CorpusEventBus:
+    '''
+    In-process notifications of chunks added to or removed from the collection.
+    Listeners implement documents_added(documents) and documents_removed(chunk_ids)
+    and are called synchronously by the thread that changed the collection, or by
+    CorpusEventPoller for changes made by another worker process.
+    '''
+
+    def __init__(self):
+        self.listeners = []
+        self.lock = threading.Lock()
+
+    def subscribe(self, listener):
+        with self.lock:
+            if listener not in self.listeners:
+                self.listeners.append(listener)
+
+    def unsubscribe(self, listener):
+        with self.lock:
+            if listener in self.listeners:
+                self.listeners.remove(listener)
+
+    def publish_documents_added(self, documents: list[dict]):
+        if not documents:
+            return
+        for listener in list(self.listeners):
+            try:
+                listener.documents_added(documents)
+            except Exception as e:
+                print(f"ERROR: {type(listener).__name__} failed to handle added documents: {e}")
+
+    def publish_documents_removed(self, chunk_ids: list[str]):
+        if not chunk_ids:
+            return
+        for listener in list(self.listeners):
+            try:
+                listener.documents_removed(chunk_ids)
+            except Exception as e:
+                print(f"ERROR: {type(listener).__name__} failed to handle removed documents: {e}")
+
+
+corpus_events = CorpusEventBus()
+
+
+class CorpusGeneration:
+    '''
+    Counter moved on by every upload or delete. Caches of search results stamp their
+    entries with it and treat entries from an older generation as stale.
+    The event sequence every process increments in Mongo is added in by CorpusEventPoller on each
+    poll, so another worker's change is seen before its event is replayed here. get never does I/O.
+    '''
+
+    def __init__(self):
+        self.value = 0
+        self.shared_value = 0
+        self.lock = threading.Lock()
+
+    def bump(self):
+        with self.lock:
+            self.value += 1
+
+    def set_shared(self, sequence: int):
+        with self.lock:
+            self.shared_value = max(self.shared_value, sequence)
+
+    def get(self) -> int:
+        # Both parts only ever grow, so their sum changes whenever either does
+        with self.lock:
+            return self.value + self.shared_value
+
+    def documents_added(self, documents: list[dict]):
+        self.bump()
+
+    def documents_removed(self, chunk_ids: list[str]):
+        self.bump()
+
+
+corpus_generation = CorpusGeneration()
+corpus_events.subscribe(corpus_generation)
+
+
+class CorpusEventPoller:
+    '''
+    Replays the uploads and deletes other worker processes recorded in the shared event log
+    on this process's event bus, so its in-memory indexes and caches follow within poll_interval.
+    Each poll also copies the shared event sequence into generation.
+    '''
+
+    def __init__(self, db_client, event_bus: CorpusEventBus, poll_interval: float = CORPUS_EVENT_POLL_SECONDS, generation: CorpusGeneration = None):
+        self.db_client = db_client
+        self.event_bus = event_bus
+        self.poll_interval = poll_interval
+        self.generation = generation
+        self.last_sequence = db_client.get_corpus_sequence()
+        if generation is not None:
+            generation.set_shared(self.last_sequence)
+        self.gap_since = None
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, name="corpus-events", daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+
+    def run(self):
+        while not self.stopped.wait(self.poll_interval):
+            try:
+                self.poll()
+            except Exception as e:
+                print(f"ERROR: Unable to poll corpus events: {e}")
+
+    def replay(self, listener, after_sequence: int):
+        # Catches up a listener that subscribed after reading after_sequence, e.g. an index that was loading.
+        # Events it also received on the bus are applied twice, adds and deletes are idempotent
+        for event in self.db_client.find_corpus_events(after_sequence):
+            if event['kind'] == "removed":
+                listener.documents_removed(event['chunkIds'])
+            else:
+                listener.documents_added(self.db_client.find_chunks(event['chunkIds']))
+
+    def poll(self):
+        if self.generation is not None:
+            # Sequence numbers taken by writers whose events may not be readable yet
+            self.generation.set_shared(self.db_client.get_corpus_sequence())
+        for event in self.db_client.find_corpus_events(self.last_sequence):
+            if event['sequence'] != self.last_sequence + 1:
+                # Another process has taken the next sequence number but not written its event yet
+                self.gap_since = self.gap_since or time.monotonic()
+                if time.monotonic() - self.gap_since < MAX_EVENT_GAP_SECONDS:
+                    return
+                print(f"WARNING: Corpus events {self.last_sequence + 1} to {event['sequence'] - 1} never arrived, skipping them")
+            self.gap_since = None
+            self.last_sequence = event['sequence']
+            if event['origin'] == get_process_id():
+                continue
+            if event['kind'] == "removed":
+                self.event_bus.publish_documents_removed(event['chunkIds'])
+            else:
+                self.event_bus.publish_documents_added(self.db_client.find_chunks(event['chunkIds']))
@@ -0,0 +1,173 @@
+import heapq
+import math
+import re
+import threading
+from collections import Counter
+from datetime import datetime
+
+from constants import (
+    BM25_K1,
+    BM25_B,
+    RRF_K
+)
+
+from vector_utils import unwrap_field
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+")
+
+# Terms that carry no signal in DDQ questions and would otherwise dominate the posting lists
+STOP_WORDS = frozenset([
+    "a", "an", "and", "are", "as", "at", "be", "by", "do", "does", "for", "from", "has", "have",
+    "how", "in", "is", "it", "its", "of", "on", "or", "that", "the", "this", "to", "was", "what",
+    "when", "where", "which", "who", "will", "with", "you", "your"
+])
+
+
+def tokenize(text: str) -> list[str]:
+    return [token for token in TOKEN_PATTERN.findall((text or "").lower()) if token not in STOP_WORDS]
+
+
+def reciprocal_rank_fusion(rankings: list[list[dict]], result_count: int, k: int = RRF_K) -> list[dict]:
+    '''
+    Fuse ranked result lists by summing 1 / (k + rank) per chunk id.
+    Only ranks are used, so scores on different scales (cosine, BM25) can be combined.
+    '''
+    fused_scores = {}
+    results_by_id = {}
+    for ranking in rankings:
+        for rank, result in enumerate(ranking, start=1):
+            chunk_id = unwrap_field(result['id'])
+            fused_scores[chunk_id] = fused_scores.get(chunk_id, 0.0) + 1.0 / (k + rank)
+            results_by_id.setdefault(chunk_id, result)
+
+    top_ids = heapq.nlargest(result_count, fused_scores, key=fused_scores.get)
+    return [{**results_by_id[chunk_id], 'similarityScore': fused_scores[chunk_id]} for chunk_id in top_ids]
+
+
+class BM25Index:
+    '''
+    In-process inverted index over chunk content scored with Okapi BM25.
+    Subscribed to corpus_events, it follows uploads and deletes like the vector index.
+    '''
+
+    def __init__(self, k1: float = BM25_K1, b: float = BM25_B):
+        self.k1 = k1
+        self.b = b
+        # term -> {chunk id: term frequency}
+        self.postings: dict[str, dict[str, int]] = {}
+        self.records: dict[str, dict] = {}
+        self.lengths: dict[str, int] = {}
+        self.total_length = 0
+        # Newest date per (client, document), rebuilt lazily after the corpus changes
+        self.latest_dates: dict = None
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.records)
+
+    @classmethod
+    def from_documents(cls, documents, **index_options) -> "BM25Index":
+        index = cls(**index_options)
+        index.add_documents(documents)
+        return index
+
+    def add_documents(self, documents):
+        with self.lock:
+            for document in documents:
+                chunk_id = unwrap_field(document['id'])
+                if chunk_id in self.records:
+                    self.remove_chunk(chunk_id)
+                term_counts = Counter(tokenize(unwrap_field(document.get('content'))))
+                for term, count in term_counts.items():
+                    self.postings.setdefault(term, {})[chunk_id] = count
+                self.records[chunk_id] = {key: value for key, value in document.items() if key not in ('_id', 'contentVector')}
+                self.lengths[chunk_id] = sum(term_counts.values())
+                self.total_length += self.lengths[chunk_id]
+            self.latest_dates = None
+
+    def remove_chunk(self, chunk_id: str):
+        record = self.records.pop(chunk_id, None)
+        if record is None:
+            return
+        for term in set(tokenize(unwrap_field(record.get('content')))):
+            postings = self.postings.get(term)
+            if postings is not None:
+                postings.pop(chunk_id, None)
+                if not postings:
+                    del self.postings[term]
+        self.total_length -= self.lengths.pop(chunk_id)
+
+    def remove_chunks(self, chunk_ids: list[str]):
+        with self.lock:
+            for chunk_id in chunk_ids:
+                self.remove_chunk(chunk_id)
+            self.latest_dates = None
+
+    def documents_added(self, documents: list[dict]):
+        self.add_documents(documents)
+
+    def documents_removed(self, chunk_ids: list[str]):
+        self.remove_chunks(chunk_ids)
+
+    @staticmethod
+    def version_key(record: dict) -> tuple:
+        return unwrap_field(record['clientName']), unwrap_field(record['documentName'])
+
+    def is_current(self, record: dict) -> bool:
+        if self.latest_dates is None:
+            latest_dates = {}
+            for other in self.records.values():
+                key = self.version_key(other)
+                date = unwrap_field(other['date'])
+                if key not in latest_dates or date > latest_dates[key]:
+                    latest_dates[key] = date
+            self.latest_dates = latest_dates
+        return unwrap_field(record['date']) == self.latest_dates[self.version_key(record)]
+
+    @staticmethod
+    def matches_filter(record: dict, client_names: list, document_names: list, start_date: datetime, end_date: datetime) -> bool:
+        if client_names and unwrap_field(record['clientName']) not in client_names:
+            return False
+        if document_names and unwrap_field(record['documentName']) not in document_names:
+            return False
+        date = unwrap_field(record['date'])
+        if start_date is not None and date < start_date:
+            return False
+        if end_date is not None and date > end_date:
+            return False
+        return True
+
+    def search(self,
+               query: str,
+               result_count: int,
+               client_names: list = None,
+               document_names: list = None,
+               start_date: datetime = None,
+               end_date: datetime = None,
+               current_only: bool = False) -> list[dict]:
+        with self.lock:
+            document_count = len(self.records)
+            if document_count == 0:
+                return []
+            average_length = self.total_length / document_count
+
+            scores: dict[str, float] = {}
+            for term in set(tokenize(query)):
+                postings = self.postings.get(term)
+                if not postings:
+                    continue
+                idf = math.log(1 + (document_count - len(postings) + 0.5) / (len(postings) + 0.5))
+                for chunk_id, term_frequency in postings.items():
+                    length_norm = self.k1 * (1 - self.b + self.b * self.lengths[chunk_id] / average_length)
+                    scores[chunk_id] = scores.get(chunk_id, 0.0) + idf * term_frequency * (self.k1 + 1) / (term_frequency + length_norm)
+
+            if client_names or document_names or start_date is not None or end_date is not None:
+                scores = {
+                    chunk_id: score for chunk_id, score in scores.items()
+                    if self.matches_filter(self.records[chunk_id], client_names, document_names, start_date, end_date)
+                }
+            if current_only:
+                scores = {chunk_id: score for chunk_id, score in scores.items() if self.is_current(self.records[chunk_id])}
+
+            top_ids = heapq.nlargest(result_count, scores, key=scores.get)
+            return [{**self.records[chunk_id], 'similarityScore': scores[chunk_id]} for chunk_id in top_ids]
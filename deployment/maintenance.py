@@ -0,0 +1,94 @@
+import argparse
+
+from constants import (
+    CONNECTION_STRING,
+    DATABASE_NAME,
+    COLLECTION_NAME,
+    CENTROID_COLLECTION_NAME,
+    QUERY_COLLECTION_NAME,
+    CORPUS_EVENT_COLLECTION_NAME,
+    COSMOS_VECTOR_INDEX_KIND,
+    NUM_LISTS_DRIFT_RATIO,
+    LOCAL_INDEX_KIND,
+    LOCAL_INDEX_STORAGE,
+    SNAPSHOT_DIRECTORY
+)
+
+from database import DatabaseClient
+
+from snapshot import (
+    VectorSnapshot,
+    write_snapshot
+)
+
+from vector_index import VectorIndex
+
+
+def rebuild_vector_indexes(kind: str, drift_ratio: float, force: bool = False):
+    db_client = DatabaseClient(CONNECTION_STRING, DATABASE_NAME, COLLECTION_NAME, CENTROID_COLLECTION_NAME)
+    db_client.rebuild_vector_index_if_drifted(kind=kind, drift_ratio=drift_ratio, force=force)
+    db_client.rebuild_vector_index_if_drifted(db_client.centroid_collection, "CentroidVectorSearchIndex",
+                                              kind=kind, drift_ratio=drift_ratio, force=force)
+
+
+def create_indices():
+    db_client = DatabaseClient(CONNECTION_STRING, DATABASE_NAME, COLLECTION_NAME, CENTROID_COLLECTION_NAME, QUERY_COLLECTION_NAME)
+    db_client.create_indices()
+
+
+def update_current_versions():
+    db_client = DatabaseClient(CONNECTION_STRING, DATABASE_NAME, COLLECTION_NAME, CENTROID_COLLECTION_NAME)
+    current_ids, superseded_ids = db_client.update_current_versions()
+    # Neighbour lists must stop citing the chunks that were superseded
+    if current_ids or superseded_ids:
+        db_client.update_related_chunks(added_ids=current_ids, removed_ids=superseded_ids)
+
+
+def update_related_chunks():
+    db_client = DatabaseClient(CONNECTION_STRING, DATABASE_NAME, COLLECTION_NAME, CENTROID_COLLECTION_NAME)
+    db_client.update_related_chunks()
+
+
+def refresh_snapshot(directory: str, index_kind: str, storage: str):
+    db_client = DatabaseClient(CONNECTION_STRING, DATABASE_NAME, COLLECTION_NAME, event_collection_name=CORPUS_EVENT_COLLECTION_NAME)
+    # Read before the collection: workers replay every event after it, including changes made while it is copied
+    event_sequence = db_client.get_corpus_sequence()
+    write_snapshot(db_client.collection.find({}, {'_id': 0, 'relatedChunks': 0}), directory, event_sequence=event_sequence)
+    # Saves the codes and graph of the workers' index configuration next to it, so they do not build them at startup
+    VectorIndex.from_snapshot(VectorSnapshot(directory), index_kind=index_kind, storage=storage)
+
+
+if __name__ == "__main__":
+    # e.g. scheduled nightly: python maintenance.py rebuild-vector-index
+    parser = argparse.ArgumentParser(description="Maintenance tasks for the DDQ knowledge base")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    rebuild_parser = subparsers.add_parser("rebuild-vector-index", help="Rebuild the Cosmos DB vector indexes if the corpus size has drifted")
+    rebuild_parser.add_argument("--kind", default=COSMOS_VECTOR_INDEX_KIND, choices=["vector-ivf", "vector-hnsw"])
+    rebuild_parser.add_argument("--drift-ratio", type=float, default=NUM_LISTS_DRIFT_RATIO)
+    rebuild_parser.add_argument("--force", action="store_true", help="Rebuild even if the index is up to date")
+
+    subparsers.add_parser("create-indices", help="Create the vector and field indexes of the chunk, centroid and query collections")
+
+    # Backfills isCurrent on chunks ingested before it was recorded
+    subparsers.add_parser("update-current-versions", help="Flag the newest upload of every document as the current version")
+
+    subparsers.add_parser("update-related-chunks", help="Recompute the precomputed neighbours of every chunk")
+
+    # Workers map the snapshot and replay the changes made since it was written, e.g. scheduled nightly
+    snapshot_parser = subparsers.add_parser("refresh-snapshot", help="Rewrite the memory-mapped vector snapshot from the collection")
+    snapshot_parser.add_argument("--directory", default=SNAPSHOT_DIRECTORY, required=not SNAPSHOT_DIRECTORY)
+    snapshot_parser.add_argument("--index-kind", default=LOCAL_INDEX_KIND, choices=["exact", "hnsw"])
+    snapshot_parser.add_argument("--storage", default=LOCAL_INDEX_STORAGE, choices=["float32", "int8", "pq"])
+
+    arguments = parser.parse_args()
+    if arguments.command == "rebuild-vector-index":
+        rebuild_vector_indexes(arguments.kind, arguments.drift_ratio, arguments.force)
+    elif arguments.command == "create-indices":
+        create_indices()
+    elif arguments.command == "update-current-versions":
+        update_current_versions()
+    elif arguments.command == "update-related-chunks":
+        update_related_chunks()
+    elif arguments.command == "refresh-snapshot":
+        refresh_snapshot(arguments.directory, arguments.index_kind, arguments.storage)
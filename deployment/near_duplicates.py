@@ -0,0 +1,88 @@
+import hashlib
+import re
+
+from centroids import HEADING_TAGS_PATTERN
+
+SIMHASH_BITS = 64
+# Signatures within SIMHASH_BANDS - 1 bits of each other agree exactly on at least one band (pigeonhole),
+# so looking up candidates by band finds every near-duplicate up to that distance
+SIMHASH_BANDS = 4
+SHINGLE_SIZE = 3
+
+WORD_PATTERN = re.compile(r"\w+")
+
+
+def get_body_words(text: str) -> list[str]:
+    # The heading hierarchy differs between documents quoting the same boilerplate, only the body is compared
+    match = HEADING_TAGS_PATTERN.search(text or "")
+    body = text[match.end():] if match else (text or "")
+    return WORD_PATTERN.findall(body.lower())
+
+
+def compute_simhash(words: list[str]) -> int:
+    '''
+    64-bit SimHash over word shingles: texts sharing most shingles get signatures a few bits apart.
+    '''
+    shingles = [" ".join(words[index:index + SHINGLE_SIZE]) for index in range(max(len(words) - SHINGLE_SIZE + 1, 1))]
+    weights = [0] * SIMHASH_BITS
+    for shingle in shingles:
+        shingle_hash = int.from_bytes(hashlib.blake2b(shingle.encode("utf-8"), digest_size=8).digest(), "big")
+        for bit in range(SIMHASH_BITS):
+            weights[bit] += 1 if shingle_hash >> bit & 1 else -1
+    return sum(1 << bit for bit, weight in enumerate(weights) if weight > 0)
+
+
+def hamming_distance(signature: int, other: int) -> int:
+    return bin(signature ^ other).count("1")
+
+
+def format_simhash(signature: int) -> str:
+    # Stored as hex, Mongo integers are signed 64-bit
+    return f"{signature:016x}"
+
+
+def get_simhash_bands(signature: int) -> list[str]:
+    band_bits = SIMHASH_BITS // SIMHASH_BANDS
+    mask = (1 << band_bits) - 1
+    return [f"{band}:{signature >> (band * band_bits) & mask:0{band_bits // 4}x}" for band in range(SIMHASH_BANDS)]
+
+
+class SimHashIndex:
+    '''
+    Canonical chunk signatures bucketed by band, for finding the canonical chunk a new chunk near-duplicates.
+    '''
+
+    def __init__(self, max_distance: int):
+        self.max_distance = max_distance
+        self.signatures: dict[str, int] = {}
+        self.buckets: dict[str, list[str]] = {}
+
+    def add(self, chunk_id: str, signature: int):
+        self.signatures[chunk_id] = signature
+        for band in get_simhash_bands(signature):
+            self.buckets.setdefault(band, []).append(chunk_id)
+
+    def find(self, signature: int) -> str:
+        # Closest canonical chunk within max_distance bits, None if there is none
+        best_id, best_distance = None, self.max_distance + 1
+        for band in get_simhash_bands(signature):
+            for chunk_id in self.buckets.get(band, []):
+                distance = hamming_distance(signature, self.signatures[chunk_id])
+                if distance < best_distance:
+                    best_id, best_distance = chunk_id, distance
+        return best_id
+
+
+def collapse_duplicates(results: list[dict], result_count: int) -> list[dict]:
+    # Results arrive best first, keep the first member of each near-duplicate group
+    seen_groups = set()
+    collapsed = []
+    for result in results:
+        group = result.get('canonicalId') or result['id'][0]
+        if group in seen_groups:
+            continue
+        seen_groups.add(group)
+        collapsed.append(result)
+        if len(collapsed) == result_count:
+            break
+    return collapsed
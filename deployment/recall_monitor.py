@@ -0,0 +1,87 @@
+import random
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable
+
+from constants import (
+    RECALL_SAMPLE_RATE,
+    RECALL_WINDOW_SIZE,
+    RECALL_ALERT_THRESHOLD
+)
+
+# Shadow searches queued beyond this are dropped rather than letting the backlog grow
+MAX_PENDING_SHADOW_SEARCHES = 8
+# Too few samples make the window mean noisy, no warning before this many
+MIN_SAMPLES_FOR_ALERT = 20
+
+
+class RecallMonitor:
+    '''
+    Shadows a sample of served searches with an exact search on a background thread and
+    tracks recall@k of the served results over a sliding window of sampled queries.
+    '''
+
+    def __init__(self,
+                 sample_rate: float = RECALL_SAMPLE_RATE,
+                 window_size: int = RECALL_WINDOW_SIZE,
+                 alert_threshold: float = RECALL_ALERT_THRESHOLD):
+        self.sample_rate = sample_rate
+        self.alert_threshold = alert_threshold
+        self.recalls = deque(maxlen=window_size)
+        self.lock = threading.Lock()
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="recall-monitor")
+        self.pending = 0
+        self.sampled = 0
+        self.dropped = 0
+        self.failed = 0
+
+    def maybe_shadow(self, served_ids: list[str], result_count: int, exact_search: Callable[[], list[str]]):
+        '''
+        With probability sample_rate, run exact_search (returning the exact top result_count chunk ids)
+        in the background and record the recall of served_ids against it.
+        '''
+        if self.sample_rate <= 0 or random.random() >= self.sample_rate:
+            return
+        with self.lock:
+            if self.pending >= MAX_PENDING_SHADOW_SEARCHES:
+                self.dropped += 1
+                return
+            self.pending += 1
+        self.executor.submit(self.shadow, list(served_ids), result_count, exact_search)
+
+    def shadow(self, served_ids: list[str], result_count: int, exact_search: Callable[[], list[str]]):
+        try:
+            expected_ids = set(exact_search()[:result_count])
+        except Exception as e:
+            with self.lock:
+                self.pending -= 1
+                self.failed += 1
+            print(f"ERROR: Recall monitor shadow search failed: {e}")
+            return
+
+        recall = len(expected_ids & set(served_ids[:result_count])) / len(expected_ids) if expected_ids else 1.0
+        with self.lock:
+            self.pending -= 1
+            self.sampled += 1
+            self.recalls.append(recall)
+            window_recall = sum(self.recalls) / len(self.recalls)
+            window_count = len(self.recalls)
+
+        print(f"Recall monitor: recall@{result_count} = {recall:.2f}, window mean {window_recall:.3f} over {window_count} queries")
+        if window_count >= MIN_SAMPLES_FOR_ALERT and window_recall < self.alert_threshold:
+            print(f"WARNING: Mean recall {window_recall:.3f} is below {self.alert_threshold}, consider rebuilding the vector index")
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {
+                'sampleRate': self.sample_rate,
+                'sampled': self.sampled,
+                'pending': self.pending,
+                'dropped': self.dropped,
+                'failed': self.failed,
+                'windowSize': len(self.recalls),
+                'meanRecall': sum(self.recalls) / len(self.recalls) if self.recalls else None,
+                'minRecall': min(self.recalls) if self.recalls else None,
+                'alertThreshold': self.alert_threshold
+            }
@@ -0,0 +1,127 @@
+import numpy as np
+
+from centroids import (
+    get_document_key,
+    get_version_key
+)
+
+from vector_utils import (
+    normalize_vectors,
+    top_k_indices,
+    unwrap_field
+)
+
+# Target chunks scored against the whole corpus per matrix product, bounds the score matrix held at once
+NEIGHBOUR_BLOCK_SIZE = 256
+
+
+class NeighbourGroups:
+    '''
+    Upload, document version and near-duplicate group of every row of the neighbour matrix.
+    Superseded chunks are never listed as neighbours, nor are other versions of the chunk's own
+    document or near-duplicates of the chunk, which repeat it almost verbatim.
+    '''
+
+    def __init__(self, upload_ids: np.ndarray, version_ids: np.ndarray, duplicate_ids: np.ndarray, superseded: np.ndarray):
+        self.upload_ids = upload_ids
+        self.version_ids = version_ids
+        self.duplicate_ids = duplicate_ids
+        self.superseded = superseded
+
+    def excluded(self, rows: np.ndarray, columns: np.ndarray) -> np.ndarray:
+        # (rows, columns) mask of the pairs that are never neighbours
+        other_versions = ((self.version_ids[rows, None] == self.version_ids[None, columns])
+                          & (self.upload_ids[rows, None] != self.upload_ids[None, columns]))
+        duplicates = self.duplicate_ids[rows, None] == self.duplicate_ids[None, columns]
+        return other_versions | duplicates | self.superseded[None, columns]
+
+
+def compute_neighbours(chunk_ids: list[str], matrix: np.ndarray, target_rows: np.ndarray, neighbour_count: int, groups: NeighbourGroups) -> dict[str, list[dict]]:
+    '''
+    Top neighbour_count chunks by cosine similarity for each target row of the normalized matrix,
+    excluding the chunk itself, stored on the chunk as relatedChunks: [{id, similarityScore}].
+    '''
+    related = {}
+    all_rows = np.arange(matrix.shape[0])
+    for block_start in range(0, len(target_rows), NEIGHBOUR_BLOCK_SIZE):
+        block_rows = target_rows[block_start:block_start + NEIGHBOUR_BLOCK_SIZE]
+        block_scores = matrix[block_rows] @ matrix.T
+        block_scores[np.arange(len(block_rows)), block_rows] = -np.inf
+        block_scores[groups.excluded(block_rows, all_rows)] = -np.inf
+        for row, scores in zip(block_rows, block_scores):
+            related[chunk_ids[row]] = [
+                {'id': chunk_ids[index], 'similarityScore': float(scores[index])}
+                for index in top_k_indices(scores, neighbour_count)
+                if np.isfinite(scores[index])
+            ]
+    return related
+
+
+def find_affected_rows(matrix: np.ndarray, related_chunks: list, new_rows: np.ndarray, neighbour_count: int, groups: NeighbourGroups) -> np.ndarray:
+    '''
+    Rows whose stored neighbour list could change once new_rows were added: the new rows themselves,
+    rows with fewer than neighbour_count neighbours, and rows scoring a new row above their weakest neighbour.
+    '''
+    affected = np.zeros(matrix.shape[0], dtype=bool)
+    affected[new_rows] = True
+    if not len(new_rows):
+        return np.flatnonzero(affected)
+    weakest_scores = np.asarray([
+        related[-1]['similarityScore'] if related and len(related) >= neighbour_count else -np.inf
+        for related in related_chunks
+    ], dtype=np.float32)
+    for block_start in range(0, matrix.shape[0], NEIGHBOUR_BLOCK_SIZE):
+        block = slice(block_start, block_start + NEIGHBOUR_BLOCK_SIZE)
+        new_scores = matrix[block] @ matrix[new_rows].T
+        new_scores[groups.excluded(np.arange(matrix.shape[0])[block], new_rows)] = -np.inf
+        affected[block] |= new_scores.max(axis=1) > weakest_scores[block]
+    return np.flatnonzero(affected)
+
+
+def merge_new_neighbours(chunk_ids: list[str], matrix: np.ndarray, related_chunks: list, target_rows: np.ndarray, new_rows: np.ndarray, neighbour_count: int, groups: NeighbourGroups) -> dict[str, list[dict]]:
+    '''
+    Neighbour lists of target_rows once new_rows were added, from one (targets, new rows) matrix product.
+    A stored list already holds the best of the rest of the corpus, so only new rows can displace its entries.
+    Only the lists that change are returned.
+    '''
+    related = {}
+    new_ids = {chunk_ids[row] for row in new_rows}
+    new_scores = matrix[target_rows] @ matrix[new_rows].T
+    new_scores[groups.excluded(target_rows, new_rows)] = -np.inf
+    for row, scores in zip(target_rows, new_scores):
+        stored = related_chunks[row] or []
+        merged = [neighbour for neighbour in stored if neighbour['id'] not in new_ids]
+        merged += [
+            {'id': chunk_ids[new_rows[column]], 'similarityScore': float(scores[column])}
+            for column in np.flatnonzero(np.isfinite(scores))
+        ]
+        merged.sort(key=lambda neighbour: neighbour['similarityScore'], reverse=True)
+        if merged[:neighbour_count] != stored:
+            related[chunk_ids[row]] = merged[:neighbour_count]
+    return related
+
+
+def get_duplicate_group(document: dict) -> str:
+    # Near-duplicates point at their canonical chunk, which heads the group
+    return document.get('canonicalId') or unwrap_field(document['id'])
+
+
+def load_neighbour_matrix(documents) -> tuple[list[str], np.ndarray, list, NeighbourGroups]:
+    # Chunk ids, their normalized vectors, their currently stored neighbour lists and their groups, in one pass
+    chunk_ids, vectors, related_chunks = [], [], []
+    upload_ids, version_ids, duplicate_ids, superseded = {}, {}, {}, []
+    upload_rows, version_rows, duplicate_rows = [], [], []
+    for document in documents:
+        if not document.get('contentVector'):
+            continue
+        chunk_ids.append(unwrap_field(document['id']))
+        vectors.append(document['contentVector'])
+        related_chunks.append(document.get('relatedChunks'))
+        upload_rows.append(upload_ids.setdefault(get_document_key(document), len(upload_ids)))
+        version_rows.append(version_ids.setdefault(get_version_key(document), len(version_ids)))
+        duplicate_rows.append(duplicate_ids.setdefault(get_duplicate_group(document), len(duplicate_ids)))
+        superseded.append(document.get('isCurrent') is False)
+    matrix = normalize_vectors(vectors) if vectors else np.empty((0, 0), dtype=np.float32)
+    groups = NeighbourGroups(np.asarray(upload_rows, dtype=np.int64), np.asarray(version_rows, dtype=np.int64),
+                             np.asarray(duplicate_rows, dtype=np.int64), np.asarray(superseded, dtype=bool))
+    return chunk_ids, matrix, related_chunks, groups
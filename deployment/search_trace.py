@@ -0,0 +1,84 @@
+import contextvars
+import threading
+import time
+from contextlib import contextmanager
+
+_current_trace = contextvars.ContextVar("search_trace", default=None)
+
+
+class SearchTrace:
+    '''
+    Diagnostics for one /search?explain=true request: wall time per stage in the order the stages
+    finished, plus details recorded along the way (search path, candidate counts, index parameters, bytes).
+    '''
+
+    def __init__(self):
+        self.stages: list[dict] = []
+        self.details: dict = {}
+        # Partitions may be searched on worker threads that share this trace
+        self.lock = threading.Lock()
+
+    @contextmanager
+    def stage(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stages.append({'stage': name, 'ms': round((time.perf_counter() - start) * 1000, 3)})
+
+    def to_dict(self) -> dict:
+        return {'stages': self.stages, **self.details}
+
+
+@contextmanager
+def tracing():
+    trace = SearchTrace()
+    token = _current_trace.set(trace)
+    try:
+        yield trace
+    finally:
+        _current_trace.reset(token)
+
+
+def get_trace() -> SearchTrace:
+    return _current_trace.get()
+
+
+@contextmanager
+def trace_stage(name: str):
+    # No-op unless the current request is being explained
+    trace = _current_trace.get()
+    if trace is None:
+        yield
+        return
+    with trace.stage(name):
+        yield
+
+
+def trace_detail(key: str, value, overwrite: bool = True):
+    trace = _current_trace.get()
+    if trace is not None:
+        with trace.lock:
+            if overwrite or key not in trace.details:
+                trace.details[key] = value
+
+
+def trace_count(key: str, amount: int):
+    trace = _current_trace.get()
+    if trace is not None:
+        with trace.lock:
+            trace.details[key] = trace.details.get(key, 0) + amount
+
+
+def trace_append(key: str, value):
+    trace = _current_trace.get()
+    if trace is not None:
+        with trace.lock:
+            trace.details.setdefault(key, []).append(value)
+
+
+def trace_entry(key: str, name: str, value):
+    trace = _current_trace.get()
+    if trace is not None:
+        with trace.lock:
+            trace.details.setdefault(key, {})[name] = value
@@ -0,0 +1,51 @@
+import threading
+from concurrent.futures import Future
+from typing import Callable
+
+
+class SingleFlight:
+    '''
+    Coalesces concurrent calls with the same key: the first caller runs the function,
+    callers arriving while it is in flight wait for and share its result (or exception).
+    Nothing is kept once the call completes, later calls run again.
+    '''
+
+    def __init__(self):
+        self.in_flight: dict = {}
+        self.lock = threading.Lock()
+        self.executions = 0
+        self.coalesced = 0
+
+    def do(self, key, function: Callable, *args, **kwargs):
+        with self.lock:
+            future = self.in_flight.get(key)
+            is_leader = future is None
+            if is_leader:
+                future = Future()
+                self.in_flight[key] = future
+                self.executions += 1
+            else:
+                self.coalesced += 1
+
+        if not is_leader:
+            return future.result()
+
+        try:
+            result = function(*args, **kwargs)
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            with self.lock:
+                del self.in_flight[key]
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {
+                'inFlight': len(self.in_flight),
+                'executions': self.executions,
+                'coalesced': self.coalesced
+            }
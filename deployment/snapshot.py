@@ -0,0 +1,181 @@
+import argparse
+import hashlib
+import json
+import os
+from datetime import datetime
+from typing import Callable
+
+import numpy as np
+
+from vector_index import VectorIndex
+
+from vector_utils import (
+    normalize_vectors,
+    unwrap_field
+)
+
+VECTORS_FILENAME = "vectors.npy"
+METADATA_FILENAME = "metadata.json"
+# Codes, quantizers and graphs of a local index configuration built over the snapshot, see VectorIndex.state_key
+INDEX_STATE_FILENAME = "index-{state_key}.npz"
+DATE_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+
+def compute_corpus_version(chunk_ids) -> str:
+    # Any upload or delete changes the set of chunk ids and therefore the version
+    digest = hashlib.sha1()
+    for chunk_id in sorted(chunk_ids):
+        digest.update(chunk_id.encode("utf-8"))
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+def read_vectorized_backups(paths: list[str]) -> list[dict]:
+    # *_parsed_vectorized.json backups store the date as a string, restore the datetime used in the collection
+    documents = []
+    for path in paths:
+        with open(path, "r", encoding="utf-8") as file:
+            for document in json.load(file):
+                document['date'] = [datetime.strptime(unwrap_field(document['date']), DATE_FORMAT)]
+                documents.append(document)
+    return documents
+
+
+def write_snapshot(documents, directory: str, corpus_version: str = None, event_sequence: int = 0) -> str:
+    '''
+    Write a float32 matrix of unit-normalized vectors (np.save pads the header so the data is 64 byte aligned)
+    and a metadata sidecar keyed by chunk id. Rows are grouped by client so each client is one contiguous slice.
+    event_sequence is the corpus event sequence read before documents, workers replay the events after it.
+    '''
+    documents = [document for document in documents if document.get('contentVector')]
+    documents.sort(key=lambda document: (unwrap_field(document['clientName']), unwrap_field(document['id'])))
+    if corpus_version is None:
+        corpus_version = compute_corpus_version(unwrap_field(document['id']) for document in documents)
+
+    chunks = {}
+    for row, document in enumerate(documents):
+        record = {key: value for key, value in document.items() if key not in ('_id', 'contentVector')}
+        date = unwrap_field(record['date'])
+        record['date'] = [date.strftime(DATE_FORMAT) if isinstance(date, datetime) else date]
+        chunks[unwrap_field(document['id'])] = {'row': row, **record}
+
+    os.makedirs(directory, exist_ok=True)
+    vectors = normalize_vectors([document['contentVector'] for document in documents]) if documents else np.empty((0, 0), dtype=np.float32)
+
+    # Write to temporary files first so concurrently starting workers never map a half written snapshot
+    vectors_path = os.path.join(directory, VECTORS_FILENAME)
+    metadata_path = os.path.join(directory, METADATA_FILENAME)
+    with open(f"{vectors_path}.{os.getpid()}.tmp", "wb") as file:
+        np.save(file, vectors)
+    with open(f"{metadata_path}.{os.getpid()}.tmp", "w", encoding="utf-8") as file:
+        json.dump({
+            'corpusVersion': corpus_version,
+            'eventSequence': event_sequence,
+            'dimensions': int(vectors.shape[1]),
+            'createdAt': datetime.now().strftime(DATE_FORMAT),
+            'chunks': chunks
+        }, file)
+    os.replace(f"{vectors_path}.{os.getpid()}.tmp", vectors_path)
+    os.replace(f"{metadata_path}.{os.getpid()}.tmp", metadata_path)
+
+    print(f"Wrote vector snapshot of {len(documents)} chunks to {directory} (version {corpus_version[:12]})")
+    return corpus_version
+
+
+class VectorSnapshot:
+    '''
+    A snapshot opened with mmap: vectors are paged in on demand and shared through the OS page cache.
+    Chunks uploaded after the snapshot was written are not in it, get_vectors reads those through fallback_loader.
+    Workers never rewrite it, python maintenance.py refresh-snapshot does.
+    '''
+
+    def __init__(self, directory: str, fallback_loader: Callable[[list[dict]], list] = None):
+        self.directory = directory
+        self.fallback_loader = fallback_loader
+        with open(os.path.join(directory, METADATA_FILENAME), "r", encoding="utf-8") as file:
+            metadata = json.load(file)
+        self.corpus_version = metadata['corpusVersion']
+        self.event_sequence = metadata.get('eventSequence', 0)
+        self.dimensions = metadata['dimensions']
+        self.vectors = np.load(os.path.join(directory, VECTORS_FILENAME), mmap_mode='r')
+        if len(metadata['chunks']) != self.vectors.shape[0]:
+            raise ValueError(f"Snapshot {directory} is inconsistent: {len(metadata['chunks'])} chunks, {self.vectors.shape[0]} vectors")
+
+        self.records = [None] * len(metadata['chunks'])
+        self.row_by_id = {}
+        for chunk_id, chunk in metadata['chunks'].items():
+            row = chunk.pop('row')
+            chunk['date'] = [datetime.strptime(unwrap_field(chunk['date']), DATE_FORMAT)]
+            self.records[row] = chunk
+            self.row_by_id[chunk_id] = row
+
+    def __len__(self):
+        return len(self.records)
+
+    def client_slices(self) -> dict[str, slice]:
+        slices = {}
+        start = 0
+        for row in range(1, len(self.records) + 1):
+            client_name = unwrap_field(self.records[start]['clientName'])
+            if row == len(self.records) or unwrap_field(self.records[row]['clientName']) != client_name:
+                slices[client_name] = slice(start, row)
+                start = row
+        return slices
+
+    def get_vectors(self, records: list[dict]) -> np.ndarray:
+        rows = [self.row_by_id.get(unwrap_field(record['id'])) for record in records]
+        missing = [position for position, row in enumerate(rows) if row is None]
+        if not missing:
+            return self.vectors[rows]
+        if self.fallback_loader is None:
+            raise KeyError(f"Chunk {unwrap_field(records[missing[0]]['id'])} is not in the snapshot {self.directory}")
+        vectors = np.empty((len(records), self.vectors.shape[1]), dtype=np.float32)
+        present = [position for position, row in enumerate(rows) if row is not None]
+        vectors[present] = self.vectors[[rows[position] for position in present]]
+        vectors[missing] = normalize_vectors(self.fallback_loader([records[position] for position in missing]))
+        return vectors
+
+    def read_index_state(self, state_key: str) -> dict[str, dict]:
+        # Per client arrays saved by write_index_state, None when missing or saved for another corpus version
+        path = os.path.join(self.directory, INDEX_STATE_FILENAME.format(state_key=state_key))
+        try:
+            with np.load(path, allow_pickle=False) as saved:
+                metadata = json.loads(str(saved['metadata']))
+                if metadata['corpusVersion'] != self.corpus_version:
+                    return None
+                states = {client_name: {} for client_name in metadata['clients']}
+                for name in saved.files:
+                    if name != 'metadata':
+                        position, key = name.split(':', 1)
+                        states[metadata['clients'][int(position)]][key] = saved[name]
+                return states
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError, KeyError) as e:
+            print(f"WARNING: Unable to read saved index state {path}: {e}")
+            return None
+
+    def write_index_state(self, state_key: str, states: dict[str, dict]):
+        clients = list(states)
+        arrays = {f"{position}:{key}": value for position, client_name in enumerate(clients) for key, value in states[client_name].items()}
+        arrays['metadata'] = np.asarray(json.dumps({'corpusVersion': self.corpus_version, 'clients': clients}))
+        path = os.path.join(self.directory, INDEX_STATE_FILENAME.format(state_key=state_key))
+        try:
+            with open(f"{path}.{os.getpid()}.tmp", "wb") as file:
+                np.savez(file, **arrays)
+            os.replace(f"{path}.{os.getpid()}.tmp", path)
+            print(f"Saved index state {state_key} of {len(clients)} clients to {self.directory}")
+        except OSError as e:
+            print(f"WARNING: Unable to save index state {path}: {e}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build a memory-mapped vector snapshot from *_parsed_vectorized.json backups")
+    parser.add_argument("backups", nargs="+", help="Paths to *_parsed_vectorized.json files")
+    parser.add_argument("--output", required=True, help="Snapshot directory")
+    parser.add_argument("--index-kind", choices=["exact", "hnsw"], help="Also build the local index and save its codes and graph in the snapshot")
+    parser.add_argument("--storage", default="float32", choices=["float32", "int8", "pq"])
+    arguments = parser.parse_args()
+    write_snapshot(read_vectorized_backups(arguments.backups), arguments.output)
+    if arguments.index_kind:
+        VectorIndex.from_snapshot(VectorSnapshot(arguments.output), index_kind=arguments.index_kind, storage=arguments.storage)
@@ -0,0 +1,74 @@
+import unittest
+from unittest import mock
+
+# api_methods pulls in the OpenAI, Azure and Mongo clients, which a bare test environment may not have
+try:
+    import api_methods
+except ImportError:
+    api_methods = None
+
+
+def make_results(scores: list[float]) -> list[dict]:
+    return [{'id': [f"chunk_{position}"], 'similarityScore': score} for position, score in enumerate(scores)]
+
+
+def result_ids(results: list[dict]) -> list[str]:
+    return [result['id'][0] for result in results]
+
+
+@unittest.skipIf(api_methods is None, "api_methods dependencies are not installed")
+class SelectExcerptsTest(unittest.TestCase):
+
+    def select(self, scores: list[float], **kwargs) -> list[str]:
+        return result_ids(api_methods.select_excerpts(make_results(scores), **kwargs))
+
+    def test_stops_below_the_minimum_score(self):
+        self.assertEqual(self.select([0.9, 0.88, 0.7, 0.69], min_count=1, max_count=10, min_score=0.75, max_score_gap=0.5), ["chunk_0", "chunk_1"])
+
+    def test_stops_at_a_score_gap(self):
+        self.assertEqual(self.select([0.95, 0.94, 0.85, 0.84], min_count=1, max_count=10, min_score=0.5, max_score_gap=0.05), ["chunk_0", "chunk_1"])
+
+    def test_keeps_at_least_min_count(self):
+        self.assertEqual(self.select([0.6, 0.3, 0.2, 0.1], min_count=3, max_count=10, min_score=0.75, max_score_gap=0.05), ["chunk_0", "chunk_1", "chunk_2"])
+
+    def test_keeps_at_most_max_count(self):
+        self.assertEqual(len(self.select([0.9] * 20, min_count=1, max_count=4, min_score=0.5, max_score_gap=0.05)), 4)
+
+    def test_fewer_results_than_min_count(self):
+        self.assertEqual(self.select([0.1], min_count=3, max_count=10, min_score=0.75, max_score_gap=0.05), ["chunk_0"])
+        self.assertEqual(self.select([], min_count=3, max_count=10, min_score=0.75, max_score_gap=0.05), [])
+
+
+@unittest.skipIf(api_methods is None, "api_methods dependencies are not installed")
+class ComputeCompletionTest(unittest.TestCase):
+
+    def setUp(self):
+        self.response_list = make_results([0.9, 0.89, 0.5, 0.4])
+        search_patcher = mock.patch("api_methods.search", return_value=self.response_list)
+        answer_patcher = mock.patch("api_methods.answer_from_excerpts", return_value="answer")
+        search_patcher.start()
+        self.answer_from_excerpts = answer_patcher.start()
+        self.addCleanup(search_patcher.stop)
+        self.addCleanup(answer_patcher.stop)
+
+    def excerpts_answered_from(self) -> list[str]:
+        return result_ids(self.answer_from_excerpts.call_args.args[1])
+
+    def test_adaptive_selection_trims_vector_results(self):
+        api_methods.compute_completion("query", 4, adaptive=True)
+        self.assertEqual(self.excerpts_answered_from(), ["chunk_0", "chunk_1"])
+
+    def test_adaptive_selection_ignores_other_search_modes(self):
+        # Rank fusion scores are not cosine scores, the cut-offs would drop everything
+        api_methods.compute_completion("query", 4, search_mode="hybrid", adaptive=True)
+        self.assertEqual(len(self.excerpts_answered_from()), 4)
+
+    def test_without_adaptive_every_result_is_used(self):
+        response, results = api_methods.compute_completion("query", 4)
+        self.assertEqual(response, "answer")
+        self.assertEqual(len(self.excerpts_answered_from()), 4)
+        self.assertEqual(len(results), 4)
+
+
+if __name__ == "__main__":
+    unittest.main()
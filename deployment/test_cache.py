@@ -0,0 +1,183 @@
+import unittest
+from unittest import mock
+
+from cache import (
+    GenerationalCache,
+    LRUCache,
+    SemanticAnswerCache
+)
+
+from index_events import CorpusGeneration
+
+
+class FakeClock:
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+class LRUCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+        patcher = mock.patch("cache.time.monotonic", self.clock)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_evicts_least_recently_used(self):
+        cache = LRUCache(2)
+        cache.set("a", 1)
+        cache.set("b", 2)
+        # Reading a makes b the least recently used
+        self.assertEqual(cache.get("a"), 1)
+        cache.set("c", 3)
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual(cache.get("a"), 1)
+        self.assertEqual(cache.get("c"), 3)
+        self.assertEqual(cache.stats()['evictions'], 1)
+
+    def test_set_replaces_and_refreshes(self):
+        cache = LRUCache(2)
+        cache.set("a", 1)
+        cache.set("b", 2)
+        cache.set("a", 10)
+        cache.set("c", 3)
+        self.assertEqual(len(cache), 2)
+        self.assertEqual(cache.get("a"), 10)
+        self.assertIsNone(cache.get("b"))
+
+    def test_entries_expire_after_ttl(self):
+        cache = LRUCache(10, ttl_seconds=60)
+        cache.set("a", 1)
+        self.clock.now += 59
+        self.assertEqual(cache.get("a"), 1)
+        self.clock.now += 1
+        self.assertEqual(cache.get("a", "expired"), "expired")
+        self.assertEqual(len(cache), 0)
+
+    def test_without_ttl_entries_never_expire(self):
+        cache = LRUCache(10)
+        cache.set("a", 1)
+        self.clock.now += 10 ** 9
+        self.assertEqual(cache.get("a"), 1)
+
+    def test_stale_entries_are_dropped(self):
+        cache = LRUCache(10)
+        cache.set("a", 1)
+        self.assertEqual(cache.get("a", is_stale=lambda value: value != 1), 1)
+        self.assertIsNone(cache.get("a", is_stale=lambda value: value == 1))
+        self.assertEqual(len(cache), 0)
+
+    def test_stats_pop_and_clear(self):
+        cache = LRUCache(10)
+        cache.set("a", 1)
+        cache.set("b", 2)
+        cache.get("a")
+        cache.get("missing")
+        self.assertEqual(cache.stats(), {'size': 2, 'maxSize': 10, 'hits': 1, 'misses': 1, 'evictions': 0, 'hitRate': 0.5})
+        self.assertEqual(cache.pop("a"), 1)
+        self.assertEqual(cache.pop("a", "gone"), "gone")
+        cache.clear()
+        self.assertEqual(len(cache), 0)
+
+
+class GenerationalCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.generation = CorpusGeneration()
+        self.cache = GenerationalCache(10, self.generation.get)
+
+    def test_entries_of_an_older_generation_are_misses(self):
+        self.cache.set("query", ["a"])
+        self.assertEqual(self.cache.get("query"), ["a"])
+        self.generation.documents_added([])
+        self.assertIsNone(self.cache.get("query"))
+        self.cache.set("query", ["b"])
+        self.generation.documents_removed(["b"])
+        self.assertEqual(self.cache.get("query", "stale"), "stale")
+
+    def test_generation_read_before_computing_is_kept(self):
+        # A change lands while the value is being computed, so the entry is stale on arrival
+        generation = self.generation.get()
+        self.generation.bump()
+        self.cache.set("query", ["a"], generation=generation)
+        self.assertIsNone(self.cache.get("query"))
+
+    def test_shared_sequence_moves_the_generation_on(self):
+        self.cache.set("query", ["a"])
+        self.generation.set_shared(3)
+        self.assertIsNone(self.cache.get("query"))
+        self.cache.set("query", ["b"])
+        # An older sequence read by a slower poll never moves it back
+        self.generation.set_shared(2)
+        self.assertEqual(self.generation.get(), 3)
+        self.assertEqual(self.cache.get("query"), ["b"])
+
+
+class SemanticAnswerCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+        patcher = mock.patch("cache.time.monotonic", self.clock)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_without_threshold_only_the_same_embedding_matches(self):
+        cache = SemanticAnswerCache(10)
+        cache.set([1.0, 0.0], ["a", "b"], 100, "gpt", "answer")
+        # Scaling keeps the direction, so it is the same embedding once normalized
+        self.assertEqual(cache.get([2.0, 0.0], ["a", "b"], 100, "gpt"), "answer")
+        self.assertIsNone(cache.get([1.0, 0.01], ["a", "b"], 100, "gpt"))
+
+    def test_threshold_hits_and_misses(self):
+        cache = SemanticAnswerCache(10, similarity_threshold=0.95)
+        cache.set([1.0, 0.0], ["a"], 100, "gpt", "answer")
+        self.assertEqual(cache.get([1.0, 0.2], ["a"], 100, "gpt"), "answer")
+        self.assertIsNone(cache.get([1.0, 0.5], ["a"], 100, "gpt"))
+        self.assertEqual(cache.stats()['hits'], 1)
+        self.assertEqual(cache.stats()['misses'], 1)
+
+    def test_best_match_above_threshold_wins(self):
+        cache = SemanticAnswerCache(10, similarity_threshold=0.9)
+        cache.set([1.0, 0.3], ["a"], 100, "gpt", "further")
+        cache.set([1.0, 0.1], ["a"], 100, "gpt", "closer")
+        cache.set([1.0, 0.0], ["b"], 100, "gpt", "other excerpts")
+        self.assertEqual(cache.get([1.0, 0.0], ["a"], 100, "gpt"), "closer")
+
+    def test_key_includes_model_word_limit_and_chunk_order(self):
+        cache = SemanticAnswerCache(10, similarity_threshold=0.9)
+        cache.set([1.0, 0.0], ["a", "b"], 100, "gpt", "answer")
+        self.assertIsNone(cache.get([1.0, 0.0], ["a", "b"], 100, "other-model"))
+        self.assertIsNone(cache.get([1.0, 0.0], ["a", "b"], 200, "gpt"))
+        self.assertIsNone(cache.get([1.0, 0.0], ["b", "a"], 100, "gpt"))
+
+    def test_changed_chunks_invalidate_answers_citing_them(self):
+        cache = SemanticAnswerCache(10)
+        cache.set([1.0, 0.0], ["a", "b"], 100, "gpt", "first")
+        cache.set([0.0, 1.0], ["c"], 100, "gpt", "second")
+        cache.documents_added([{'id': ["b"]}])
+        self.assertIsNone(cache.get([1.0, 0.0], ["a", "b"], 100, "gpt"))
+        cache.documents_removed(["c"])
+        self.assertEqual(len(cache), 0)
+        self.assertEqual(cache.stats()['invalidations'], 2)
+        self.assertEqual(cache.entry_ids_by_chunk, {})
+        self.assertEqual(cache.entry_ids_by_key, {})
+
+    def test_eviction_and_expiry(self):
+        cache = SemanticAnswerCache(2, ttl_seconds=60)
+        cache.set([1.0, 0.0], ["a"], 100, "gpt", "a")
+        cache.set([1.0, 0.0], ["b"], 100, "gpt", "b")
+        self.assertEqual(cache.get([1.0, 0.0], ["a"], 100, "gpt"), "a")
+        cache.set([1.0, 0.0], ["c"], 100, "gpt", "c")
+        self.assertIsNone(cache.get([1.0, 0.0], ["b"], 100, "gpt"))
+        self.assertEqual(cache.stats()['evictions'], 1)
+        self.clock.now += 60
+        self.assertIsNone(cache.get([1.0, 0.0], ["a"], 100, "gpt"))
+        self.assertEqual(len(cache), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
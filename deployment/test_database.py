@@ -0,0 +1,116 @@
+import unittest
+from datetime import datetime
+from unittest import mock
+
+# Optional, only the tests running queries against an in-memory Mongo need it
+try:
+    import mongomock
+except ImportError:
+    mongomock = None
+
+from database import DatabaseClient
+
+from vector_utils import unwrap_field
+
+
+class CreateIndicesTest(unittest.TestCase):
+
+    def setUp(self):
+        patcher = mock.patch("database.pymongo.MongoClient")
+        mongo_client = patcher.start()
+        self.addCleanup(patcher.stop)
+        # One mock per collection name, like pymongo
+        collections = {}
+        mongo_client.return_value.__getitem__.return_value.__getitem__.side_effect = \
+            lambda name: collections.setdefault(name, mock.MagicMock(name=name))
+        self.db_client = DatabaseClient("mongodb://localhost", "db", "chunks", "centroids", "queries")
+        # An existing vector index, so no createIndexes command is sent
+        self.db_client.get_vector_index = mock.Mock(return_value={})
+
+    @staticmethod
+    def indexed_fields(collection) -> list:
+        return [call.args[0][0][0] for call in collection.create_index.call_args_list]
+
+    def test_create_indices_creates_centroid_indices(self):
+        self.db_client.centroid_collection.count_documents.return_value = 3
+        self.db_client.create_indices()
+
+        centroid_fields = self.indexed_fields(self.db_client.centroid_collection)
+        self.assertIn("level", centroid_fields)
+        self.assertIn("documentKey", centroid_fields)
+        self.assertIn("id", centroid_fields)
+        self.db_client.get_vector_index.assert_any_call(self.db_client.centroid_collection, "CentroidVectorSearchIndex")
+
+    def test_centroid_indices_do_not_cascade_again(self):
+        self.db_client.centroid_collection.count_documents.return_value = 3
+        with mock.patch.object(self.db_client, "create_query_indices") as create_query_indices:
+            self.db_client.create_indices()
+        create_query_indices.assert_called_once()
+        self.assertEqual(self.indexed_fields(self.db_client.centroid_collection).count("level"), 1)
+
+    def test_empty_centroid_collection_is_filled_first(self):
+        self.db_client.centroid_collection.count_documents.return_value = 0
+        with mock.patch.object(self.db_client, "update_centroids") as update_centroids:
+            self.db_client.create_indices()
+        update_centroids.assert_called_once_with()
+
+    def test_without_centroid_collection(self):
+        self.db_client.centroid_collection = None
+        self.db_client.create_indices()
+        self.assertIn("clientName", self.indexed_fields(self.db_client.collection))
+
+
+@unittest.skipIf(mongomock is None, "mongomock is not installed")
+class UpdateCurrentVersionsTest(unittest.TestCase):
+
+    def setUp(self):
+        patcher = mock.patch("database.pymongo.MongoClient", mongomock.MongoClient)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.db_client = DatabaseClient("mongodb://localhost", "db", "chunks", "centroids")
+        self.insert_version("Alpha", "Responses", datetime(2023, 1, 1), ["a1", "a2"])
+        self.insert_version("Alpha", "Responses", datetime(2023, 2, 1), ["b1", "b2"])
+        self.insert_version("Beta", "Responses", datetime(2023, 1, 1), ["c1"])
+
+    def insert_version(self, client_name: str, document_name: str, date: datetime, chunk_ids: list[str]):
+        self.db_client.collection.insert_many([
+            {'id': [chunk_id], 'clientName': [client_name], 'documentName': [document_name], 'date': [date]}
+            for chunk_id in chunk_ids
+        ])
+        self.db_client.centroid_collection.insert_one(
+            {'id': f"{client_name}_{date:%m}", 'clientName': [client_name], 'documentName': [document_name], 'date': [date]})
+
+    def flags(self, collection) -> dict:
+        return {unwrap_field(document['id']): document.get('isCurrent') for document in collection.find({}, {'_id': 0})}
+
+    def test_newest_upload_of_each_document_is_current(self):
+        current_ids, superseded_ids = self.db_client.update_current_versions()
+        self.assertEqual(sorted(current_ids), ["b1", "b2", "c1"])
+        self.assertEqual(sorted(superseded_ids), ["a1", "a2"])
+        self.assertEqual(self.flags(self.db_client.collection), {"a1": False, "a2": False, "b1": True, "b2": True, "c1": True})
+        self.assertEqual(self.flags(self.db_client.centroid_collection), {"Alpha_01": False, "Alpha_02": True, "Beta_01": True})
+
+    def test_only_changed_chunks_are_returned(self):
+        self.db_client.update_current_versions()
+        self.assertEqual(self.db_client.update_current_versions(), ([], []))
+        self.insert_version("Alpha", "Responses", datetime(2023, 3, 1), ["d1"])
+        current_ids, superseded_ids = self.db_client.update_current_versions({("Alpha", "Responses")})
+        self.assertEqual(current_ids, ["d1"])
+        self.assertEqual(sorted(superseded_ids), ["b1", "b2"])
+
+    def test_deleting_the_newest_upload_restores_the_previous_one(self):
+        self.db_client.update_current_versions()
+        self.db_client.collection.delete_many({'id': {'$in': ["b1", "b2"]}})
+        current_ids, superseded_ids = self.db_client.update_current_versions({("Alpha", "Responses")})
+        self.assertEqual(sorted(current_ids), ["a1", "a2"])
+        self.assertEqual(superseded_ids, [])
+
+    def test_only_the_given_version_keys_are_refreshed(self):
+        self.assertEqual(self.db_client.update_current_versions(set()), ([], []))
+        current_ids, _ = self.db_client.update_current_versions({("Beta", "Responses")})
+        self.assertEqual(current_ids, ["c1"])
+        self.assertIsNone(self.flags(self.db_client.collection)["b1"])
+
+
+if __name__ == "__main__":
+    unittest.main()
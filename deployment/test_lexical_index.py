@@ -0,0 +1,104 @@
+import math
+import unittest
+from datetime import datetime
+
+from lexical_index import (
+    BM25Index,
+    reciprocal_rank_fusion,
+    tokenize
+)
+
+
+def make_document(chunk_id: str, content: str, client_name: str = "Alpha", document_name: str = "Responses", date: datetime = datetime(2023, 1, 1)) -> dict:
+    return {
+        'id': [chunk_id],
+        'clientName': [client_name],
+        'documentName': [document_name],
+        'date': [date],
+        'content': [content],
+        'contentVector': [0.0]
+    }
+
+
+def result_ids(results: list[dict]) -> list[str]:
+    return [result['id'][0] for result in results]
+
+
+class TokenizeTest(unittest.TestCase):
+
+    def test_lowercases_and_drops_stop_words(self):
+        self.assertEqual(tokenize("What is the AUM of the Fund in 2023?"), ["aum", "fund", "2023"])
+        self.assertEqual(tokenize(None), [])
+
+
+class BM25IndexTest(unittest.TestCase):
+
+    def setUp(self):
+        self.documents = [
+            make_document("esg", "Our ESG policy covers responsible investment and ESG reporting."),
+            make_document("aum", "Assets under management (AUM) were 2 billion at year end."),
+            make_document("team", "The investment team has twelve members.", client_name="Beta"),
+            make_document("long", "Investment " + "filler " * 40, client_name="Beta", date=datetime(2023, 6, 1)),
+        ]
+        self.index = BM25Index.from_documents(self.documents)
+
+    def test_scores_follow_okapi_bm25(self):
+        results = self.index.search("AUM", 5)
+        self.assertEqual(result_ids(results), ["aum"])
+        # One posting among four chunks, term frequency 1
+        idf = math.log(1 + (4 - 1 + 0.5) / (1 + 0.5))
+        lengths = [len(tokenize(document['content'][0])) for document in self.documents]
+        length_norm = 1.2 * (1 - 0.75 + 0.75 * lengths[1] / (sum(lengths) / 4))
+        self.assertAlmostEqual(results[0]['similarityScore'], idf * (1.2 + 1) / (1 + length_norm))
+        self.assertNotIn('contentVector', results[0])
+
+    def test_term_frequency_and_length_normalization(self):
+        # "esg" twice beats every other chunk; the short team chunk beats the padded one for "investment"
+        self.assertEqual(result_ids(self.index.search("ESG investment", 1)), ["esg"])
+        self.assertEqual(result_ids(self.index.search("investment", 3))[-1], "long")
+
+    def test_unknown_terms_and_empty_index(self):
+        self.assertEqual(self.index.search("derivatives", 5), [])
+        self.assertEqual(BM25Index().search("investment", 5), [])
+
+    def test_filters(self):
+        self.assertEqual(set(result_ids(self.index.search("investment", 5, client_names=["Beta"]))), {"team", "long"})
+        self.assertEqual(result_ids(self.index.search("investment", 5, start_date=datetime(2023, 3, 1))), ["long"])
+        self.assertEqual(result_ids(self.index.search("investment", 5, current_only=True, client_names=["Beta"])), ["long"])
+
+    def test_updates_and_removals(self):
+        self.index.add_documents([make_document("aum", "Headcount grew to fifty.")])
+        self.assertEqual(self.index.search("AUM", 5), [])
+        self.assertEqual(result_ids(self.index.search("headcount", 5)), ["aum"])
+        self.index.remove_chunks(["esg", "missing"])
+        self.assertEqual(len(self.index), 3)
+        self.assertNotIn("esg", self.index.postings.get("investment", {}))
+        self.assertNotIn("responsible", self.index.postings)
+        self.assertEqual(self.index.total_length, sum(self.index.lengths.values()))
+
+
+class ReciprocalRankFusionTest(unittest.TestCase):
+
+    def test_fuses_by_rank(self):
+        vector_results = [{'id': ["a"], 'similarityScore': 0.9}, {'id': ["b"], 'similarityScore': 0.8}, {'id': ["c"], 'similarityScore': 0.7}]
+        lexical_results = [{'id': ["c"], 'similarityScore': 12.0}, {'id': ["b"], 'similarityScore': 3.0}]
+        fused = reciprocal_rank_fusion([vector_results, lexical_results], 3, k=60)
+        # c (ranks 3 and 1) edges out b (ranks 2 and 2), a appears in one ranking only
+        self.assertEqual(result_ids(fused), ["c", "b", "a"])
+        self.assertAlmostEqual(fused[0]['similarityScore'], 1 / 63 + 1 / 61)
+        self.assertAlmostEqual(fused[1]['similarityScore'], 1 / 62 + 1 / 62)
+        self.assertAlmostEqual(fused[2]['similarityScore'], 1 / 61)
+
+    def test_keeps_the_first_copy_of_each_result(self):
+        fused = reciprocal_rank_fusion([[{'id': ["a"], 'page': [1]}], [{'id': ["a"], 'page': [2]}]], 5)
+        self.assertEqual(len(fused), 1)
+        self.assertEqual(fused[0]['page'], [1])
+
+    def test_result_count(self):
+        rankings = [[{'id': [str(position)]} for position in range(10)]]
+        self.assertEqual(result_ids(reciprocal_rank_fusion(rankings, 3)), ["0", "1", "2"])
+        self.assertEqual(reciprocal_rank_fusion([[], []], 3), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,98 @@
+import unittest
+
+from near_duplicates import (
+    SIMHASH_BANDS,
+    SIMHASH_BITS,
+    SimHashIndex,
+    collapse_duplicates,
+    compute_simhash,
+    format_simhash,
+    get_body_words,
+    get_simhash_bands,
+    hamming_distance
+)
+
+POLICY_TEXT = (
+    "The fund is managed in accordance with the investment policy approved by the board of directors and all "
+    "investments are reviewed quarterly by the investment committee which reports to the board on performance "
+    "risk exposure liquidity and compliance with applicable securities regulation in every jurisdiction where the fund operates"
+)
+
+ESG_TEXT = (
+    "Our environmental social and governance program tracks energy use water consumption and tenant satisfaction "
+    "across every property in the portfolio and results are published annually in a sustainability report"
+)
+
+
+def flip_bits(signature: int, bits: list[int]) -> int:
+    for bit in bits:
+        signature ^= 1 << bit
+    return signature
+
+
+class SimHashTest(unittest.TestCase):
+
+    def test_headings_are_not_compared(self):
+        heading_text = f"Context Heading Tags: Governance > Oversight | Content: {POLICY_TEXT}"
+        self.assertEqual(get_body_words(heading_text), get_body_words(POLICY_TEXT))
+        self.assertEqual(get_body_words(None), [])
+
+    def test_similar_texts_get_close_signatures(self):
+        signature = compute_simhash(get_body_words(POLICY_TEXT))
+        # Case and punctuation are not part of the words
+        self.assertEqual(compute_simhash(get_body_words(POLICY_TEXT.upper().replace(" and ", ", and "))), signature)
+        edited = compute_simhash(get_body_words(POLICY_TEXT.replace("quarterly", "monthly")))
+        unrelated = compute_simhash(get_body_words(ESG_TEXT))
+        self.assertLess(hamming_distance(signature, edited), hamming_distance(signature, unrelated))
+
+    def test_signature_formats(self):
+        signature = compute_simhash(get_body_words(POLICY_TEXT))
+        self.assertLess(signature, 1 << SIMHASH_BITS)
+        self.assertEqual(int(format_simhash(signature), 16), signature)
+        self.assertEqual(len(format_simhash(1)), 16)
+        bands = get_simhash_bands(signature)
+        self.assertEqual(len(bands), SIMHASH_BANDS)
+        self.assertEqual([band.split(":")[0] for band in bands], ["0", "1", "2", "3"])
+
+
+class SimHashIndexTest(unittest.TestCase):
+
+    def setUp(self):
+        self.signature = compute_simhash(get_body_words(POLICY_TEXT))
+        self.index = SimHashIndex(max_distance=3)
+        self.index.add("policy", self.signature)
+
+    def test_finds_signatures_within_max_distance(self):
+        self.assertEqual(self.index.find(self.signature), "policy")
+        # One bit in each of three bands, the fourth band still matches exactly
+        self.assertEqual(self.index.find(flip_bits(self.signature, [0, 20, 40])), "policy")
+
+    def test_ignores_signatures_beyond_max_distance(self):
+        self.assertIsNone(self.index.find(flip_bits(self.signature, [0, 1, 2, 3])))
+        self.assertIsNone(self.index.find(compute_simhash(get_body_words(ESG_TEXT))))
+
+    def test_closest_canonical_chunk_wins(self):
+        self.index.add("closer", flip_bits(self.signature, [5]))
+        self.assertEqual(self.index.find(flip_bits(self.signature, [5, 6])), "closer")
+
+
+class CollapseDuplicatesTest(unittest.TestCase):
+
+    def test_keeps_the_best_result_of_each_group(self):
+        results = [
+            {'id': ["copy_1"], 'canonicalId': "original"},
+            {'id': ["other"]},
+            {'id': ["original"]},
+            {'id': ["copy_2"], 'canonicalId': "original"},
+            {'id': ["last"]}
+        ]
+        self.assertEqual([result['id'][0] for result in collapse_duplicates(results, 5)], ["copy_1", "other", "last"])
+
+    def test_stops_at_result_count(self):
+        results = [{'id': [str(position)]} for position in range(10)]
+        self.assertEqual(len(collapse_duplicates(results, 3)), 3)
+        self.assertEqual(collapse_duplicates([], 3), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
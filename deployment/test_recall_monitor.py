@@ -0,0 +1,93 @@
+import io
+import threading
+import unittest
+from contextlib import redirect_stdout
+
+from recall_monitor import (
+    MAX_PENDING_SHADOW_SEARCHES,
+    MIN_SAMPLES_FOR_ALERT,
+    RecallMonitor
+)
+
+
+class RecallMonitorTest(unittest.TestCase):
+
+    def setUp(self):
+        self.output = io.StringIO()
+        redirect = redirect_stdout(self.output)
+        redirect.__enter__()
+        self.addCleanup(redirect.__exit__, None, None, None)
+
+    def drain(self, monitor: RecallMonitor):
+        # The single worker runs shadow searches in order, so a no-op submitted last finishes after all of them
+        monitor.executor.submit(lambda: None).result()
+
+    def test_zero_sample_rate_never_shadows(self):
+        monitor = RecallMonitor(sample_rate=0)
+        calls = []
+        for _ in range(100):
+            monitor.maybe_shadow(["a"], 1, lambda: calls.append(1) or ["a"])
+        self.drain(monitor)
+        self.assertEqual(calls, [])
+        self.assertEqual(monitor.stats()['sampled'], 0)
+
+    def test_recall_is_recorded_over_the_window(self):
+        monitor = RecallMonitor(sample_rate=1, window_size=2)
+        monitor.maybe_shadow(["a", "b", "x", "y"], 4, lambda: ["a", "b", "c", "d", "e"])
+        monitor.maybe_shadow(["a", "b"], 2, lambda: ["a", "b"])
+        monitor.maybe_shadow(["x"], 1, lambda: ["a"])
+        self.drain(monitor)
+        stats = monitor.stats()
+        self.assertEqual(stats['sampled'], 3)
+        self.assertEqual(stats['windowSize'], 2)
+        # The first query (recall 0.5) has slid out of the window
+        self.assertEqual(stats['meanRecall'], 0.5)
+        self.assertEqual(stats['minRecall'], 0.0)
+
+    def test_empty_exact_results_count_as_full_recall(self):
+        monitor = RecallMonitor(sample_rate=1)
+        monitor.maybe_shadow([], 5, lambda: [])
+        self.drain(monitor)
+        self.assertEqual(monitor.stats()['meanRecall'], 1.0)
+
+    def test_failed_shadow_searches_are_counted(self):
+        monitor = RecallMonitor(sample_rate=1)
+
+        def exact_search():
+            raise RuntimeError("collection unavailable")
+
+        monitor.maybe_shadow(["a"], 1, exact_search)
+        self.drain(monitor)
+        stats = monitor.stats()
+        self.assertEqual((stats['failed'], stats['sampled'], stats['pending']), (1, 0, 0))
+        self.assertIn("collection unavailable", self.output.getvalue())
+
+    def test_backlog_beyond_the_limit_is_dropped(self):
+        monitor = RecallMonitor(sample_rate=1)
+        release = threading.Event()
+
+        def exact_search():
+            release.wait(5)
+            return ["a"]
+
+        for _ in range(MAX_PENDING_SHADOW_SEARCHES + 3):
+            monitor.maybe_shadow(["a"], 1, exact_search)
+        self.assertEqual(monitor.stats()['pending'], MAX_PENDING_SHADOW_SEARCHES)
+        self.assertEqual(monitor.stats()['dropped'], 3)
+        release.set()
+        self.drain(monitor)
+        self.assertEqual(monitor.stats()['sampled'], MAX_PENDING_SHADOW_SEARCHES)
+
+    def test_warns_once_enough_samples_are_below_the_threshold(self):
+        monitor = RecallMonitor(sample_rate=1, alert_threshold=0.9)
+        for _ in range(MIN_SAMPLES_FOR_ALERT - 1):
+            monitor.maybe_shadow(["x"], 1, lambda: ["a"])
+            self.drain(monitor)
+        self.assertNotIn("WARNING", self.output.getvalue())
+        monitor.maybe_shadow(["x"], 1, lambda: ["a"])
+        self.drain(monitor)
+        self.assertIn("WARNING", self.output.getvalue())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,63 @@
+import threading
+import time
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+
+from singleflight import SingleFlight
+
+
+class SingleFlightTest(unittest.TestCase):
+
+    def setUp(self):
+        self.single_flight = SingleFlight()
+        self.release = threading.Event()
+        self.calls = 0
+
+    def blocking_call(self, value):
+        self.calls += 1
+        self.release.wait(5)
+        return value
+
+    def failing_call(self):
+        self.calls += 1
+        self.release.wait(5)
+        raise RuntimeError("search failed")
+
+    def wait_for_waiters(self, count: int):
+        # Followers register under the lock before blocking on the leader's future
+        deadline = time.monotonic() + 5
+        while self.single_flight.stats()['coalesced'] < count:
+            self.assertLess(time.monotonic(), deadline)
+            time.sleep(0.01)
+
+    def test_concurrent_calls_share_one_execution(self):
+        with ThreadPoolExecutor(5) as executor:
+            futures = [executor.submit(self.single_flight.do, "query", self.blocking_call, "result") for _ in range(5)]
+            self.wait_for_waiters(4)
+            self.release.set()
+            self.assertEqual([future.result() for future in futures], ["result"] * 5)
+        self.assertEqual(self.calls, 1)
+        self.assertEqual(self.single_flight.stats(), {'inFlight': 0, 'executions': 1, 'coalesced': 4})
+
+    def test_errors_reach_every_waiter(self):
+        with ThreadPoolExecutor(3) as executor:
+            futures = [executor.submit(self.single_flight.do, "query", self.failing_call) for _ in range(3)]
+            self.wait_for_waiters(2)
+            self.release.set()
+            for future in futures:
+                with self.assertRaisesRegex(RuntimeError, "search failed"):
+                    future.result()
+        self.assertEqual(self.calls, 1)
+        self.assertEqual(self.single_flight.stats()['inFlight'], 0)
+
+    def test_different_keys_and_later_calls_run_again(self):
+        self.release.set()
+        self.assertEqual(self.single_flight.do("first", self.blocking_call, 1), 1)
+        self.assertEqual(self.single_flight.do("second", self.blocking_call, 2), 2)
+        self.assertEqual(self.single_flight.do("first", self.blocking_call, 3), 3)
+        self.assertEqual(self.calls, 3)
+        self.assertEqual(self.single_flight.stats()['coalesced'], 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
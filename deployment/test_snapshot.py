@@ -0,0 +1,118 @@
+import json
+import os
+import tempfile
+import unittest
+from datetime import datetime
+
+import numpy as np
+
+from snapshot import (
+    METADATA_FILENAME,
+    VectorSnapshot,
+    write_snapshot
+)
+
+from vector_index import VectorIndex
+
+DIMENSIONS = 8
+
+
+def make_documents(count: int, seed: int = 0, first: int = 0) -> list[dict]:
+    rng = np.random.default_rng(seed)
+    return [{
+        'id': [f"chunk_{position}"],
+        'clientName': ["Beta" if position % 3 else "Alpha"],
+        'documentName': [f"Responses_{position % 2}"],
+        'date': [datetime(2023, 1, 1 + position % 5, 12, 30)],
+        'page': [position],
+        'content': [f"chunk {position}"],
+        'contentVector': rng.normal(size=DIMENSIONS).tolist()
+    } for position in range(first, first + count)]
+
+
+def result_ids(results: list[dict]) -> list[str]:
+    return [result['id'][0] for result in results]
+
+
+class VectorSnapshotTest(unittest.TestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+        self.documents = make_documents(30)
+        self.corpus_version = write_snapshot(self.documents, self.directory, event_sequence=7)
+
+    def test_round_trip(self):
+        snapshot = VectorSnapshot(self.directory)
+        self.assertEqual(len(snapshot), 30)
+        self.assertEqual(snapshot.corpus_version, self.corpus_version)
+        self.assertEqual(snapshot.event_sequence, 7)
+        self.assertIsInstance(snapshot.vectors, np.memmap)
+        np.testing.assert_allclose(np.linalg.norm(snapshot.vectors, axis=1), 1, rtol=1e-5)
+        # Rows are grouped by client, metadata keeps every field but the vector
+        slices = snapshot.client_slices()
+        self.assertEqual(set(slices), {"Alpha", "Beta"})
+        for client_name, rows in slices.items():
+            self.assertTrue(all(record['clientName'] == [client_name] for record in snapshot.records[rows]))
+        record = snapshot.records[snapshot.row_by_id["chunk_4"]]
+        self.assertEqual(record['date'], [datetime(2023, 1, 5, 12, 30)])
+        self.assertNotIn('contentVector', record)
+
+    def test_corpus_version_follows_chunk_ids(self):
+        other_directory = os.path.join(self.directory, "other")
+        self.assertEqual(write_snapshot(list(reversed(self.documents)), other_directory), self.corpus_version)
+        self.assertNotEqual(write_snapshot(self.documents[1:], other_directory), self.corpus_version)
+
+    def test_index_matches_one_built_from_documents(self):
+        snapshot_index = VectorIndex.from_snapshot(VectorSnapshot(self.directory))
+        document_index = VectorIndex.from_documents(self.documents, dimensions=DIMENSIONS)
+        for query in np.random.default_rng(1).normal(size=(5, DIMENSIONS)):
+            self.assertEqual(result_ids(snapshot_index.search(query, 5)), result_ids(document_index.search(query, 5)))
+
+    def test_uploads_leave_the_mapped_rows_shared(self):
+        snapshot = VectorSnapshot(self.directory)
+        vector_index = VectorIndex.from_snapshot(snapshot)
+        added = make_documents(10, seed=2, first=30)
+        vector_index.add_documents(added)
+        vector_index.remove_chunks(["chunk_3", "chunk_31"])
+        for partition in vector_index.partitions.values():
+            self.assertTrue(np.shares_memory(partition.store.base, snapshot.vectors))
+        remaining = [document for document in self.documents + added if document['id'][0] not in ("chunk_3", "chunk_31")]
+        document_index = VectorIndex.from_documents(remaining, dimensions=DIMENSIONS)
+        for query in np.random.default_rng(3).normal(size=(5, DIMENSIONS)):
+            self.assertEqual(result_ids(vector_index.search(query, 8)), result_ids(document_index.search(query, 8)))
+
+    def test_index_state_is_read_back_for_the_same_version_only(self):
+        snapshot = VectorSnapshot(self.directory)
+        states = {"Alpha": {'codes': np.arange(4, dtype=np.uint8)}}
+        snapshot.write_index_state("exact-int8", states)
+        np.testing.assert_array_equal(snapshot.read_index_state("exact-int8")["Alpha"]['codes'], states["Alpha"]['codes'])
+        self.assertIsNone(snapshot.read_index_state("exact-pq"))
+        # A snapshot rewritten for another corpus ignores states saved for the previous one
+        write_snapshot(self.documents[1:], self.directory)
+        self.assertIsNone(VectorSnapshot(self.directory).read_index_state("exact-int8"))
+
+    def test_inconsistent_snapshot_is_rejected(self):
+        metadata_path = os.path.join(self.directory, METADATA_FILENAME)
+        with open(metadata_path, "r", encoding="utf-8") as file:
+            metadata = json.load(file)
+        del metadata['chunks']["chunk_0"]
+        with open(metadata_path, "w", encoding="utf-8") as file:
+            json.dump(metadata, file)
+        with self.assertRaises(ValueError):
+            VectorSnapshot(self.directory)
+
+    def test_vectors_of_later_uploads_come_from_the_fallback_loader(self):
+        added = make_documents(2, seed=4, first=30)
+        records = [self.documents[0], *added]
+        with self.assertRaises(KeyError):
+            VectorSnapshot(self.directory).get_vectors(records)
+        snapshot = VectorSnapshot(self.directory, fallback_loader=lambda missing: [document['contentVector'] for document in missing])
+        vectors = snapshot.get_vectors(records)
+        expected = np.asarray([document['contentVector'] for document in records])
+        np.testing.assert_allclose(vectors, expected / np.linalg.norm(expected, axis=1, keepdims=True), rtol=1e-5)
+
+
+if __name__ == "__main__":
+    unittest.main()
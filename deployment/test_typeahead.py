@@ -0,0 +1,51 @@
+import unittest
+
+from typeahead import QueryTypeahead
+
+
+class QueryTypeaheadTest(unittest.TestCase):
+
+    def setUp(self):
+        self.typeahead = QueryTypeahead.from_documents([
+            {'query': "what is the aum", 'text': "What is the AUM?", 'count': 5},
+            {'query': "what is the esg policy", 'text': "What is the ESG policy?", 'count': 9},
+            {'query': "what is the fee structure", 'text': "What is the fee structure?", 'count': 2},
+            {'query': "who is the auditor", 'text': "Who is the auditor?", 'count': 7}
+        ])
+
+    def suggested(self, prefix: str, limit: int = 5) -> list[str]:
+        return [suggestion['query'] for suggestion in self.typeahead.suggest(prefix, limit)]
+
+    def test_suggestions_match_the_prefix_ranked_by_count(self):
+        self.assertEqual(self.suggested("what is"), ["What is the ESG policy?", "What is the AUM?", "What is the fee structure?"])
+        self.assertEqual(self.typeahead.suggest("who", 5), [{'query': "Who is the auditor?", 'count': 7}])
+        self.assertEqual(self.suggested("what is the e"), ["What is the ESG policy?"])
+
+    def test_limit_and_unknown_prefix(self):
+        self.assertEqual(self.suggested("w", 2), ["What is the ESG policy?", "Who is the auditor?"])
+        self.assertEqual(self.suggested("how"), [])
+        self.assertEqual(len(self.suggested("")), 4)
+
+    def test_repeated_queries_add_up_and_keep_the_latest_phrasing(self):
+        self.typeahead.record("what is the fee structure", "What's the fee structure", 10)
+        self.assertEqual(self.typeahead.suggest("what is", 1), [{'query': "What's the fee structure", 'count': 12}])
+        self.assertEqual(len(self.typeahead), 4)
+
+    def test_least_asked_query_is_evicted_when_full(self):
+        typeahead = QueryTypeahead(max_queries=3)
+        typeahead.record("aum", "AUM", 3)
+        typeahead.record("auditor", "Auditor", 1)
+        typeahead.record("esg", "ESG", 2)
+        typeahead.record("fees", "Fees")
+        self.assertEqual(len(typeahead), 3)
+        self.assertEqual(typeahead.queries, ["aum", "esg", "fees"])
+        self.assertEqual([suggestion['query'] for suggestion in typeahead.suggest("a", 5)], ["AUM"])
+        self.assertNotIn("auditor", typeahead.texts)
+
+    def test_empty_queries_are_not_recorded(self):
+        self.typeahead.record("", "   ")
+        self.assertEqual(len(self.typeahead), 4)
+
+
+if __name__ == "__main__":
+    unittest.main()
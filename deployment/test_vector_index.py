@@ -0,0 +1,204 @@
+import unittest
+from datetime import datetime
+
+import numpy as np
+
+from vector_index import (
+    VectorIndex,
+    get_compaction_executor
+)
+
+DIMENSIONS = 16
+
+
+def make_documents(count: int, seed: int = 0) -> list[dict]:
+    # Chunks spread over two clients, three documents each and two upload dates, with random embeddings
+    rng = np.random.default_rng(seed)
+    documents = []
+    for position in range(count):
+        client_name = ["Alpha", "Beta"][position % 2]
+        documents.append({
+            'id': [f"{client_name}_chunk_{position}"],
+            'clientName': [client_name],
+            'documentName': [f"{client_name}_Responses_{position % 3}"],
+            'date': [datetime(2023, 1 + position % 2, 1)],
+            'page': [position],
+            'content': [f"chunk {position}"],
+            'contentVector': rng.normal(size=DIMENSIONS).tolist()
+        })
+    return documents
+
+
+def brute_force_ids(documents: list[dict], query: list, result_count: int, keep=lambda document: True) -> list[str]:
+    candidates = [document for document in documents if keep(document)]
+    matrix = np.asarray([document['contentVector'] for document in candidates], dtype=np.float64)
+    scores = matrix @ np.asarray(query) / np.linalg.norm(matrix, axis=1)
+    return [candidates[index]['id'][0] for index in np.argsort(-scores)[:result_count]]
+
+
+def result_ids(results: list[dict]) -> list[str]:
+    return [result['id'][0] for result in results]
+
+
+class VectorIndexFilterTest(unittest.TestCase):
+
+    def setUp(self):
+        self.documents = make_documents(60)
+        self.vector_index = VectorIndex.from_documents(self.documents, dimensions=DIMENSIONS)
+        self.queries = np.random.default_rng(1).normal(size=(10, DIMENSIONS)).tolist()
+
+    def test_search_matches_brute_force(self):
+        for query in self.queries:
+            self.assertEqual(result_ids(self.vector_index.search(query, 5)), brute_force_ids(self.documents, query, 5))
+
+    def test_scores_are_cosine_similarities(self):
+        query = self.queries[0]
+        for result in self.vector_index.search(query, 3):
+            vector = next(document['contentVector'] for document in self.documents if document['id'] == result['id'])
+            expected = np.dot(vector, query) / (np.linalg.norm(vector) * np.linalg.norm(query))
+            self.assertAlmostEqual(result['similarityScore'], expected, places=5)
+        self.assertNotIn('contentVector', result)
+
+    def test_client_filter(self):
+        for query in self.queries:
+            results = self.vector_index.search(query, 5, client_names=["Beta"])
+            self.assertEqual(result_ids(results), brute_force_ids(self.documents, query, 5, lambda document: document['clientName'] == ["Beta"]))
+
+    def test_unknown_client_returns_nothing(self):
+        self.assertEqual(self.vector_index.search(self.queries[0], 5, client_names=["Gamma"]), [])
+
+    def test_document_and_date_filters(self):
+        start_date, end_date = datetime(2023, 2, 1), datetime(2023, 2, 28)
+        keep = lambda document: document['documentName'][0] in ("Alpha_Responses_1", "Beta_Responses_1") and start_date <= document['date'][0] <= end_date
+        for query in self.queries:
+            results = self.vector_index.search(query, 5, document_names=["Alpha_Responses_1", "Beta_Responses_1"], start_date=start_date, end_date=end_date)
+            self.assertEqual(result_ids(results), brute_force_ids(self.documents, query, 5, keep))
+
+    def test_filter_with_fewer_matches_than_requested(self):
+        results = self.vector_index.search(self.queries[0], 50, client_names=["Alpha"], document_names=["Alpha_Responses_0"])
+        self.assertEqual(len(results), len([document for document in self.documents if document['documentName'] == ["Alpha_Responses_0"]]))
+
+    def test_search_many_matches_search(self):
+        batch_results = self.vector_index.search_many(self.queries, 5, client_names=["Alpha"])
+        for query, results in zip(self.queries, batch_results):
+            self.assertEqual(result_ids(results), result_ids(self.vector_index.search(query, 5, client_names=["Alpha"])))
+
+    def test_documents_without_vectors_are_skipped(self):
+        documents = make_documents(4)
+        documents[0]['contentVector'] = None
+        self.assertEqual(len(VectorIndex.from_documents(documents, dimensions=DIMENSIONS)), 3)
+
+
+class VectorIndexUpdateTest(unittest.TestCase):
+
+    def setUp(self):
+        self.documents = make_documents(40)
+        self.vector_index = VectorIndex.from_documents(self.documents, dimensions=DIMENSIONS)
+        self.queries = np.random.default_rng(2).normal(size=(10, DIMENSIONS)).tolist()
+
+    def assert_matches(self, documents: list[dict]):
+        for query in self.queries:
+            self.assertEqual(result_ids(self.vector_index.search(query, 8)), brute_force_ids(documents, query, 8))
+
+    def test_add_documents_skips_known_ids(self):
+        added = make_documents(50, seed=3)[40:]
+        self.vector_index.add_documents(self.documents[:5] + added)
+        self.assertEqual(len(self.vector_index), 50)
+        self.assert_matches(self.documents + added)
+
+    def test_removed_chunks_are_never_returned(self):
+        removed_ids = ["Alpha_chunk_0", "Beta_chunk_1", "Beta_chunk_3"]
+        self.assertEqual(self.vector_index.remove_chunks(removed_ids + ["Gamma_chunk_0"]), 3)
+        self.assertEqual(len(self.vector_index), 37)
+        self.assert_matches([document for document in self.documents if document['id'][0] not in removed_ids])
+
+    def test_removing_every_chunk_of_a_client_drops_its_partition(self):
+        self.vector_index.remove_chunks([document['id'][0] for document in self.documents if document['clientName'] == ["Alpha"]])
+        self.assertEqual(list(self.vector_index.partitions), ["Beta"])
+
+    def test_rebuild_drops_deleted_rows(self):
+        removed_ids = [f"Beta_chunk_{position}" for position in range(1, 11, 2)]
+        # Exactly the deleted ratio, so no compaction was scheduled yet
+        self.vector_index.remove_chunks(removed_ids)
+        self.assertEqual(self.vector_index.rebuilding, set())
+        self.vector_index.rebuild_partition("Beta")
+        partition = self.vector_index.partitions["Beta"]
+        self.assertEqual(partition.deleted_count, 0)
+        self.assertEqual(partition.size, 15)
+        self.assertEqual(len(partition.store), 15)
+        self.assert_matches([document for document in self.documents if document['id'][0] not in removed_ids])
+
+    def test_compaction_is_scheduled_past_the_deleted_ratio(self):
+        removed_ids = [f"Alpha_chunk_{position}" for position in range(0, 20, 2)]
+        self.vector_index.remove_chunks(removed_ids)
+        get_compaction_executor().submit(lambda: None).result()
+        self.assertEqual(self.vector_index.partitions["Alpha"].deleted_count, 0)
+        self.assertEqual(self.vector_index.rebuilding, set())
+        self.assert_matches([document for document in self.documents if document['id'][0] not in removed_ids])
+
+    def test_changes_made_during_compaction_are_replayed(self):
+        partition = self.vector_index.partitions["Alpha"]
+        partition.remove(["Alpha_chunk_0"])
+        keep = ~partition.deleted.data[:partition.size]
+        compacted = partition.compacted(keep)
+        # An upload and a delete land on the old partition while the copy is built
+        added = [document for document in make_documents(44, seed=4)[40:] if document['clientName'] == ["Alpha"]]
+        self.vector_index.add_documents(added)
+        partition.remove(["Alpha_chunk_2"])
+        compacted.catch_up(partition, keep)
+        self.vector_index.partitions["Alpha"] = compacted
+        self.assertEqual(len(compacted), 20 - 2 + len(added))
+        self.assert_matches([document for document in self.documents + added if document['id'][0] not in ("Alpha_chunk_0", "Alpha_chunk_2")])
+
+
+class CurrentVersionsTest(unittest.TestCase):
+
+    def setUp(self):
+        # The same document uploaded in January and re-uploaded in February, plus a document uploaded once
+        self.versions = {
+            "january": self.make_version("Responses", datetime(2023, 1, 1), 6, seed=5),
+            "february": self.make_version("Responses", datetime(2023, 2, 1), 6, seed=6),
+            "policy": self.make_version("Policy", datetime(2023, 1, 15), 4, seed=7)
+        }
+        self.vector_index = VectorIndex.from_documents([document for documents in self.versions.values() for document in documents], dimensions=DIMENSIONS)
+        self.query = np.random.default_rng(8).normal(size=DIMENSIONS).tolist()
+
+    @staticmethod
+    def make_version(document_name: str, date: datetime, count: int, seed: int) -> list[dict]:
+        documents = make_documents(2 * count, seed)[::2]
+        for document in documents:
+            document['id'] = [f"{document_name}_{date:%m}_{document['id'][0]}"]
+            document['documentName'] = [document_name]
+            document['date'] = [date]
+        return documents
+
+    def current_ids(self) -> set[str]:
+        return set(result_ids(self.vector_index.search(self.query, 50, current_only=True)))
+
+    def ids(self, *version_names: str) -> set[str]:
+        return {document['id'][0] for version_name in version_names for document in self.versions[version_name]}
+
+    def test_only_the_newest_upload_is_current(self):
+        self.assertEqual(self.current_ids(), self.ids("february", "policy"))
+        self.assertEqual(len(self.vector_index.search(self.query, 50)), 16)
+
+    def test_newer_upload_supersedes_the_current_one(self):
+        self.assertEqual(self.current_ids(), self.ids("february", "policy"))
+        self.versions["march"] = self.make_version("Responses", datetime(2023, 3, 1), 3, seed=9)
+        self.vector_index.add_documents(self.versions["march"])
+        self.assertEqual(self.current_ids(), self.ids("march", "policy"))
+
+    def test_deleting_the_newest_upload_restores_the_previous_one(self):
+        self.assertEqual(self.current_ids(), self.ids("february", "policy"))
+        self.vector_index.remove_chunks(list(self.ids("february")))
+        self.assertEqual(self.current_ids(), self.ids("january", "policy"))
+
+    def test_filters_combine_with_current_only(self):
+        results = self.vector_index.search(self.query, 50, document_names=["Responses"], current_only=True)
+        self.assertEqual(set(result_ids(results)), self.ids("february"))
+        results = self.vector_index.search(self.query, 50, end_date=datetime(2023, 1, 31), current_only=True)
+        self.assertEqual(set(result_ids(results)), self.ids("policy"))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,109 @@
+import unittest
+from datetime import datetime
+
+import numpy as np
+
+from vector_index import VectorIndex
+
+from vector_storage import (
+    Int8VectorStore,
+    ProductQuantizedVectorStore
+)
+
+from vector_utils import normalize_vectors
+
+
+def make_documents(vectors: np.ndarray) -> list[dict]:
+    return [{
+        'id': [f"chunk_{position}"],
+        'clientName': ["Alpha"],
+        'documentName': ["Alpha_Responses"],
+        'date': [datetime(2023, 1, 1)],
+        'page': [position],
+        'content': [f"chunk {position}"],
+        'contentVector': vector.tolist()
+    } for position, vector in enumerate(vectors)]
+
+
+def clustered_vectors(count: int, dimensions: int, seed: int = 0) -> np.ndarray:
+    # Embeddings cluster by topic, so a lossy code keeps the clusters but blurs the order within one
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(size=(8, dimensions))
+    return centers[rng.integers(0, 8, count)] + 0.5 * rng.normal(size=(count, dimensions))
+
+
+def recall(vector_index: VectorIndex, reference_index: VectorIndex, queries: np.ndarray, result_count: int) -> float:
+    recalls = []
+    for query in queries:
+        expected = {result['id'][0] for result in reference_index.search(query, result_count)}
+        found = {result['id'][0] for result in vector_index.search(query, result_count)}
+        recalls.append(len(found & expected) / result_count)
+    return float(np.mean(recalls))
+
+
+class Int8VectorStoreTest(unittest.TestCase):
+
+    def test_scores_are_close_to_float32(self):
+        vectors = normalize_vectors(clustered_vectors(200, 32))
+        store = Int8VectorStore(32)
+        store.add(vectors)
+        query = vectors[0]
+        self.assertEqual(store.codes.dtype, np.int8)
+        self.assertEqual(store.nbytes, vectors.nbytes // 4 + store.scale.nbytes)
+        np.testing.assert_allclose(store.score(query), vectors @ query, atol=0.02)
+        np.testing.assert_allclose(store.score_many(vectors[:3]), vectors @ vectors[:3].T, atol=0.02)
+
+
+class ProductQuantizedVectorStoreTest(unittest.TestCase):
+
+    def test_codes_and_scores(self):
+        vectors = normalize_vectors(clustered_vectors(300, 32))
+        store = ProductQuantizedVectorStore(32, subspaces=8, centroids=16, iterations=5)
+        store.add(vectors)
+        self.assertEqual(store.codes.shape, (300, 8))
+        self.assertEqual(store.codes.dtype, np.uint8)
+        # Asymmetric scores are exact dot products with the reconstructed vectors
+        query = vectors[0]
+        np.testing.assert_allclose(store.score(query), store.get(np.arange(300)) @ query, rtol=1e-4, atol=1e-5)
+        np.testing.assert_allclose(store.score(query, np.arange(10, 20)), store.score(query)[10:20], rtol=1e-5)
+
+    def test_dimensions_must_split_into_subspaces(self):
+        with self.assertRaises(ValueError):
+            ProductQuantizedVectorStore(30, subspaces=8)
+
+
+class RescoringRecallTest(unittest.TestCase):
+
+    def setUp(self):
+        # PQ_SUBSPACES defaults to 384, two dimensions per subspace
+        self.dimensions = 768
+        vectors = clustered_vectors(600, self.dimensions)
+        self.documents = make_documents(vectors)
+        self.vectors_by_id = {document['id'][0]: document['contentVector'] for document in self.documents}
+        self.reference_index = VectorIndex.from_documents(self.documents, dimensions=self.dimensions)
+        self.queries = vectors[np.random.default_rng(1).choice(600, 20, replace=False)] + 0.2 * np.random.default_rng(2).normal(size=(20, self.dimensions))
+
+    def vector_loader(self, records: list[dict]) -> list:
+        return [self.vectors_by_id[record['id'][0]] for record in records]
+
+    def test_int8_recall(self):
+        vector_index = VectorIndex.from_documents(self.documents, dimensions=self.dimensions, storage="int8", vector_loader=self.vector_loader)
+        self.assertEqual(recall(vector_index, self.reference_index, self.queries, 10), 1.0)
+
+    def test_pq_recall_with_rescoring(self):
+        rescored_index = VectorIndex.from_documents(self.documents, dimensions=self.dimensions, storage="pq", vector_loader=self.vector_loader)
+        codes_only_index = VectorIndex.from_documents(self.documents, dimensions=self.dimensions, storage="pq")
+        rescored_recall = recall(rescored_index, self.reference_index, self.queries, 10)
+        self.assertGreaterEqual(rescored_recall, 0.9)
+        self.assertGreater(rescored_recall, recall(codes_only_index, self.reference_index, self.queries, 10))
+
+    def test_rescored_scores_are_exact(self):
+        vector_index = VectorIndex.from_documents(self.documents, dimensions=self.dimensions, storage="pq", vector_loader=self.vector_loader)
+        query = self.queries[0]
+        for result in vector_index.search(query, 5):
+            vector = np.asarray(self.vectors_by_id[result['id'][0]])
+            self.assertAlmostEqual(result['similarityScore'], vector @ query / (np.linalg.norm(vector) * np.linalg.norm(query)), places=4)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,57 @@
+import bisect
+import heapq
+import threading
+
+from constants import TYPEAHEAD_MAX_QUERIES
+
+
+class QueryTypeahead:
+    '''
+    Previously submitted queries kept in a sorted array of normalized query text, so the queries
+    starting with a prefix are one contiguous slice found by binary search, ranked by how often they were asked.
+    '''
+
+    def __init__(self, max_queries: int = TYPEAHEAD_MAX_QUERIES):
+        self.max_queries = max_queries
+        self.queries: list[str] = []
+        self.counts: dict[str, int] = {}
+        # Latest phrasing of each normalized query, returned as the suggestion
+        self.texts: dict[str, str] = {}
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.queries)
+
+    @classmethod
+    def from_documents(cls, documents, **typeahead_options) -> "QueryTypeahead":
+        typeahead = cls(**typeahead_options)
+        for document in documents:
+            typeahead.record(document['query'], document['text'], document['count'])
+        return typeahead
+
+    def record(self, normalized_query: str, text: str, count: int = 1):
+        if not normalized_query:
+            return
+        with self.lock:
+            if normalized_query not in self.counts:
+                if len(self.queries) >= self.max_queries:
+                    self.evict()
+                bisect.insort(self.queries, normalized_query)
+                self.counts[normalized_query] = 0
+            self.counts[normalized_query] += count
+            self.texts[normalized_query] = text
+
+    def evict(self):
+        # Full: the least asked query makes room
+        least_asked = min(self.counts, key=self.counts.get)
+        del self.queries[bisect.bisect_left(self.queries, least_asked)]
+        del self.counts[least_asked]
+        del self.texts[least_asked]
+
+    def suggest(self, normalized_prefix: str, limit: int) -> list[dict]:
+        with self.lock:
+            start = bisect.bisect_left(self.queries, normalized_prefix)
+            # Every string starting with the prefix sorts before prefix + the highest code point
+            end = bisect.bisect_left(self.queries, normalized_prefix + "\U0010ffff", lo=start)
+            top_queries = heapq.nlargest(limit, self.queries[start:end], key=self.counts.get)
+            return [{'query': self.texts[query], 'count': self.counts[query]} for query in top_queries]
@@ -0,0 +1,685 @@
+import contextvars
+import copy
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Callable
+
+import numpy as np
+
+from constants import (
+    VECTOR_DIMENSIONS,
+    HNSW_M,
+    HNSW_EF_CONSTRUCTION,
+    HNSW_EF_SEARCH,
+    RESCORE_FACTOR,
+    QUANTIZER_TRAINING_SAMPLE,
+    QUANTIZER_RETRAIN_GROWTH,
+    SEARCH_WORKERS,
+    PARALLEL_SEARCH_MIN_ROWS
+)
+
+from hnsw_index import (
+    HNSW_AVAILABLE,
+    HNSWGraph
+)
+
+from vector_storage import (
+    RowBuffer,
+    create_vector_store
+)
+
+from vector_utils import (
+    normalize_vectors,
+    to_datetime64,
+    top_k_indices,
+    unwrap_field
+)
+
+from centroids import get_section_key
+
+from search_trace import (
+    trace_append,
+    trace_count,
+    trace_entry
+)
+
+# Fraction of deleted rows at which a partition is rebuilt without them, in the background
+COMPACTION_RATIO = 0.25
+
+# Queries scored together by search_many, bounds the (rows, queries) score matrix
+QUERY_BLOCK_SIZE = 64
+
+# Shared by every index in the process. NumPy releases the GIL inside the matrix products,
+# so partitions scanned on these threads run on separate cores over the same memory.
+# Only scans are submitted here, HNSW graph walks run on the request thread.
+_search_executor: ThreadPoolExecutor = None
+_search_executor_lock = threading.Lock()
+
+
+def get_search_executor() -> ThreadPoolExecutor:
+    global _search_executor
+    with _search_executor_lock:
+        if _search_executor is None:
+            _search_executor = ThreadPoolExecutor(max_workers=SEARCH_WORKERS, thread_name_prefix="vector-search")
+    return _search_executor
+
+
+# Full precision vectors read per vector_loader call while a quantized partition is rebuilt
+REENCODE_BLOCK_SIZE = 1024
+
+# Compactions run one at a time off the request path, each re-encodes or relinks a whole partition
+_compaction_executor: ThreadPoolExecutor = None
+_compaction_executor_lock = threading.Lock()
+
+
+def get_compaction_executor() -> ThreadPoolExecutor:
+    global _compaction_executor
+    with _compaction_executor_lock:
+        if _compaction_executor is None:
+            _compaction_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="index-compaction")
+    return _compaction_executor
+
+
+class IndexPartition:
+    def __init__(self,
+                 client_name: str,
+                 dimensions: int = VECTOR_DIMENSIONS,
+                 index_kind: str = "exact",
+                 hnsw_params: dict = None,
+                 storage: str = "float32",
+                 vector_loader: Callable[[list[dict]], list] = None):
+        self.client_name = client_name
+        self.dimensions = dimensions
+        self.index_kind = index_kind
+        self.hnsw_params = hnsw_params or {}
+        self.storage = storage
+        self.vector_loader = vector_loader
+        self.records: list[dict] = []
+        self.row_by_id: dict[str, int] = {}
+        self.store = create_vector_store(storage, dimensions)
+        self.document_names = RowBuffer((), object)
+        self.dates = RowBuffer((), 'datetime64[us]')
+        self.deleted = RowBuffer((), bool)
+        self.deleted_count = 0
+        # Running vector sums per section, so section centroids stay current without a rebuild
+        self.section_ids: dict[str, int] = {}
+        self.section_rows: list[list[int]] = []
+        self.section_sums = RowBuffer((dimensions,), np.float32)
+        self.row_sections = RowBuffer((), np.int64)
+        # Bumped last by every add and remove, once every array reflects the change
+        self.modifications = 0
+        # (modifications, rows of the newest dated version of each document), stale once modifications moves on
+        self.current_rows: tuple[int, np.ndarray] = None
+        # Rows visible to searches, only advanced once every array holds the new rows
+        self.size = 0
+        # Rows the quantizer had been fitted on, a lossy partition is rebuilt once it grows well past them
+        self.trained_size = 0
+        self.graph = HNSWGraph(dimensions, **self.hnsw_params) if index_kind == "hnsw" else None
+
+    def __len__(self):
+        return self.size - self.deleted_count
+
+    @property
+    def rescores(self) -> bool:
+        return self.store.is_lossy and self.vector_loader is not None
+
+    def get_exact_vectors(self, row_ids: np.ndarray) -> np.ndarray:
+        # Full precision when a vector_loader is available, otherwise what the store can reconstruct
+        if not self.store.is_lossy or self.vector_loader is None:
+            return self.store.get(row_ids)
+        vectors = np.empty((len(row_ids), self.dimensions), dtype=np.float32)
+        for start in range(0, len(row_ids), REENCODE_BLOCK_SIZE):
+            block = row_ids[start:start + REENCODE_BLOCK_SIZE]
+            vectors[start:start + len(block)] = normalize_vectors(self.vector_loader([self.records[row_id] for row_id in block]))
+        return vectors
+
+    @property
+    def needs_retraining(self) -> bool:
+        return self.store.is_lossy and self.trained_size > 0 and self.size >= QUANTIZER_RETRAIN_GROWTH * self.trained_size
+
+    def add(self, records: list[dict], vectors: np.ndarray, state: dict = None):
+        # state, from get_state of a partition holding exactly these rows, restores an empty partition without re-encoding or relinking
+        first_row = self.size
+        if state is not None and first_row:
+            raise ValueError("A saved partition state can only be restored into an empty partition")
+        self.records.extend(records)
+        self.document_names.append(np.array([unwrap_field(record['documentName']) for record in records], dtype=object))
+        self.dates.append(np.array([to_datetime64(record['date']) for record in records], dtype='datetime64[us]'))
+        self.deleted.append(np.zeros(len(records), dtype=bool))
+        self.add_to_sections(records, vectors, first_row)
+        if state is None:
+            self.store.add(vectors)
+        else:
+            self.store.load_state(state, vectors)
+        if self.store.is_lossy and not self.trained_size:
+            # The store fitted its quantizer on this first batch
+            self.trained_size = first_row + len(records)
+        for row_id, record in enumerate(records, start=first_row):
+            self.row_by_id[unwrap_field(record['id'])] = row_id
+        if self.graph is not None and state is None:
+            self.graph.add(np.arange(first_row, first_row + len(records)), vectors)
+        elif self.graph is not None:
+            self.graph.load_state({key[len('graph.'):]: value for key, value in state.items() if key.startswith('graph.')})
+        self.size = first_row + len(records)
+        self.modifications += 1
+
+    def get_state(self) -> dict:
+        # Quantizer and codes, plus the graph's adjacency, everything add derives from the vectors
+        state = dict(self.store.get_state())
+        if self.graph is not None:
+            state.update({f'graph.{key}': value for key, value in self.graph.get_state().items()})
+        return state
+
+    def add_to_sections(self, records: list[dict], vectors: np.ndarray, first_row: int):
+        section_ids = []
+        for row_id, record in enumerate(records, start=first_row):
+            section_key = get_section_key(record)
+            section_id = self.section_ids.get(section_key)
+            if section_id is None:
+                section_id = len(self.section_rows)
+                self.section_ids[section_key] = section_id
+                self.section_rows.append([])
+                self.section_sums.append(np.zeros((1, self.dimensions), dtype=np.float32))
+            self.section_rows[section_id].append(row_id)
+            section_ids.append(section_id)
+        section_ids = np.asarray(section_ids, dtype=np.int64)
+        np.add.at(self.section_sums.data, section_ids, vectors)
+        self.row_sections.append(section_ids)
+
+    def remove(self, chunk_ids) -> int:
+        # Deleted rows are masked out of every search until the partition is compacted
+        rows = [self.row_by_id.pop(chunk_id) for chunk_id in chunk_ids if chunk_id in self.row_by_id]
+        if rows:
+            self.deleted.data[rows] = True
+            self.deleted_count += len(rows)
+            section_ids = self.row_sections.data[rows]
+            np.subtract.at(self.section_sums.data, section_ids, self.store.get(np.asarray(rows)))
+            for row_id, section_id in zip(rows, section_ids):
+                self.section_rows[section_id] = [row for row in self.section_rows[section_id] if row != row_id]
+            self.modifications += 1
+        return len(rows)
+
+    def compacted(self, keep: np.ndarray) -> "IndexPartition":
+        # Built as a new partition from the first len(keep) rows, so searches and writes against this one are unaffected.
+        # A quantized partition refits its quantizer on the kept rows and re-encodes them from full precision vectors.
+        partition = IndexPartition(self.client_name, self.dimensions, self.index_kind, self.hnsw_params,
+                                   self.storage, self.vector_loader)
+        partition.records = [record for record, kept in zip(self.records, keep) if kept]
+        partition.row_by_id = {unwrap_field(record['id']): row_id for row_id, record in enumerate(partition.records)}
+        kept_rows = np.flatnonzero(keep)
+        if self.store.is_lossy:
+            vectors = self.get_exact_vectors(kept_rows)
+            if len(kept_rows):
+                sample_size = min(len(kept_rows), QUANTIZER_TRAINING_SAMPLE)
+                partition.store.train(vectors[np.random.default_rng(len(kept_rows)).choice(len(kept_rows), sample_size, replace=False)])
+                partition.store.add(vectors)
+            partition.trained_size = len(kept_rows)
+        else:
+            partition.store = copy.copy(self.store)
+            partition.store.compact(keep)
+            vectors = partition.store.get(np.arange(len(kept_rows)))
+        partition.document_names = self.document_names.compacted(keep)
+        partition.dates = self.dates.compacted(keep)
+        partition.deleted.append(np.zeros(len(partition.records), dtype=bool))
+        partition.add_to_sections(partition.records, vectors, 0)
+        if partition.graph is not None:
+            partition.graph.add(np.arange(len(partition.records)), vectors)
+        partition.size = len(partition.records)
+        return partition
+
+    def catch_up(self, partition: "IndexPartition", keep: np.ndarray):
+        # Applies what was removed from or added to partition while this compacted copy of it was built
+        size = keep.shape[0]
+        removed_rows = np.flatnonzero(keep & partition.deleted.data[:size])
+        self.remove([unwrap_field(partition.records[row_id]['id']) for row_id in removed_rows])
+        added_rows = np.flatnonzero(~partition.deleted.data[size:partition.size]) + size
+        if len(added_rows):
+            self.add([partition.records[row_id] for row_id in added_rows], partition.get_exact_vectors(added_rows))
+
+    def current_mask(self, size: int) -> np.ndarray:
+        # Read before the arrays: a mask computed while a write is under way is stored under the
+        # count from before it, so no search reuses it once the write completes
+        modifications = self.modifications
+        cached = self.current_rows
+        if cached is not None and cached[0] == modifications and cached[1].shape[0] >= size:
+            return cached[1][:size]
+        # A document re-uploaded with a newer date supersedes its older versions within the client
+        live = ~self.deleted.data[:size]
+        names, inverse = np.unique(self.document_names.data[:size], return_inverse=True)
+        date_values = self.dates.data[:size].astype(np.int64)
+        latest_dates = np.full(len(names), np.iinfo(np.int64).min, dtype=np.int64)
+        np.maximum.at(latest_dates, inverse[live], date_values[live])
+        current_rows = date_values == latest_dates[inverse]
+        self.current_rows = (modifications, current_rows)
+        return current_rows
+
+    def filter_mask(self, size: int, document_names: list = None, start_date: datetime = None, end_date: datetime = None, current_only: bool = False) -> np.ndarray:
+        mask = ~self.deleted.data[:size] if self.deleted_count else None
+        if not document_names and start_date is None and end_date is None and not current_only:
+            return mask
+        if mask is None:
+            mask = np.ones(size, dtype=bool)
+        if current_only:
+            mask &= self.current_mask(size)
+        if document_names:
+            mask &= np.isin(self.document_names.data[:size], document_names)
+        if start_date is not None:
+            mask &= self.dates.data[:size] >= np.datetime64(start_date, 'us')
+        if end_date is not None:
+            mask &= self.dates.data[:size] <= np.datetime64(end_date, 'us')
+        return mask
+
+    def rescore(self, query_vector: np.ndarray, row_ids: np.ndarray, k: int) -> tuple[np.ndarray, np.ndarray]:
+        # Re-rank the candidates found on compressed codes with their full precision vectors
+        exact_vectors = normalize_vectors(self.vector_loader([self.records[row_id] for row_id in row_ids]))
+        scores = exact_vectors @ query_vector
+        top_indices = top_k_indices(scores, k)
+        return row_ids[top_indices], scores[top_indices]
+
+    def rows_mask(self, rows: np.ndarray, document_names: list = None, start_date: datetime = None, end_date: datetime = None, current_only: bool = False) -> np.ndarray:
+        mask = ~self.deleted.data[rows]
+        if current_only:
+            mask &= self.current_mask(self.size)[rows]
+        if document_names:
+            mask &= np.isin(self.document_names.data[rows], document_names)
+        if start_date is not None:
+            mask &= self.dates.data[rows] >= np.datetime64(start_date, 'us')
+        if end_date is not None:
+            mask &= self.dates.data[rows] <= np.datetime64(end_date, 'us')
+        return mask
+
+    def section_candidates(self,
+                           query_vector: np.ndarray,
+                           section_count: int,
+                           size: int,
+                           document_names: list = None,
+                           start_date: datetime = None,
+                           end_date: datetime = None,
+                           current_only: bool = False) -> np.ndarray:
+        # Stage one of hierarchical search: rank the section centroids and keep the rows of the best sections
+        section_rows = self.section_rows[:len(self.section_sums)]
+        live_sections = np.asarray([section_id for section_id, rows in enumerate(section_rows) if rows and rows[0] < size], dtype=np.int64)
+        if not len(live_sections):
+            return np.empty(0, dtype=np.int64)
+
+        # Every row of a section shares its document and date, so the first row stands in for the section
+        first_rows = np.asarray([section_rows[section_id][0] for section_id in live_sections], dtype=np.int64)
+        live_sections = live_sections[self.rows_mask(first_rows, document_names, start_date, end_date, current_only)]
+        if not len(live_sections):
+            return np.empty(0, dtype=np.int64)
+
+        centroid_scores = normalize_vectors(self.section_sums.data[live_sections]) @ query_vector
+        top_sections = live_sections[top_k_indices(centroid_scores, section_count)]
+        candidate_rows = np.concatenate([np.asarray(section_rows[section_id], dtype=np.int64) for section_id in top_sections])
+        return candidate_rows[candidate_rows < size]
+
+    def search(self,
+               query_vector: np.ndarray,
+               k: int,
+               document_names: list = None,
+               start_date: datetime = None,
+               end_date: datetime = None,
+               exact: bool = False,
+               ef_search: int = None,
+               section_count: int = None,
+               current_only: bool = False) -> tuple[np.ndarray, np.ndarray]:
+        size = self.size
+        fetch_count = k * RESCORE_FACTOR if self.rescores else k
+
+        if section_count:
+            # Two-stage search: cost grows with the number of sections plus the rows of the chosen ones
+            candidate_rows = self.section_candidates(query_vector, section_count, size, document_names, start_date, end_date, current_only)
+            trace_append('searchPath', f'two-stage:{self.client_name}')
+            trace_count('candidatesScanned', len(candidate_rows))
+            scores = self.store.score(query_vector, candidate_rows)
+            top_indices = top_k_indices(scores, fetch_count)
+            row_ids, scores = candidate_rows[top_indices], scores[top_indices]
+            if self.rescores and len(row_ids):
+                return self.rescore(query_vector, row_ids, k)
+            return row_ids, scores
+
+        mask = self.filter_mask(size, document_names, start_date, end_date, current_only)
+        candidate_count = size if mask is None else int(np.count_nonzero(mask))
+        if candidate_count == 0:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+
+        # A graph walk visits at least ef nodes, so a selective filter is cheaper to scan exactly
+        use_graph = self.graph is not None and not exact
+        if use_graph and mask is not None and candidate_count <= max(ef_search or self.graph.ef_search, fetch_count):
+            use_graph = False
+
+        # The graph gives up when it cannot reach fetch_count allowed rows, the scan below always can
+        found = self.graph.search(query_vector, fetch_count, ef_search, mask) if use_graph else None
+        trace_append('searchPath', f"{'hnsw' if found is not None else 'exact-scan'}:{self.client_name}")
+        trace_count('candidatesFiltered', candidate_count)
+        if found is not None:
+            row_ids, scores = found
+            # Nodes linked in by a concurrent add are not searchable until it completes
+            committed = row_ids < size
+            row_ids, scores = row_ids[committed], scores[committed]
+        elif mask is None or 2 * candidate_count > size:
+            # Most rows pass the filter (e.g. current_only): scoring them all in place is cheaper than gathering them
+            trace_count('candidatesScanned', size)
+            scores = self.store.score(query_vector, slice(0, size))
+            if mask is not None:
+                scores[~mask] = -np.inf
+            row_ids = top_k_indices(scores, min(fetch_count, candidate_count))
+            scores = scores[row_ids]
+        else:
+            candidate_rows = np.flatnonzero(mask)
+            trace_count('candidatesScanned', len(candidate_rows))
+            scores = self.store.score(query_vector, candidate_rows)
+            top_indices = top_k_indices(scores, fetch_count)
+            row_ids, scores = candidate_rows[top_indices], scores[top_indices]
+
+        if self.rescores and len(row_ids):
+            trace_count('candidatesRescored', len(row_ids))
+            return self.rescore(query_vector, row_ids, k)
+        return row_ids, scores
+
+    def search_many(self,
+                    query_matrix: np.ndarray,
+                    k: int,
+                    document_names: list = None,
+                    start_date: datetime = None,
+                    end_date: datetime = None,
+                    current_only: bool = False) -> list[tuple[np.ndarray, np.ndarray]]:
+        # Exact top k for every row of query_matrix from a single matrix-matrix product
+        size = self.size
+        fetch_count = k * RESCORE_FACTOR if self.rescores else k
+        mask = self.filter_mask(size, document_names, start_date, end_date, current_only)
+        candidate_rows = None if mask is None else np.flatnonzero(mask)
+        if candidate_rows is not None and not len(candidate_rows):
+            return [(np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)) for _ in query_matrix]
+
+        scores = self.store.score_many(query_matrix, slice(0, size) if candidate_rows is None else candidate_rows)
+        results = []
+        for column, query_vector in enumerate(query_matrix):
+            top_indices = top_k_indices(scores[:, column], fetch_count)
+            row_ids = top_indices if candidate_rows is None else candidate_rows[top_indices]
+            if self.rescores and len(row_ids):
+                results.append(self.rescore(query_vector, row_ids, k))
+            else:
+                results.append((row_ids, scores[top_indices, column]))
+        return results
+
+
+class VectorIndex:
+    '''
+    Unit-normalized float32 chunk embeddings held in one contiguous matrix per client.
+    Exact search is a single matrix-vector product per partition; index_kind="hnsw"
+    additionally builds an hnswlib approximate nearest neighbour graph per partition.
+    storage="int8" or "pq" keeps only compressed codes resident; when a vector_loader
+    is given, the top candidates are rescored with their full precision vectors.
+    Subscribed to corpus_events, the index follows uploads and deletes incrementally.
+    section_count enables two-stage search over per-section centroids, current_only restricts
+    every search to the newest dated version of each document.
+    '''
+
+    def __init__(self,
+                 dimensions: int = VECTOR_DIMENSIONS,
+                 index_kind: str = "exact",
+                 hnsw_m: int = HNSW_M,
+                 hnsw_ef_construction: int = HNSW_EF_CONSTRUCTION,
+                 hnsw_ef_search: int = HNSW_EF_SEARCH,
+                 storage: str = "float32",
+                 vector_loader: Callable[[list[dict]], list] = None):
+        if index_kind not in ("exact", "hnsw"):
+            raise ValueError(f"Unsupported index kind '{index_kind}', expecting 'exact' or 'hnsw'")
+        if index_kind == "hnsw" and not HNSW_AVAILABLE:
+            raise ValueError("index_kind 'hnsw' needs the hnswlib package, install it with pip install hnswlib")
+        self.dimensions = dimensions
+        self.index_kind = index_kind
+        self.hnsw_params = {
+            'm': hnsw_m,
+            'ef_construction': hnsw_ef_construction,
+            'ef_search': hnsw_ef_search
+        }
+        self.storage = storage
+        self.vector_loader = vector_loader
+        self.partitions: dict[str, IndexPartition] = {}
+        self.write_lock = threading.Lock()
+        # Clients whose partition is being rebuilt in the background
+        self.rebuilding: set[str] = set()
+
+    def __len__(self):
+        return sum(len(partition) for partition in self.partitions.values())
+
+    @classmethod
+    def from_documents(cls, documents, dimensions: int = VECTOR_DIMENSIONS, **index_options) -> "VectorIndex":
+        vector_index = cls(dimensions, **index_options)
+        vector_index.add_documents(documents)
+        return vector_index
+
+    @classmethod
+    def from_snapshot(cls, snapshot, **index_options) -> "VectorIndex":
+        # float32 partitions are views into the memory-mapped matrix, nothing is copied at startup.
+        # Quantized partitions rescore against the mapping. Codes, quantizers and graphs are read back
+        # from the snapshot; the first worker to build them for this configuration saves them there.
+        index_options.setdefault('vector_loader', snapshot.get_vectors)
+        vector_index = cls(snapshot.dimensions or VECTOR_DIMENSIONS, **index_options)
+        saved_state = snapshot.read_index_state(vector_index.state_key) if vector_index.has_state else None
+        if saved_state is not None:
+            try:
+                vector_index.add_snapshot_rows(snapshot, saved_state)
+                return vector_index
+            except (KeyError, ValueError) as e:
+                print(f"WARNING: Saved index state in {snapshot.directory} does not match the snapshot, rebuilding: {e}")
+                vector_index = cls(snapshot.dimensions or VECTOR_DIMENSIONS, **index_options)
+        vector_index.add_snapshot_rows(snapshot)
+        if vector_index.has_state:
+            snapshot.write_index_state(vector_index.state_key, vector_index.get_state())
+        return vector_index
+
+    def add_snapshot_rows(self, snapshot, saved_state: dict = None):
+        for client_name, rows in snapshot.client_slices().items():
+            partition = self.get_or_create_partition(client_name)
+            partition.add(snapshot.records[rows], snapshot.vectors[rows], saved_state[client_name] if saved_state is not None else None)
+
+    @property
+    def has_state(self) -> bool:
+        # Exact float32 partitions derive nothing from the vectors
+        return self.index_kind == "hnsw" or self.storage != "float32"
+
+    @property
+    def state_key(self) -> str:
+        # Saved states are only read back by an index with the same configuration
+        key = f"{self.index_kind}-{self.storage}"
+        if self.index_kind == "hnsw":
+            key += f"-m{self.hnsw_params['m']}-ef{self.hnsw_params['ef_construction']}"
+        return key
+
+    def get_state(self) -> dict[str, dict]:
+        with self.write_lock:
+            return {client_name: partition.get_state() for client_name, partition in self.partitions.items()}
+
+    def add_documents(self, documents):
+        grouped_records: dict[str, list[dict]] = {}
+        grouped_vectors: dict[str, list] = {}
+        with self.write_lock:
+            for document in documents:
+                if not document.get('contentVector'):
+                    continue
+                client_name = unwrap_field(document['clientName'])
+                chunk_id = unwrap_field(document['id'])
+                partition = self.partitions.get(client_name)
+                if partition is not None and chunk_id in partition.row_by_id:
+                    continue
+                record = {key: value for key, value in document.items() if key not in ('_id', 'contentVector')}
+                grouped_records.setdefault(client_name, []).append(record)
+                grouped_vectors.setdefault(client_name, []).append(document['contentVector'])
+
+            for client_name, records in grouped_records.items():
+                partition = self.get_or_create_partition(client_name)
+                partition.add(records, normalize_vectors(grouped_vectors[client_name]))
+                if partition.needs_retraining:
+                    self.schedule_rebuild(client_name)
+
+    def remove_chunks(self, chunk_ids: list[str]) -> int:
+        removed_count = 0
+        with self.write_lock:
+            for client_name, partition in list(self.partitions.items()):
+                removed_count += partition.remove(chunk_ids)
+                if not len(partition):
+                    del self.partitions[client_name]
+                elif partition.deleted_count > COMPACTION_RATIO * partition.size:
+                    self.schedule_rebuild(client_name)
+        return removed_count
+
+    def schedule_rebuild(self, client_name: str):
+        # Called with write_lock held
+        if client_name not in self.rebuilding:
+            self.rebuilding.add(client_name)
+            get_compaction_executor().submit(self.rebuild_partition, client_name)
+
+    def rebuild_partition(self, client_name: str):
+        '''
+        Rebuilds the partition without its deleted rows, refitting a quantized partition's quantizer,
+        outside the write lock, then swaps it in after replaying the adds and deletes that arrived
+        meanwhile. Searches keep using the old partition, with deleted rows masked out, until the swap.
+        '''
+        try:
+            with self.write_lock:
+                partition = self.partitions.get(client_name)
+                if partition is None:
+                    return
+                keep = ~partition.deleted.data[:partition.size]
+            compacted = partition.compacted(keep)
+            with self.write_lock:
+                # Dropped, or emptied and recreated, while the copy was built
+                if self.partitions.get(client_name) is partition:
+                    compacted.catch_up(partition, keep)
+                    self.partitions[client_name] = compacted
+        except Exception as e:
+            print(f"ERROR: Unable to rebuild the vector index partition of {client_name}: {e}")
+        finally:
+            with self.write_lock:
+                self.rebuilding.discard(client_name)
+
+    def documents_added(self, documents: list[dict]):
+        self.add_documents(documents)
+
+    def documents_removed(self, chunk_ids: list[str]):
+        self.remove_chunks(chunk_ids)
+
+    def get_or_create_partition(self, client_name: str) -> IndexPartition:
+        partition = self.partitions.get(client_name)
+        if partition is None:
+            partition = IndexPartition(client_name, self.dimensions, self.index_kind, self.hnsw_params,
+                                       self.storage, self.vector_loader)
+            self.partitions[client_name] = partition
+        return partition
+
+    @property
+    def nbytes(self) -> int:
+        return sum(partition.store.nbytes + (partition.graph.nbytes if partition.graph is not None else 0)
+                   for partition in self.partitions.values())
+
+    def get_partitions(self, client_names: list = None) -> list[IndexPartition]:
+        if client_names is None:
+            return list(self.partitions.values())
+        return [self.partitions[name] for name in client_names if name in self.partitions]
+
+    def search(self,
+               query_embedding,
+               result_count: int,
+               client_names: list = None,
+               document_names: list = None,
+               start_date: datetime = None,
+               end_date: datetime = None,
+               exact: bool = False,
+               ef_search: int = None,
+               section_count: int = None,
+               current_only: bool = False) -> list[dict]:
+        query_vector = normalize_vectors(query_embedding)
+
+        partitions = self.get_partitions(client_names)
+        trace_entry('indexParameters', 'local', {
+            'indexKind': self.index_kind,
+            'storage': self.storage,
+            'exact': exact,
+            'efSearch': ef_search or self.hnsw_params['ef_search'],
+            'm': self.hnsw_params['m'],
+            'sectionCount': section_count,
+            'partitions': len(partitions)
+        })
+
+        def search_partition(partition: IndexPartition):
+            return partition.search(query_vector, result_count, document_names=document_names, start_date=start_date, end_date=end_date, exact=exact, ef_search=ef_search, section_count=section_count, current_only=current_only)
+
+        # Fan out across partitions only when there is enough work to outweigh the hand-off, and only
+        # for NumPy scans: filtered graph walks call back into Python for every row they visit
+        scans = exact or self.index_kind != "hnsw" or bool(section_count)
+        if scans and SEARCH_WORKERS > 1 and len(partitions) > 1 and sum(partition.size for partition in partitions) >= PARALLEL_SEARCH_MIN_ROWS:
+            # Each task runs in a copy of the caller's context so an explained request keeps its trace
+            futures = [get_search_executor().submit(contextvars.copy_context().run, search_partition, partition) for partition in partitions]
+            partition_results = [future.result() for future in futures]
+        else:
+            partition_results = [search_partition(partition) for partition in partitions]
+
+        return self.merge_partition_results(partitions, partition_results, result_count)
+
+    def search_many(self,
+                    query_embeddings,
+                    result_count: int,
+                    client_names: list = None,
+                    document_names: list = None,
+                    start_date: datetime = None,
+                    end_date: datetime = None,
+                    current_only: bool = False) -> list[list[dict]]:
+        '''
+        Exact search for a batch of queries, e.g. a whole questionnaire. Each partition scores
+        a block of queries with one matrix-matrix product instead of one product per query.
+        '''
+        query_matrix = normalize_vectors(query_embeddings)
+        partitions = self.get_partitions(client_names)
+        results = []
+        for start in range(0, query_matrix.shape[0], QUERY_BLOCK_SIZE):
+            query_block = query_matrix[start:start + QUERY_BLOCK_SIZE]
+
+            def search_partition(partition: IndexPartition):
+                return partition.search_many(query_block, result_count, document_names=document_names, start_date=start_date, end_date=end_date, current_only=current_only)
+
+            if SEARCH_WORKERS > 1 and len(partitions) > 1 and sum(partition.size for partition in partitions) >= PARALLEL_SEARCH_MIN_ROWS:
+                block_results = list(get_search_executor().map(search_partition, partitions))
+            else:
+                block_results = [search_partition(partition) for partition in partitions]
+
+            for query_index in range(query_block.shape[0]):
+                partition_results = [partition_result[query_index] for partition_result in block_results]
+                results.append(self.merge_partition_results(partitions, partition_results, result_count))
+        return results
+
+    @staticmethod
+    def merge_partition_results(partitions: list[IndexPartition], partition_results: list[tuple], result_count: int) -> list[dict]:
+        candidate_scores = []
+        candidate_records = []
+        for partition, (row_ids, scores) in zip(partitions, partition_results):
+            candidate_scores.append(scores)
+            candidate_records.extend(partition.records[row_id] for row_id in row_ids)
+
+        if not candidate_records:
+            return []
+
+        # Merge the per-partition top k lists into the overall top k
+        merged_scores = np.concatenate(candidate_scores)
+        results = []
+        for index in top_k_indices(merged_scores, result_count):
+            result = dict(candidate_records[index])
+            result['similarityScore'] = float(merged_scores[index])
+            results.append(result)
+        return results
+
+    def measure_recall(self, query_embeddings, result_count: int = 5, **search_options) -> float:
+        '''
+        Mean recall@result_count of the configured search against an exhaustive scan.
+        '''
+        recalls = []
+        for query_embedding in query_embeddings:
+            expected = {unwrap_field(result['id']) for result in self.search(query_embedding, result_count, exact=True, **search_options)}
+            if not expected:
+                continue
+            found = {unwrap_field(result['id']) for result in self.search(query_embedding, result_count, **search_options)}
+            recalls.append(len(expected & found) / len(expected))
+        return float(np.mean(recalls)) if recalls else 1.0
@@ -0,0 +1,302 @@
+from typing import Callable, Union
+
+import numpy as np
+
+from constants import (
+    PQ_SUBSPACES,
+    PQ_CENTROIDS,
+    PQ_TRAINING_ITERATIONS
+)
+
+# Rows scored per block so compressed codes are never expanded to float32 all at once
+SCORING_BLOCK_SIZE = 4096
+
+
+class RowBuffer:
+    '''
+    Append-only array with amortized O(1) appends. The first batch is kept as is
+    and only copied into a growable buffer on the first append after it.
+    '''
+
+    def __init__(self, row_shape: tuple, dtype):
+        self.data = np.empty((0, *row_shape), dtype=dtype)
+        self.size = 0
+
+    def __len__(self):
+        return self.size
+
+    @property
+    def rows(self) -> np.ndarray:
+        return self.data[:self.size]
+
+    def append(self, rows: np.ndarray):
+        needed = self.size + rows.shape[0]
+        if self.size == 0 and self.data.shape[0] == 0:
+            self.data = rows
+        else:
+            if needed > self.data.shape[0] or not self.data.flags.writeable:
+                grown = np.empty((max(needed, 2 * self.data.shape[0], 64), *self.data.shape[1:]), dtype=self.data.dtype)
+                grown[:self.size] = self.data[:self.size]
+                self.data = grown
+            self.data[self.size:needed] = rows
+        self.size = needed
+
+    def compacted(self, keep: np.ndarray) -> "RowBuffer":
+        # keep covers the first len(keep) rows, rows appended since are left out
+        buffer = RowBuffer(self.data.shape[1:], self.data.dtype)
+        buffer.append(self.data[:keep.shape[0]][keep])
+        return buffer
+
+
+class Float32VectorStore:
+    '''
+    The first batch is kept as given, typically a read-only slice of the memory-mapped snapshot that every
+    worker shares through the page cache. Rows added after it go to a private tail, so the base is never copied.
+    '''
+    is_lossy = False
+
+    def __init__(self, dimensions: int):
+        self.dimensions = dimensions
+        self.base = np.empty((0, dimensions), dtype=np.float32)
+        self.tail = RowBuffer((dimensions,), np.float32)
+
+    def __len__(self):
+        return self.base.shape[0] + len(self.tail)
+
+    @property
+    def nbytes(self) -> int:
+        return self.base.nbytes + self.tail.rows.nbytes
+
+    def add(self, vectors: np.ndarray):
+        if len(self) == 0:
+            self.base = vectors
+        else:
+            self.tail.append(vectors)
+
+    def get_state(self) -> dict:
+        # The vectors themselves are the snapshot, there is nothing derived to save
+        return {}
+
+    def load_state(self, state: dict, vectors: np.ndarray):
+        self.add(vectors)
+
+    def compact(self, keep: np.ndarray):
+        # The kept rows become a private base, the mapped one is left to the partition being replaced
+        self.base = self.get(np.flatnonzero(keep))
+        self.tail = RowBuffer((self.dimensions,), np.float32)
+
+    def apply(self, function: Callable[[np.ndarray], np.ndarray], row_ids: Union[np.ndarray, slice] = None) -> np.ndarray:
+        # function of the selected rows, evaluated on the base and the tail separately so neither is copied whole
+        base_size = self.base.shape[0]
+        if not len(self.tail):
+            return function(self.base if row_ids is None else self.base[row_ids])
+        if row_ids is None or isinstance(row_ids, slice):
+            start, stop, _ = (row_ids or slice(None)).indices(len(self))
+            return np.concatenate([function(self.base[start:max(min(stop, base_size), start)]),
+                                   function(self.tail.rows[max(start - base_size, 0):max(stop - base_size, 0)])])
+        row_ids = np.asarray(row_ids)
+        in_base = row_ids < base_size
+        base_result = function(self.base[row_ids[in_base]])
+        tail_result = function(self.tail.rows[row_ids[~in_base] - base_size])
+        result = np.empty((len(row_ids), *base_result.shape[1:]), dtype=np.result_type(base_result, tail_result))
+        result[in_base] = base_result
+        result[~in_base] = tail_result
+        return result
+
+    def get(self, row_ids: np.ndarray) -> np.ndarray:
+        return self.apply(lambda vectors: vectors, row_ids)
+
+    def score(self, query_vector: np.ndarray, row_ids: Union[np.ndarray, slice] = None) -> np.ndarray:
+        return self.apply(lambda vectors: vectors @ query_vector, row_ids)
+
+    def score_many(self, query_matrix: np.ndarray, row_ids: Union[np.ndarray, slice] = None) -> np.ndarray:
+        # (rows, queries) scores from one matrix-matrix product per part
+        return self.apply(lambda vectors: vectors @ query_matrix.T, row_ids)
+
+
+class Int8VectorStore:
+    '''
+    Symmetric per-dimension scalar quantization, one signed byte per component (4x smaller than float32).
+    The scale is fitted on the first batch added unless trained beforehand; later components outside it
+    are clipped until the owning partition refits it.
+    '''
+    is_lossy = True
+
+    def __init__(self, dimensions: int):
+        self.dimensions = dimensions
+        self.scale = None
+        self.buffer = RowBuffer((dimensions,), np.int8)
+
+    def __len__(self):
+        return len(self.buffer)
+
+    @property
+    def codes(self) -> np.ndarray:
+        return self.buffer.rows
+
+    @property
+    def nbytes(self) -> int:
+        return self.codes.nbytes + (self.scale.nbytes if self.scale is not None else 0)
+
+    def train(self, vectors: np.ndarray):
+        max_abs = np.abs(vectors).max(axis=0)
+        max_abs[max_abs == 0] = 1.0
+        self.scale = (max_abs / 127).astype(np.float32)
+
+    def encode(self, vectors: np.ndarray) -> np.ndarray:
+        return np.clip(np.rint(vectors / self.scale), -127, 127).astype(np.int8)
+
+    def add(self, vectors: np.ndarray):
+        if self.scale is None:
+            self.train(vectors)
+        self.buffer.append(self.encode(vectors))
+
+    def get_state(self) -> dict:
+        return {'scale': self.scale, 'codes': self.codes}
+
+    def load_state(self, state: dict, vectors: np.ndarray):
+        # Scale and codes saved by get_state for these vectors, nothing is fitted or encoded again
+        if state['codes'].shape != (vectors.shape[0], self.dimensions):
+            raise ValueError(f"Saved int8 codes {state['codes'].shape} do not match {vectors.shape[0]} vectors of {self.dimensions} dimensions")
+        self.scale = state['scale']
+        self.buffer.append(state['codes'])
+
+    def compact(self, keep: np.ndarray):
+        self.buffer = self.buffer.compacted(keep)
+
+    def get(self, row_ids: np.ndarray) -> np.ndarray:
+        return self.codes[row_ids].astype(np.float32) * self.scale
+
+    def score(self, query_vector: np.ndarray, row_ids: Union[np.ndarray, slice] = None) -> np.ndarray:
+        # (codes * scale) . q == codes . (scale * q), so the codes are never dequantized
+        scaled_query = self.scale * query_vector
+        codes = self.codes if row_ids is None else self.codes[row_ids]
+        scores = np.empty(codes.shape[0], dtype=np.float32)
+        for start in range(0, codes.shape[0], SCORING_BLOCK_SIZE):
+            block = codes[start:start + SCORING_BLOCK_SIZE]
+            scores[start:start + block.shape[0]] = block.astype(np.float32) @ scaled_query
+        return scores
+
+    def score_many(self, query_matrix: np.ndarray, row_ids: Union[np.ndarray, slice] = None) -> np.ndarray:
+        scaled_queries = (query_matrix * self.scale).T
+        codes = self.codes if row_ids is None else self.codes[row_ids]
+        scores = np.empty((codes.shape[0], query_matrix.shape[0]), dtype=np.float32)
+        for start in range(0, codes.shape[0], SCORING_BLOCK_SIZE):
+            block = codes[start:start + SCORING_BLOCK_SIZE]
+            scores[start:start + block.shape[0]] = block.astype(np.float32) @ scaled_queries
+        return scores
+
+
+class ProductQuantizedVectorStore:
+    '''
+    Product quantization: the vector is split into subspaces and each sub-vector is
+    replaced by the index of its nearest k-means centroid (one byte per subspace).
+    Scores are asymmetric distance lookups into a per-query table of centroid dot products.
+    Codebooks are trained on the first batch added unless trained beforehand, and refitted by the owning partition as it grows.
+    '''
+    is_lossy = True
+
+    def __init__(self, dimensions: int, subspaces: int = PQ_SUBSPACES, centroids: int = PQ_CENTROIDS, iterations: int = PQ_TRAINING_ITERATIONS, seed: int = 42):
+        if dimensions % subspaces != 0:
+            raise ValueError(f"Vector dimensions {dimensions} must be divisible by the number of PQ subspaces {subspaces}")
+        if centroids > 256:
+            raise ValueError("PQ codes are stored as single bytes, at most 256 centroids are supported")
+        self.dimensions = dimensions
+        self.subspaces = subspaces
+        self.subspace_dimensions = dimensions // subspaces
+        self.centroid_count = centroids
+        self.iterations = iterations
+        self.rng = np.random.default_rng(seed)
+        self.codebooks = None
+        self.buffer = RowBuffer((subspaces,), np.uint8)
+
+    def __len__(self):
+        return len(self.buffer)
+
+    @property
+    def codes(self) -> np.ndarray:
+        return self.buffer.rows
+
+    @property
+    def nbytes(self) -> int:
+        return self.codes.nbytes + (self.codebooks.nbytes if self.codebooks is not None else 0)
+
+    def split(self, vectors: np.ndarray) -> np.ndarray:
+        # (n, dimensions) -> (subspaces, n, subspace_dimensions)
+        return vectors.reshape(vectors.shape[0], self.subspaces, self.subspace_dimensions).transpose(1, 0, 2)
+
+    def train(self, vectors: np.ndarray):
+        sub_vectors = self.split(vectors)
+        centroid_count = min(self.centroid_count, vectors.shape[0])
+        self.codebooks = np.empty((self.subspaces, centroid_count, self.subspace_dimensions), dtype=np.float32)
+        for subspace in range(self.subspaces):
+            points = sub_vectors[subspace]
+            centroids = points[self.rng.choice(points.shape[0], centroid_count, replace=False)].copy()
+            for _ in range(self.iterations):
+                assignments = self.nearest_centroids(points, centroids)
+                sums = np.zeros_like(centroids)
+                np.add.at(sums, assignments, points)
+                counts = np.bincount(assignments, minlength=centroid_count)
+                occupied = counts > 0
+                centroids[occupied] = sums[occupied] / counts[occupied, None]
+            self.codebooks[subspace] = centroids
+
+    @staticmethod
+    def nearest_centroids(points: np.ndarray, centroids: np.ndarray) -> np.ndarray:
+        distances = (centroids ** 2).sum(axis=1) - 2 * points @ centroids.T
+        return distances.argmin(axis=1)
+
+    def encode(self, vectors: np.ndarray) -> np.ndarray:
+        sub_vectors = self.split(vectors)
+        codes = np.empty((vectors.shape[0], self.subspaces), dtype=np.uint8)
+        for subspace in range(self.subspaces):
+            codes[:, subspace] = self.nearest_centroids(sub_vectors[subspace], self.codebooks[subspace])
+        return codes
+
+    def add(self, vectors: np.ndarray):
+        if self.codebooks is None:
+            self.train(vectors)
+        self.buffer.append(self.encode(vectors))
+
+    def get_state(self) -> dict:
+        return {'codebooks': self.codebooks, 'codes': self.codes}
+
+    def load_state(self, state: dict, vectors: np.ndarray):
+        # Codebooks and codes saved by get_state for these vectors, k-means is not run again
+        if state['codes'].shape != (vectors.shape[0], self.subspaces) or state['codebooks'].shape[0] != self.subspaces:
+            raise ValueError(f"Saved PQ codes {state['codes'].shape} do not match {vectors.shape[0]} vectors of {self.subspaces} subspaces")
+        self.codebooks = state['codebooks']
+        self.buffer.append(state['codes'])
+
+    def compact(self, keep: np.ndarray):
+        self.buffer = self.buffer.compacted(keep)
+
+    def get(self, row_ids: np.ndarray) -> np.ndarray:
+        codes = self.codes[row_ids]
+        reconstructed = self.codebooks[np.arange(self.subspaces), codes]
+        return reconstructed.reshape(codes.shape[0], self.dimensions)
+
+    def score(self, query_vector: np.ndarray, row_ids: Union[np.ndarray, slice] = None) -> np.ndarray:
+        # lookup_table[s, c] is the dot product of the query's sub-vector s with centroid c
+        lookup_table = np.einsum('scd,sd->sc', self.codebooks, query_vector.reshape(self.subspaces, self.subspace_dimensions))
+        codes = self.codes if row_ids is None else self.codes[row_ids]
+        subspace_ids = np.arange(self.subspaces)
+        scores = np.empty(codes.shape[0], dtype=np.float32)
+        for start in range(0, codes.shape[0], SCORING_BLOCK_SIZE):
+            block = codes[start:start + SCORING_BLOCK_SIZE]
+            scores[start:start + block.shape[0]] = lookup_table[subspace_ids, block].sum(axis=1)
+        return scores
+
+    def score_many(self, query_matrix: np.ndarray, row_ids: Union[np.ndarray, slice] = None) -> np.ndarray:
+        # Lookups are per query; gathering every query's table at once would need rows * queries * subspaces floats
+        return np.stack([self.score(query_vector, row_ids) for query_vector in query_matrix], axis=1)
+
+
+def create_vector_store(storage: str, dimensions: int):
+    if storage == "float32":
+        return Float32VectorStore(dimensions)
+    if storage == "int8":
+        return Int8VectorStore(dimensions)
+    if storage == "pq":
+        return ProductQuantizedVectorStore(dimensions)
+    raise ValueError(f"Unsupported vector storage '{storage}', expecting 'float32', 'int8' or 'pq'")
@@ -0,0 +1,39 @@
+from datetime import datetime
+
+import numpy as np
+
+
+def unwrap_field(value):
+    # Chunk fields are stored as single element arrays, e.g. clientName: ['CIBC']
+    if isinstance(value, (list, tuple)):
+        return value[0] if value else None
+    return value
+
+
+def to_datetime64(value) -> np.datetime64:
+    value = unwrap_field(value)
+    if isinstance(value, str):
+        value = datetime.strptime(value, '%Y-%m-%d %H:%M:%S')
+    return np.datetime64(value, 'us') if value is not None else np.datetime64('NaT', 'us')
+
+
+def normalize_vectors(vectors) -> np.ndarray:
+    matrix = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+def top_k_indices(scores: np.ndarray, k: int) -> np.ndarray:
+    '''
+    Indices of the k highest scores in descending order.
+    argpartition keeps this O(n) instead of sorting every candidate.
+    '''
+    k = min(k, scores.shape[0])
+    if k <= 0:
+        return np.empty(0, dtype=np.int64)
+    if k < scores.shape[0]:
+        candidates = np.argpartition(-scores, k - 1)[:k]
+    else:
+        candidates = np.arange(scores.shape[0])
+    return candidates[np.argsort(-scores[candidates], kind="stable")]